@@ -130,19 +130,71 @@ CELERY_BROKER_CONNECTION_TIMEOUT = 30
 CELERY_TASK_ALWAYS_EAGER = True
 CELERY_TASK_EAGER_PROPAGATES = True
 
+# Окремі черги під тип навантаження; DAG-стадії маршрутизуються явно (tasks.SYNC_STAGES)
+CELERY_TASK_DEFAULT_QUEUE = "celery"
+CELERY_TASK_ROUTES = {
+    "ads_sync.sf_pubsub_*": {"queue": "pubsub"},
+    "ads_sync.pull_*": {"queue": "ga-read"},
+    "ads_sync.snapshot_*": {"queue": "ga-read"},
+    "ads_sync.reconcile": {"queue": "ga-read"},
+    "ads_sync.push_*": {"queue": "ga-write"},
+}
+
 CELERY_BEAT_SCHEDULE = {
     "sync-google-ads-regular": {
-        "task": "ads_sync.tasks.sync_google_ads_pipeline",
+        "task": "ads_sync.sync_google_ads_pipeline",
         "schedule": 60 * 15,
-        "options": {"queue": "sync"},
     },
     "sync-google-ads-nightly": {
-        "task": "ads_sync.tasks.nightly_full_reconcile",
+        "task": "ads_sync.nightly_full_reconcile",
+        "schedule": 60 * 60 * 24,
+    },
+    "reap-pending-change-leases": {
+        "task": "ads_sync.reap_pending_change_leases",
+        "schedule": 60,
+    },
+    "maintain-partitions": {
+        "task": "ads_sync.maintain_partitions",
         "schedule": 60 * 60 * 24,
-        "options": {"queue": "sync"},
     },
 }
 
+# PendingChange work queue (lease / retry)
+PENDING_CHANGE_LEASE_SECONDS = int(os.getenv("PENDING_CHANGE_LEASE_SECONDS", 300))
+PENDING_CHANGE_MAX_ATTEMPTS = int(os.getenv("PENDING_CHANGE_MAX_ATTEMPTS", 5))
+PENDING_CHANGE_RETRY_BASE_SECONDS = int(os.getenv("PENDING_CHANGE_RETRY_BASE_SECONDS", 30))
+PENDING_CHANGE_CLAIM_HORIZON_DAYS = int(os.getenv("PENDING_CHANGE_CLAIM_HORIZON_DAYS", 14))
+# Priority lanes: 0 = high, 1 = normal, 2 = low ("resource.action", "resource.*", "*.action")
+PENDING_CHANGE_PRIORITIES = {
+    "campaign.pause": 0,
+    "campaign.remove": 0,
+    "campaign.enable": 1,
+    "campaign.create": 1,
+    "campaign.update": 2,
+    "lead.*": 1,
+    "opportunity.retract": 1,
+    "opportunity.*": 2,
+}
+# share of every claimed batch per priority (weighted fair — low is never starved)
+PENDING_CHANGE_PRIORITY_WEIGHTS = {0: 6, 1: 3, 2: 1}
+
+# Partitioning / retention (python manage.py manage_partitions --convert)
+SF_EVENT_PARTITION_INTERVAL = os.getenv("SF_EVENT_PARTITION_INTERVAL", "day")  # day | month
+SF_EVENT_RETENTION_DAYS = int(os.getenv("SF_EVENT_RETENTION_DAYS", 30))
+# SalesforceEvent history → PendingChange (python manage.py reprocess_events --since ... --dry-run)
+REPROCESS_CHUNK_SIZE = int(os.getenv("REPROCESS_CHUNK_SIZE", 2000))
+REPROCESS_WORKERS = int(os.getenv("REPROCESS_WORKERS", 4))
+
+# Daily campaign metrics (nightly stage pull_campaign_metrics → ga_campaign_daily_metric)
+CAMPAIGN_METRICS_CUSTOMER_IDS = [c.strip() for c in os.getenv("CAMPAIGN_METRICS_CUSTOMER_IDS", "").split(",") if c.strip()]
+CAMPAIGN_METRICS_LOOKBACK_DAYS = int(os.getenv("CAMPAIGN_METRICS_LOOKBACK_DAYS", 14))
+CAMPAIGN_METRICS_WORKERS = int(os.getenv("CAMPAIGN_METRICS_WORKERS", 4))
+CAMPAIGN_METRICS_PARTITION_INTERVAL = os.getenv("CAMPAIGN_METRICS_PARTITION_INTERVAL", "month")  # day | month
+CAMPAIGN_METRICS_RETENTION_DAYS = int(os.getenv("CAMPAIGN_METRICS_RETENTION_DAYS", 0))  # 0 = keep
+PENDING_CHANGE_PARTITION_INTERVAL = os.getenv("PENDING_CHANGE_PARTITION_INTERVAL", "month")
+PENDING_CHANGE_RETENTION_DAYS = int(os.getenv("PENDING_CHANGE_RETENTION_DAYS", 90))
+PARTITION_ARCHIVE_DIR = os.getenv("PARTITION_ARCHIVE_DIR", "")  # empty = drop without archive
+
 # Celery / Brokers
 
 RABBITMQ_DEFAULT_USER = os.getenv("RABBITMQ_DEFAULT_USER")
@@ -165,3 +217,69 @@ SF_DOMAIN = os.getenv("SF_DOMAIN", "login")  # Or 'test' for sandbox
 
 # Pub/Sub gRPC endpoint
 SF_PUBSUB_ENDPOINT = os.getenv("SF_PUBSUB_ENDPOINT", "pubsub.salesforce.com:443")
+
+# ExternalIdMap resolver cache (SF <-> GA ids)
+ID_MAP_LRU_SIZE = int(os.getenv("ID_MAP_LRU_SIZE", 50000))
+ID_MAP_LRU_TTL = int(os.getenv("ID_MAP_LRU_TTL", 300))
+ID_MAP_REDIS_URL = os.getenv("ID_MAP_REDIS_URL", "")  # e.g. redis://redis:6379/2; empty = LRU only
+ID_MAP_REDIS_TTL = int(os.getenv("ID_MAP_REDIS_TTL", 60 * 60 * 24))
+
+# Nightly reconciliation
+RECONCILE_PARTITIONS = int(os.getenv("RECONCILE_PARTITIONS", 64))
+SF_LEAD_GCLID_FIELD = os.getenv("SF_LEAD_GCLID_FIELD", "GCLID__c")
+# Opportunity → conversion adjustments (restate on Amount change, retract on these stages / delete)
+SF_OPPORTUNITY_RETRACT_STAGES = [s.strip() for s in os.getenv("SF_OPPORTUNITY_RETRACT_STAGES", "Closed Lost").split(",") if s.strip()]
+
+# Shared API rate limits ("qps/burst"; empty = unlimited). Redis makes them cluster-wide.
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "")  # e.g. redis://redis:6379/3
+RATE_LIMIT_MAX_WAIT_SECONDS = float(os.getenv("RATE_LIMIT_MAX_WAIT_SECONDS", 120))
+GA_RATE_DEVELOPER_TOKEN = os.getenv("GA_RATE_DEVELOPER_TOKEN", "")  # e.g. "20/40"
+GA_RATE_CUSTOMER = os.getenv("GA_RATE_CUSTOMER", "")  # e.g. "5/10"
+GA_QUOTA_MAX_RETRIES = int(os.getenv("GA_QUOTA_MAX_RETRIES", 3))
+GA_QUOTA_DEFAULT_DELAY = float(os.getenv("GA_QUOTA_DEFAULT_DELAY", 30))
+# GAQL streams as raw protobuf (no proto-plus wrappers); compare: manage.py benchmark_ga_stream
+GA_RAW_STREAM = os.getenv("GA_RAW_STREAM", "false").lower() in ("1", "true", "yes")
+SF_RATE_ORG = os.getenv("SF_RATE_ORG", "")  # e.g. "10/25"
+SF_LIMIT_MAX_RETRIES = int(os.getenv("SF_LIMIT_MAX_RETRIES", 3))
+SF_LIMIT_DEFAULT_DELAY = float(os.getenv("SF_LIMIT_DEFAULT_DELAY", 60))
+
+# Adaptive (AIMD) push batching: batch size / in-flight mutate requests per customer
+PUSH_MIN_BATCH = int(os.getenv("PUSH_MIN_BATCH", 10))
+PUSH_MAX_BATCH = int(os.getenv("PUSH_MAX_BATCH", 2000))
+PUSH_MAX_CONCURRENCY = int(os.getenv("PUSH_MAX_CONCURRENCY", 8))
+PUSH_TARGET_LATENCY_MS = float(os.getenv("PUSH_TARGET_LATENCY_MS", 5000))
+PUSH_MAX_FAILURE_RATE = float(os.getenv("PUSH_MAX_FAILURE_RATE", 0.2))
+PUSH_LANES = int(os.getenv("PUSH_LANES", PUSH_MAX_CONCURRENCY))  # key-partitioned ordered lanes
+
+# Pipeline run lock (lease + heartbeat). Same group = never overlap for one customer.
+RUN_LOCK_LEASE_SECONDS = int(os.getenv("RUN_LOCK_LEASE_SECONDS", 900))
+RUN_LOCK_GROUPS = {"sync_google_ads": "ga-sync", "nightly_full_reconcile": "ga-sync"}
+RUN_LOCK_POLICIES = {  # skip | queue | coalesce
+    "sync_google_ads": os.getenv("RUN_LOCK_POLICY_SYNC", "coalesce"),
+    "nightly_full_reconcile": os.getenv("RUN_LOCK_POLICY_NIGHTLY", "queue"),
+}
+RUN_LOCK_QUEUE_RETRY_SECONDS = int(os.getenv("RUN_LOCK_QUEUE_RETRY_SECONDS", 60))
+RUN_LOCK_QUEUE_MAX_RETRIES = int(os.getenv("RUN_LOCK_QUEUE_MAX_RETRIES", 30))
+
+# Event-driven push: PendingChange INSERT → NOTIFY → listen_pending_changes
+PENDING_CHANGE_NOTIFY_CHANNEL = os.getenv("PENDING_CHANGE_NOTIFY_CHANNEL", "pending_change")
+PENDING_CHANGE_NOTIFY_DEBOUNCE_MS = int(os.getenv("PENDING_CHANGE_NOTIFY_DEBOUNCE_MS", 500))
+
+# Pub/Sub subscriber catch-up: lag (commitTimestamp → now) понад поріг = pipelined fetch + bulk writes
+PUBSUB_CATCHUP_LAG_SECONDS = float(os.getenv("PUBSUB_CATCHUP_LAG_SECONDS", 300))
+PUBSUB_CATCHUP_OUTSTANDING = int(os.getenv("PUBSUB_CATCHUP_OUTSTANDING", 5))  # FetchRequest × 100 подій
+PUBSUB_CATCHUP_CHUNK = int(os.getenv("PUBSUB_CATCHUP_CHUNK", 1000))
+PUBSUB_DECODE_WORKERS = int(os.getenv("PUBSUB_DECODE_WORKERS", 4))
+PUBSUB_LANES = int(os.getenv("PUBSUB_LANES", 4))  # ordered write lanes (hash SF record Id)
+
+# HTTP ingest (Outbound Messages / Flow callouts) → batched SalesforceEvent + PendingChange
+INGEST_TOKEN = os.getenv("INGEST_TOKEN", "")  # порожній = endpoints закриті (403)
+INGEST_ALLOWED_ORG_IDS = [o.strip() for o in os.getenv("INGEST_ALLOWED_ORG_IDS", "").split(",") if o.strip()]
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 500))
+INGEST_FLUSH_MS = int(os.getenv("INGEST_FLUSH_MS", 50))
+INGEST_MAX_PENDING = int(os.getenv("INGEST_MAX_PENDING", 20000))
+INGEST_DURABLE_ACK = os.getenv("INGEST_DURABLE_ACK", "true").lower() in ("1", "true", "yes")
+
+# Conversion upload idempotency (ConversionKey + in-process LRU of uploaded keys)
+IDEMPOTENCY_LRU_SIZE = int(os.getenv("IDEMPOTENCY_LRU_SIZE", 100000))
+IDEMPOTENCY_RETENTION_DAYS = int(os.getenv("IDEMPOTENCY_RETENTION_DAYS", 100))
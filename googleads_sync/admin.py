@@ -1,3 +1,114 @@
-from django.contrib import admin
+from datetime import timedelta
 
-# Register your models here.
+from django.contrib import admin, messages
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils import timezone as djtz
+
+from .models import DeadLetter, PendingChange, SyncLatency, SyncRun, SyncStageRun
+from .services import dead_letter, latency, sync_runs
+
+
+@admin.register(DeadLetter)
+class DeadLetterAdmin(admin.ModelAdmin):
+    list_display = ("id", "created_at", "resource", "action", "error_code", "attempts", "status", "pending_change_id")
+    list_filter = ("status", "resource", "action", "error_code", ("created_at", admin.DateFieldListFilter))
+    search_fields = ("error_code", "error_message", "=pending_change_id")
+    readonly_fields = [f.name for f in DeadLetter._meta.fields]
+    date_hierarchy = "created_at"
+    actions = ("replay_selected", "discard_selected")
+
+    @admin.action(description="Re-queue selected (new PendingChange rows)")
+    def replay_selected(self, request, queryset):
+        counts = dead_letter.replay(queryset)
+        self.message_user(request, f"Re-queued {sum(counts.values())}: {counts}", messages.SUCCESS)
+
+    @admin.action(description="Discard selected")
+    def discard_selected(self, request, queryset):
+        n = dead_letter.discard(queryset.filter(status=dead_letter.STATUS_OPEN))
+        self.message_user(request, f"Discarded {n}", messages.SUCCESS)
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(SyncLatency)
+class SyncLatencyAdmin(admin.ModelAdmin):
+    def get_urls(self):
+        return [path("", self.admin_site.admin_view(self.report_view), name="googleads_sync_synclatency_changelist")]
+
+    def report_view(self, request):
+        hours = int(request.GET.get("hours") or 24)
+        resource = request.GET.get("resource") or None
+        until = djtz.now()
+        rows = latency.report(since=until - timedelta(hours=hours), until=until, resource=resource)
+        stages = []
+        for stage, _start, _end in latency.STAGES:
+            stage_rows = [r for r in rows if r["stage"] == stage]
+            if stage_rows:
+                stages.append((stage, stage_rows))
+        context = {
+            **self.admin_site.each_context(request),
+            "title": "Sync latency (SF commit → GA applied)",
+            "opts": self.model._meta,
+            "hours": hours,
+            "resource": resource or "",
+            "resources": PendingChange.RESOURCES,
+            "stages": stages,
+        }
+        return TemplateResponse(request, "admin/googleads_sync/latency_report.html", context)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+class SyncStageRunInline(admin.TabularInline):
+    model = SyncStageRun
+    extra = 0
+    can_delete = False
+    fields = ("stage", "queue", "started_at", "duration_ms", "rows_in", "rows_out", "api_calls", "errors", "bytes", "error")
+    readonly_fields = fields
+
+
+@admin.register(SyncRun)
+class SyncRunAdmin(admin.ModelAdmin):
+    list_display = ("run_id", "pipeline", "status", "started_at", "duration_seconds", "rows_in", "rows_out", "api_calls", "errors")
+    list_filter = ("pipeline", "status", ("started_at", admin.DateFieldListFilter))
+    search_fields = ("=run_id",)
+    date_hierarchy = "started_at"
+    readonly_fields = [f.name for f in SyncRun._meta.fields]
+    inlines = (SyncStageRunInline,)
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(SyncStageRun)
+class SyncStageRunAdmin(admin.ModelAdmin):
+    list_display = ("run", "stage", "started_at", "duration_ms", "rows_out", "rows_per_second", "api_calls", "errors", "bytes")
+    list_filter = ("stage", "run__pipeline", ("started_at", admin.DateFieldListFilter))
+    date_hierarchy = "started_at"
+    readonly_fields = [f.name for f in SyncStageRun._meta.fields]
+    change_list_template = "admin/googleads_sync/syncstagerun/change_list.html"
+
+    def changelist_view(self, request, extra_context=None):
+        # trend — не фільтр changelist-а, прибираємо до super() (інакше ?e=1)
+        params = request.GET.copy()
+        bucket = "hour" if params.pop("trend", ["day"])[-1] == "hour" else "day"
+        request.GET = params
+        since = djtz.now() - (timedelta(days=2) if bucket == "hour" else timedelta(days=30))
+        extra_context = {
+            **(extra_context or {}),
+            "trend_bucket": bucket,
+            "trend": sync_runs.throughput(stage=request.GET.get("stage") or None, since=since, bucket=bucket),
+        }
+        return super().changelist_view(request, extra_context=extra_context)
+
+    def has_add_permission(self, request):
+        return False
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class GoogleadsSyncConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'googleads_sync'
+
+    def ready(self):
+        # write-through кешу ExternalIdMap (post_save / post_delete)
+        from .services import id_resolver  # noqa: F401
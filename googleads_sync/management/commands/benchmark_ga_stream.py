@@ -0,0 +1,90 @@
+# benchmark_ga_stream.py
+import time
+
+from django.core.management.base import BaseCommand
+from google.ads.googleads.client import GoogleAdsClient
+
+from googleads_sync.services.mappers import (
+    campaign_pb_to_dict,
+    campaign_row_to_dict,
+    campaign_snapshot_pb_to_dict,
+    campaign_snapshot_row_to_dict,
+)
+
+BATCH_ROWS = 10000  # приблизно стільки рядків GA кладе в один SearchGoogleAdsStreamResponse
+
+
+def _stream_blobs(client: GoogleAdsClient, n: int):
+    """Серіалізовані SearchGoogleAdsStreamResponse — як вони приходять по gRPC."""
+    response_type = type(client.get_type("SearchGoogleAdsStreamResponse"))
+    row_type = type(client.get_type("GoogleAdsRow"))
+    status = client.enums.CampaignStatusEnum
+    channel = client.enums.AdvertisingChannelTypeEnum
+    blobs = []
+    for start in range(0, n, BATCH_ROWS):
+        resp = response_type()
+        for i in range(start, min(start + BATCH_ROWS, n)):
+            row = row_type()
+            c = row.campaign
+            c.resource_name = f"customers/1/campaigns/{i}"
+            c.id = i
+            c.name = f"Campaign {i}"
+            c.status = status.ENABLED if i % 3 else status.PAUSED
+            c.advertising_channel_type = channel.SEARCH
+            c.start_date = "2025-01-01"
+            c.campaign_budget = f"customers/1/campaignBudgets/{i}"
+            row.campaign_budget.amount_micros = 1000000 + i
+            resp.results.append(row)
+        blobs.append(response_type.serialize(resp))
+    return response_type, blobs
+
+
+class Command(BaseCommand):
+    help = "GAQL stream decode + mapping: proto-plus vs raw protobuf (synthetic campaign rows, no API calls)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=100000)
+        parser.add_argument("--repeat", type=int, default=3, help="Best of N runs per mode.")
+
+    def _run(self, label, fn, blobs, rows, repeat):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            fn(blobs)
+            took = time.perf_counter() - started
+            best = took if best is None else min(best, took)
+        self.stdout.write(f"{label:36} {rows:>8} rows  {best:7.3f}s  {rows / best:>12,.0f} rows/s")
+        return best
+
+    def handle(self, *args, **opts):
+        n = opts["rows"]
+        # get_type / serialize не ходять у мережу — credentials не потрібні
+        client = GoogleAdsClient(credentials=None, developer_token="benchmark", use_proto_plus=True)
+        response_type, blobs = _stream_blobs(client, n)
+        raw_type = response_type.pb()
+        self.stdout.write(f"{len(blobs)} batches, {sum(map(len, blobs)):,} bytes")
+
+        def proto_plus(mapper):
+            def run(blobs):
+                for blob in blobs:
+                    for row in response_type.deserialize(blob).results:
+                        mapper(row)
+            return run
+
+        def raw(mapper):
+            def run(blobs):
+                for blob in blobs:
+                    for row in raw_type.FromString(blob).results:
+                        mapper(row)
+            return run
+
+        for name, row_mapper, pb_mapper in (
+            ("Campaign", campaign_row_to_dict, campaign_pb_to_dict),
+            ("campaign snapshot", campaign_snapshot_row_to_dict, campaign_snapshot_pb_to_dict),
+        ):
+            # обидва режими мають давати ті самі dict-и (інакше snapshot hash-і "зміняться")
+            if row_mapper(response_type.deserialize(blobs[0]).results[0]) != pb_mapper(raw_type.FromString(blobs[0]).results[0]):
+                self.stdout.write(self.style.WARNING(f"{name}: proto-plus and raw mappers disagree"))
+            plus = self._run(f"{name} (proto-plus)", proto_plus(row_mapper), blobs, n, opts["repeat"])
+            fast = self._run(f"{name} (raw protobuf)", raw(pb_mapper), blobs, n, opts["repeat"])
+            self.stdout.write(f"speedup: {plus / fast:.2f}x")
@@ -0,0 +1,43 @@
+# listen_pending_changes.py
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, InterfaceError, OperationalError
+
+from googleads_sync.services import notify
+from googleads_sync.tasks import push_adjustment_changes_task, push_campaign_changes_task, push_lead_changes_task
+
+PUSH_TASKS = {
+    "campaign": push_campaign_changes_task,
+    "lead": push_lead_changes_task,
+    "opportunity": push_adjustment_changes_task,
+}
+
+
+class Command(BaseCommand):
+    help = "LISTEN for PendingChange inserts and dispatch a push for each affected resource (debounced)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--debounce-ms", type=int, default=notify.DEBOUNCE_MS)
+        parser.add_argument("--no-install", action="store_true", help="Do not (re)install the NOTIFY trigger.")
+
+    def dispatch(self, resources):
+        for resource in sorted(resources):
+            task = PUSH_TASKS.get(resource)
+            if task is None:
+                self.stderr.write(f"No push task for resource {resource!r}")
+                continue
+            res = task.delay()
+            self.stdout.write(f"{resource}: push dispatched ({res.id})")
+
+    def handle(self, *args, **opts):
+        while True:
+            try:
+                if not opts["no_install"]:
+                    notify.install_trigger()
+                notify.listen(self.dispatch, debounce_ms=opts["debounce_ms"])
+            except (OperationalError, InterfaceError) as e:
+                # БД перезапустилась — перепідключаємось; пропущене підбере beat
+                self.stderr.write(f"Listener connection lost: {e}; reconnecting")
+                connection.close()
+                time.sleep(5)
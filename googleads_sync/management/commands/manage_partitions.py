@@ -0,0 +1,31 @@
+# manage_partitions.py
+from django.core.management.base import BaseCommand
+
+from googleads_sync.services import partitions
+
+
+class Command(BaseCommand):
+    help = "Convert SalesforceEvent/PendingChange/CampaignDailyMetric to partitioned tables, pre-create partitions, apply retention."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--convert", action="store_true", help="One-off conversion of plain tables (ACCESS EXCLUSIVE lock).")
+        parser.add_argument("--ahead", type=int, default=3, help="How many future partitions to keep created.")
+        parser.add_argument("--dry-run", action="store_true", help="Only report partitions that would be dropped.")
+
+    def handle(self, *args, **opts):
+        if opts["convert"]:
+            for spec in partitions.specs():
+                converted = partitions.convert_to_partitioned(spec, ahead=opts["ahead"])
+                msg = "converted" if converted else "already partitioned"
+                self.stdout.write(f"{spec.table}: {msg} (by {spec.interval} on {spec.column})")
+
+        result = partitions.maintain_partitions(ahead=opts["ahead"], dry_run=opts["dry_run"])
+        for table, info in result.items():
+            if not info["partitioned"]:
+                self.stdout.write(self.style.WARNING(f"{table}: not partitioned (run with --convert)"))
+                continue
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"{table}: created={len(info['created'])} dropped={', '.join(info['dropped']) or '-'}"
+                )
+            )
@@ -0,0 +1,54 @@
+# replay_dead_letters.py
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.utils.dateparse import parse_datetime
+
+from googleads_sync.services import dead_letter
+
+
+class Command(BaseCommand):
+    help = "List, re-queue or discard dead-lettered sync operations in bulk."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--resource", help="campaign | lead")
+        parser.add_argument("--action", help="create | update | remove | pause | enable")
+        parser.add_argument("--code", help="Error code prefix, e.g. quota_error or NO_MAPPING.")
+        parser.add_argument("--since", help="ISO datetime (failed at >=).")
+        parser.add_argument("--until", help="ISO datetime (failed at <).")
+        parser.add_argument("--limit", type=int, help="Replay at most N letters.")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--discard", action="store_true", help="Mark matching letters as discarded instead.")
+        parser.add_argument("--dry-run", action="store_true", help="Only print counts per resource/error code.")
+
+    def _dt(self, value):
+        if not value:
+            return None
+        dt = parse_datetime(value)
+        if dt is None:
+            raise CommandError(f"Invalid datetime: {value!r}")
+        return dt
+
+    def handle(self, *args, **opts):
+        qs = dead_letter.filter_letters(
+            resource=opts["resource"],
+            action=opts["action"],
+            error_code=opts["code"],
+            since=self._dt(opts["since"]),
+            until=self._dt(opts["until"]),
+        )
+        if opts["limit"]:
+            qs = qs.model.objects.filter(pk__in=list(qs.values_list("pk", flat=True)[:opts["limit"]]))
+
+        if opts["dry_run"]:
+            rows = qs.order_by().values("resource", "error_code").annotate(n=Count("id")).order_by("resource", "-n")
+            for row in rows:
+                self.stdout.write(f"{row['resource']:10} {row['error_code'] or '-':50} {row['n']}")
+            return
+
+        if opts["discard"]:
+            self.stdout.write(self.style.SUCCESS(f"Discarded: {dead_letter.discard(qs)}"))
+            return
+
+        counts = dead_letter.replay(qs, batch_size=opts["batch_size"])
+        total = sum(counts.values())
+        self.stdout.write(self.style.SUCCESS(f"Re-queued {total}: {counts or '-'}"))
@@ -0,0 +1,53 @@
+# reprocess_events.py
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from googleads_sync.services import reprocess
+
+
+class Command(BaseCommand):
+    help = "Re-derive PendingChange rows from stored SalesforceEvent history (after a mapping fix)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--since", help="ISO datetime (received at >=).")
+        parser.add_argument("--until", help="ISO datetime (received at <).")
+        parser.add_argument("--topic", action="append", default=[],
+                            help="SalesforceEvent.object_name, e.g. /data/LeadChangeEvent (repeatable).")
+        parser.add_argument("--workers", type=int, default=reprocess.WORKERS)
+        parser.add_argument("--chunk-size", type=int, default=reprocess.CHUNK_SIZE)
+        parser.add_argument("--force", action="store_true",
+                            help="Insert every derived change, even if an identical PendingChange exists.")
+        parser.add_argument("--dry-run", action="store_true", help="Only print the diff against existing rows.")
+
+    def _dt(self, value):
+        if not value:
+            return None
+        dt = parse_datetime(value)
+        if dt is None:
+            raise CommandError(f"Invalid datetime: {value!r}")
+        return dt
+
+    def handle(self, *args, **opts):
+        since, until = self._dt(opts["since"]), self._dt(opts["until"])
+        if not (since or until or opts["topic"]):
+            raise CommandError("Refusing to reprocess the whole history: pass --since/--until or --topic.")
+
+        res = reprocess.Reprocessor(
+            since=since,
+            until=until,
+            topics=opts["topic"],
+            workers=opts["workers"],
+            chunk_size=opts["chunk_size"],
+            dry_run=opts["dry_run"],
+            force=opts["force"],
+        ).run()
+
+        self.stdout.write(f"events: {res.events}")
+        self.stdout.write(f"{'change':24} {'derived':>9} {'added':>9} {'stale':>9}")
+        for label in sorted(set(res.derived) | set(res.stale)):
+            self.stdout.write(f"{label:24} {res.derived[label]:>9} {res.added[label]:>9} {res.stale[label]:>9}")
+        for line in res.samples:
+            self.stdout.write(line)
+        total = sum(res.added.values())
+        verb = "Would insert" if opts["dry_run"] else "Inserted"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {total} PendingChange rows"))
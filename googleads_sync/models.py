@@ -1,8 +1,11 @@
 # googleads_sync/models.py
 
+from django.conf import settings
 from django.db import models
 from django.utils import timezone
 
+from .services.lanes import key_hash
+
 
 class Timestamped(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
@@ -44,10 +47,22 @@ class PendingChange(Timestamped):
         ("remove", "Remove"),
         ("pause", "Pause"),
         ("enable", "Enable"),
+        ("restate", "Restate"),   # opportunity → conversion adjustment RESTATEMENT
+        ("retract", "Retract"),   # opportunity → conversion adjustment RETRACTION
     )
     RESOURCES = (
         ("campaign", "Campaign"),
         ("lead", "Lead"),
+        ("opportunity", "Opportunity"),
+    )
+    # менше = терміновіше; claim_batch ділить batch між рівнями за вагами
+    PRIORITY_HIGH = 0
+    PRIORITY_NORMAL = 1
+    PRIORITY_LOW = 2
+    PRIORITIES = (
+        (PRIORITY_HIGH, "High"),
+        (PRIORITY_NORMAL, "Normal"),
+        (PRIORITY_LOW, "Low"),
     )
 
     resource = models.CharField(max_length=32, choices=RESOURCES)
@@ -56,17 +71,97 @@ class PendingChange(Timestamped):
     status = models.CharField(max_length=16, default="pending")
     error = models.TextField(blank=True, null=True)
 
+    # lease/черга: хто забрав рядок, до коли, скільки спроб і коли наступна
+    lease_owner = models.CharField(max_length=128, blank=True, default="")
+    lease_expires_at = models.DateTimeField(blank=True, null=True)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    priority = models.PositiveSmallIntegerField(choices=PRIORITIES, default=PRIORITY_NORMAL)
+    error_history = models.JSONField(default=list, blank=True)  # [{at, error, codes}] по спробах
+    # hash SF Id / resource_name: зміни одного запису йдуть в одному lane і по черзі (services.lanes)
+    key_hash = models.PositiveIntegerField(blank=True, null=True)
+
+    # latency: SF commit → отримано → (created_at = enqueued) → claimed → застосовано в GA
+    source_commit_at = models.DateTimeField(blank=True, null=True)  # ChangeEventHeader.commitTimestamp
+    source_received_at = models.DateTimeField(blank=True, null=True)
+    # SalesforceEvent.id, з якої виведено зміну (без FK: обидві таблиці партиційовані) — diff у reprocess
+    source_event_id = models.BigIntegerField(blank=True, null=True)
+    claimed_at = models.DateTimeField(blank=True, null=True)  # останній claim (спроба, що завершилась)
+    applied_at = models.DateTimeField(blank=True, null=True)
+
     class Meta:
         indexes = [
             models.Index(fields=["resource", "status", "created_at"]),
+            # claim query: окремий keyset (created_at, id) для кожного priority, лише pending-рядки
+            models.Index(
+                fields=["resource", "priority", "created_at", "id"],
+                condition=models.Q(status="pending"),
+                name="pendingchange_claim_idx",
+            ),
+            # claim: ключі, що зараз у роботі або чекають retry, — не обганяти їх
+            models.Index(
+                fields=["resource", "key_hash"],
+                condition=models.Q(status__in=("processing", "pending")),
+                name="pendingchange_key_idx",
+            ),
+            # reaper: прострочені lease серед processing
+            models.Index(
+                fields=["lease_expires_at"],
+                condition=models.Q(status="processing"),
+                name="pendingchange_lease_idx",
+            ),
+            # reprocess: diff по події-джерелу (--topic → source_event_id IN (...))
+            models.Index(
+                fields=["source_event_id"],
+                condition=models.Q(source_event_id__isnull=False),
+                name="pendingchange_source_event_idx",
+            ),
+            # latency report: застосовані зміни за період
+            models.Index(
+                fields=["applied_at"],
+                condition=models.Q(status="done"),
+                name="pendingchange_applied_idx",
+            ),
         ]
 
+    @staticmethod
+    def priority_for(resource: str, action: str) -> int:
+        """PENDING_CHANGE_PRIORITIES: "resource.action" → "resource.*" → "*.action" → NORMAL."""
+        table = getattr(settings, "PENDING_CHANGE_PRIORITIES", {})
+        for key in (f"{resource}.{action}", f"{resource}.*", f"*.{action}"):
+            if key in table:
+                return int(table[key])
+        return PendingChange.PRIORITY_NORMAL
+
+    def assign_priority(self):
+        self.priority = self.priority_for(self.resource, self.action)
+        return self
+
+    @staticmethod
+    def record_key(payload: dict) -> str:
+        """SF Id (reconcile / CDC recordIds) або GA resource_name — ключ впорядкування."""
+        payload = payload or {}
+        header = payload.get("ChangeEventHeader") or {}
+        return payload.get("Id") or (header.get("recordIds") or [""])[0] or payload.get("resource_name") or ""
+
+    def assign_key(self):
+        self.key_hash = key_hash(self.record_key(self.payload))
+        return self
+
+    def save(self, *args, **kwargs):
+        # bulk_create save() не викликає — там assign_priority() / assign_key() треба звати явно
+        if self._state.adding:
+            self.assign_priority()
+            self.assign_key()
+        super().save(*args, **kwargs)
+
 
 class SalesforceEvent(models.Model):
     object_name = models.CharField(max_length=128)  # topic or object name
     sf_id = models.CharField(max_length=32)
     payload = models.JSONField(default=dict)
     received_at = models.DateTimeField(default=timezone.now)
+    commit_at = models.DateTimeField(blank=True, null=True)  # CDC ChangeEventHeader.commitTimestamp
 
     class Meta:
         indexes = [
@@ -110,6 +205,8 @@ class BaseSnapshot(models.Model):
     name = models.CharField(max_length=255, blank=True, default="")
     status = models.CharField(max_length=64, blank=True, default="")
     raw_payload = models.JSONField(default=dict, blank=True)
+    # sha256 нормалізованого вмісту — новий рядок пишемо лише коли hash змінився
+    content_hash = models.CharField(max_length=64, blank=True, default="")
     snapshot_at = models.DateTimeField(default=timezone.now)
 
     class Meta:
@@ -186,4 +283,195 @@ class Lead(Timestamped):
         ]
 
     def __str__(self):
-        return self.sf_id or self.ga_lead_resource or "lead"
\ No newline at end of file
+        return self.sf_id or self.ga_lead_resource or "lead"
+
+# --- ADD: стан адаптивного контролера push-ів (AIMD) на customer/resource ---
+class PushTuning(models.Model):
+    customer_id = models.CharField(max_length=32)
+    resource = models.CharField(max_length=32)
+    batch_size = models.PositiveIntegerField(default=200)
+    concurrency = models.PositiveIntegerField(default=1)
+    ewma_latency_ms = models.FloatField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = (("customer_id", "resource"),)
+
+    def __str__(self):
+        return f"{self.customer_id}/{self.resource}: batch={self.batch_size} x{self.concurrency}"
+
+
+# --- ADD: lease-based lock одного pipeline-run-а на customer ---
+class RunLock(models.Model):
+    name = models.CharField(max_length=128, unique=True)  # "<group>:<customer_id>"
+    owner = models.CharField(max_length=128, blank=True, default="")  # run id (trigger task id)
+    pipeline = models.CharField(max_length=64, blank=True, default="")
+    acquired_at = models.DateTimeField(blank=True, null=True)
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+    expires_at = models.DateTimeField(blank=True, null=True)
+    # coalesce: тригери під час run-у зливаються в один повторний запуск
+    rerun_pipeline = models.CharField(max_length=64, blank=True, default="")
+
+    def __str__(self):
+        return f"{self.name}: {self.pipeline or '-'} ({self.owner or 'free'})"
+
+
+# --- ADD: dead-letter store для остаточно невдалих PendingChange ---
+# Без FK: PendingChange партиційована (PK = id + created_at) і старі партиції дропаються.
+class DeadLetter(Timestamped):
+    STATUSES = (
+        ("open", "Open"),
+        ("replayed", "Replayed"),
+        ("discarded", "Discarded"),
+    )
+
+    pending_change_id = models.BigIntegerField(db_index=True)
+    pending_created_at = models.DateTimeField(blank=True, null=True)
+    resource = models.CharField(max_length=32)
+    action = models.CharField(max_length=16)
+    payload = models.JSONField(default=dict)          # оригінальна операція
+    error_code = models.CharField(max_length=128, blank=True, default="")
+    error_message = models.TextField(blank=True, default="")  # повний текст, без обрізання
+    errors = models.JSONField(default=list)           # [{code, message, trigger, field_path}]
+    attempts = models.PositiveIntegerField(default=0)
+    history = models.JSONField(default=list)          # помилки попередніх спроб
+    status = models.CharField(max_length=16, choices=STATUSES, default="open")
+    replayed_at = models.DateTimeField(blank=True, null=True)
+    replay_change_id = models.BigIntegerField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "resource", "created_at"]),
+            models.Index(fields=["error_code", "created_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.resource}/{self.action} #{self.pending_change_id}: {self.error_code or 'error'}"
+
+
+# --- ADD: idempotency-ключі завантажених click conversions (services.idempotency) ---
+class ConversionKey(models.Model):
+    """Один рядок на конверсію: sha256(action | click id | conversion time | order_id)[:16]."""
+    STATE_RESERVED = "reserved"
+    STATE_UPLOADED = "uploaded"
+    STATES = (
+        (STATE_RESERVED, "Reserved"),
+        (STATE_UPLOADED, "Uploaded"),
+    )
+
+    digest = models.BinaryField(max_length=16, unique=True)
+    pending_change_id = models.BigIntegerField()  # хто зарезервував (без FK — PendingChange партиційована)
+    state = models.CharField(max_length=16, choices=STATES, default=STATE_RESERVED)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["created_at"]),
+        ]
+
+    def __str__(self):
+        return f"{bytes(self.digest).hex()} ({self.state})"
+
+
+# --- ADD: щоденні метрики кампаній (services.campaign_metrics, COPY → staging → merge) ---
+class CampaignDailyMetric(models.Model):
+    """
+    Факт-таблиця: customer × campaign × date × device. RANGE-партиції за date
+    (manage_partitions --convert); campaign_id — Campaign.campaign_id, без FK.
+    """
+    pk = models.CompositePrimaryKey("customer_id", "campaign_id", "date", "device")
+    customer_id = models.BigIntegerField()
+    campaign_id = models.BigIntegerField()
+    date = models.DateField()
+    device = models.CharField(max_length=32)
+    impressions = models.BigIntegerField(default=0)
+    clicks = models.BigIntegerField(default=0)
+    cost_micros = models.BigIntegerField(default=0)
+    conversions = models.FloatField(default=0)
+    conversions_value = models.FloatField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = "ga_campaign_daily_metric"
+        indexes = [
+            models.Index(fields=["campaign_id", "date"]),
+        ]
+
+    def __str__(self):
+        return f"{self.customer_id}/{self.campaign_id} {self.date} {self.device}"
+
+
+class SyncLatency(PendingChange):
+    """Proxy лише для пункту меню admin зі звітом latency (services.latency)."""
+
+    class Meta:
+        proxy = True
+        verbose_name = "sync latency report"
+        verbose_name_plural = "sync latency report"
+
+
+# --- ADD: ledger run-ів pipeline-ів і їхніх стадій (історія throughput) ---
+class SyncRun(models.Model):
+    STATUSES = (
+        ("running", "Running"),
+        ("success", "Success"),
+        ("partial", "Partial"),  # частина стадій з помилкою
+        ("failed", "Failed"),
+    )
+
+    run_id = models.CharField(max_length=128, unique=True)  # id тригер-задачі (= owner RunLock)
+    pipeline = models.CharField(max_length=64)
+    customer_id = models.CharField(max_length=32, blank=True, default="")
+    status = models.CharField(max_length=16, choices=STATUSES, default="running")
+    started_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    rows_in = models.BigIntegerField(default=0)
+    rows_out = models.BigIntegerField(default=0)
+    api_calls = models.BigIntegerField(default=0)
+    errors = models.BigIntegerField(default=0)
+    bytes = models.BigIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["pipeline", "started_at"]),
+        ]
+
+    @property
+    def duration_seconds(self):
+        if not self.finished_at:
+            return None
+        return (self.finished_at - self.started_at).total_seconds()
+
+    def __str__(self):
+        return f"{self.pipeline} @ {self.started_at:%Y-%m-%d %H:%M} ({self.status})"
+
+
+class SyncStageRun(models.Model):
+    run = models.ForeignKey(SyncRun, on_delete=models.CASCADE, related_name="stages")
+    stage = models.CharField(max_length=64)
+    queue = models.CharField(max_length=32, blank=True, default="")
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField()
+    duration_ms = models.FloatField(default=0)
+    rows_in = models.BigIntegerField(default=0)
+    rows_out = models.BigIntegerField(default=0)
+    api_calls = models.BigIntegerField(default=0)
+    errors = models.BigIntegerField(default=0)
+    bytes = models.BigIntegerField(default=0)
+    cursor_before = models.JSONField(default=dict, blank=True)  # SyncCursor.resource → iso, лише змінені
+    cursor_after = models.JSONField(default=dict, blank=True)
+    result = models.JSONField(default=dict, blank=True, null=True)
+    error = models.TextField(blank=True, default="")
+
+    class Meta:
+        unique_together = (("run", "stage"),)
+        indexes = [
+            models.Index(fields=["stage", "started_at"]),
+        ]
+
+    @property
+    def rows_per_second(self):
+        return self.rows_out / (self.duration_ms / 1000.0) if self.duration_ms else None
+
+    def __str__(self):
+        return f"{self.run.pipeline}/{self.stage}"
@@ -0,0 +1,141 @@
+# googleads_sync/salesforce/cdc.py
+"""
+Pure CDC → PendingChange mapping (без запитів до БД).
+
+Спільне для live-підписника (subscriber), HTTP ingest (Outbound Messages /
+webhooks) і повторної обробки збережених SalesforceEvent: на вході —
+декодований payload, на виході — незбережені PendingChange з уже
+призначеними priority і key_hash.
+"""
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+
+from ..models import PendingChange
+from ..services.mappers import epoch_ms_to_dt
+
+
+def header(payload: Dict[str, Any]) -> Dict[str, Any]:
+    return payload.get("ChangeEventHeader") or {}
+
+
+def record_id(payload: Dict[str, Any]) -> str:
+    """SF record Id (best-effort): Id платформної події або перший recordIds з CDC header."""
+    return payload.get("Id") or (header(payload).get("recordIds") or [""])[0] or ""
+
+
+def commit_time(payload: Dict[str, Any]) -> Optional[datetime]:
+    """Коли зміну закомітили в SF: CDC commitTimestamp; для platform events — CreatedDate."""
+    return epoch_ms_to_dt(header(payload).get("commitTimestamp") or payload.get("CreatedDate"))
+
+
+def campaign_action(payload: Dict[str, Any]) -> Optional[str]:
+    h = header(payload)
+    change_type = (h.get("changeType") or "").upper()  # CREATE/UPDATE/DELETE/UNDELETE
+    if change_type == "CREATE":
+        return "create"
+    if change_type == "UPDATE":
+        # Якщо саме змінився статус — робимо спеціальну дію pause/enable
+        status_val = (payload.get("Status") or "").upper()
+        if "Status" in (h.get("changedFields") or []) and status_val in ("PAUSED", "ENABLED"):
+            return "pause" if status_val == "PAUSED" else "enable"
+        return "update"
+    if change_type == "DELETE":
+        return "remove"
+    # (UNDELETE можна трактувати як enable або update, за потреби)
+    return None
+
+
+def lead_action(payload: Dict[str, Any]) -> Optional[str]:
+    return {"CREATE": "create", "UPDATE": "update", "DELETE": "remove"}.get(
+        (header(payload).get("changeType") or "").upper()
+    )
+
+
+# Opportunity стадії, що скасовують конверсію (Lead → Opportunity → програш)
+RETRACT_STAGES = {s.strip().lower() for s in getattr(settings, "SF_OPPORTUNITY_RETRACT_STAGES", ("Closed Lost",)) if s}
+
+
+def opportunity_action(payload: Dict[str, Any]) -> Optional[str]:
+    """
+    Opportunity → conversion adjustment: DELETE або перехід у RETRACT_STAGES → retract,
+    зміна Amount → restate (нове значення конверсії). Інші зміни GA не цікавлять.
+    """
+    h = header(payload)
+    change_type = (h.get("changeType") or "").upper()
+    if change_type == "DELETE":
+        return "retract"
+    if change_type not in ("CREATE", "UPDATE"):
+        return None
+    changed = h.get("changedFields") or list(payload)  # snapshot (from_record) — всі поля
+    if "StageName" in changed and (payload.get("StageName") or "").strip().lower() in RETRACT_STAGES:
+        return "retract"
+    if "Amount" in changed and payload.get("Amount") not in (None, ""):
+        return "restate"
+    return None
+
+
+def from_record(
+    record: Dict[str, Any],
+    entity: Optional[str] = None,
+    change_type: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    sObject snapshot (Outbound Message / Flow HTTP callout) → CDC-подібний payload,
+    щоб далі працював той самий мапінг і field_map. Snapshot не каже, create це
+    чи update: CreatedDate == LastModifiedDate → CREATE, інакше UPDATE.
+    """
+    entity = entity or (record.get("attributes") or {}).get("type") or ""
+    fields = {k: v for k, v in record.items() if k != "attributes"}
+    if not change_type:
+        created = fields.get("CreatedDate")
+        change_type = "CREATE" if created and created == fields.get("LastModifiedDate") else "UPDATE"
+    modified = parse_datetime(fields.get("LastModifiedDate") or fields.get("SystemModstamp") or "")
+    return {
+        **fields,
+        "ChangeEventHeader": {
+            "entityName": entity,
+            "changeType": change_type.upper(),
+            "recordIds": [fields["Id"]] if fields.get("Id") else [],
+            "changedFields": [],  # невідомо → field_map бере всі присутні поля
+            "commitTimestamp": int(modified.timestamp() * 1000) if modified else None,
+        },
+    }
+
+
+# entityName (lower) → (PendingChange.resource, action resolver)
+ENTITIES = {
+    "campaign": ("campaign", campaign_action),
+    "lead": ("lead", lead_action),
+    "opportunity": ("opportunity", opportunity_action),
+}
+
+
+def to_pending_changes(
+    payload: Dict[str, Any],
+    received_at: Optional[datetime] = None,
+    commit_at: Optional[datetime] = None,
+) -> List[PendingChange]:
+    """
+    CDC payload → незбережені PendingChange (0 або 1 на подію).
+    Payload лишається цілим CDC payload — мапінг полів робить pipelines/field_map.
+    Platform events (без ChangeEventHeader) → [].
+    """
+    entity = (header(payload).get("entityName") or "").lower()
+    if entity not in ENTITIES:
+        return []
+    resource, resolve = ENTITIES[entity]
+    action = resolve(payload)
+    if not action:
+        return []
+    change = PendingChange(
+        resource=resource,
+        action=action,
+        payload=payload,
+        status="pending",
+        source_commit_at=commit_at if commit_at is not None else commit_time(payload),
+        source_received_at=received_at,
+    )
+    return [change.assign_priority().assign_key()]
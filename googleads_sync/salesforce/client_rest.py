@@ -1,11 +1,71 @@
+import csv
+import io
 import os
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, Optional
+
+import requests
+from django.conf import settings
 from simple_salesforce import Salesforce, SalesforceLogin
+from simple_salesforce.exceptions import SalesforceExpiredSession
+
+from ..services import metrics
+from ..services.rate_limit import get_limiter, parse_rate
+
+# Bulk API 2.0 вмикаємо автоматично, коли вибірка більша за поріг
+BULK_THRESHOLD = int(os.getenv("SF_BULK_THRESHOLD", 200000))
+BULK_PAGE_RECORDS = int(os.getenv("SF_BULK_PAGE_RECORDS", 50000))
+BULK_POLL_SECONDS = float(os.getenv("SF_BULK_POLL_SECONDS", 2))
+BULK_TIMEOUT_SECONDS = int(os.getenv("SF_BULK_TIMEOUT_SECONDS", 60 * 60))
+
+SF_RATE_ORG = getattr(settings, "SF_RATE_ORG", "")  # "qps/burst" на org
+SF_LIMIT_MAX_RETRIES = int(getattr(settings, "SF_LIMIT_MAX_RETRIES", 3))
+SF_LIMIT_DEFAULT_DELAY = float(getattr(settings, "SF_LIMIT_DEFAULT_DELAY", 60))
+
+_sf: Optional[Salesforce] = None
+_sf_lock = threading.Lock()
+
+
+class RateLimitedSession(requests.Session):
+    """
+    requests.Session для simple_salesforce: кожен REST/Bulk виклик бере токен
+    зі спільного bucket-а org-и; REQUEST_LIMIT_EXCEEDED закриває bucket для всіх
+    воркерів на Retry-After (або SF_LIMIT_DEFAULT_DELAY) і повторює запит.
+    """
+
+    def __init__(self, org_key: str):
+        super().__init__()
+        self.limiter = get_limiter()
+        self.bucket = parse_rate(SF_RATE_ORG, f"sf:org:{org_key}")
+
+    def request(self, method, url, *args, **kwargs):
+        for attempt in range(SF_LIMIT_MAX_RETRIES + 1):
+            self.limiter.acquire([self.bucket])
+            resp = super().request(method, url, *args, **kwargs)
+            # stream=True (Bulk CSV) — тіло ще не прочитане, тож лише Content-Length
+            metrics.add(api_calls=1, bytes=resp.headers.get("Content-Length") or 0)
+            if resp.status_code != 403 or b"REQUEST_LIMIT_EXCEEDED" not in resp.content:
+                return resp
+            if attempt == SF_LIMIT_MAX_RETRIES or self.bucket is None:
+                return resp
+            delay = float(resp.headers.get("Retry-After") or SF_LIMIT_DEFAULT_DELAY)
+            self.limiter.block(self.bucket, delay)
+        return resp
+
 
-def get_sf():
+def _session() -> RateLimitedSession:
+    org_key = os.getenv("SF_ORG_ID") or os.getenv("SF_INSTANCE_URL") or os.getenv("SF_USERNAME") or "default"
+    return RateLimitedSession(org_key)
+
+
+def _login() -> Salesforce:
+    session = _session()
     session_id = os.getenv("SF_SESSION_ID")
     instance_url = os.getenv("SF_INSTANCE_URL")
     if session_id and instance_url:
-        return Salesforce(instance_url=instance_url, session_id=session_id)
+        return Salesforce(instance_url=instance_url, session_id=session_id, session=session)
     username = os.getenv("SF_USERNAME")
     password = os.getenv("SF_PASSWORD")
     token = os.getenv("SF_SECURITY_TOKEN")
@@ -17,9 +77,161 @@ def get_sf():
         password=password,
         security_token=token,
         domain=domain,
+        session=session,
     )
-    return Salesforce(session_id=session_id, instance=instance)
+    return Salesforce(session_id=session_id, instance=instance, session=session)
+
+
+def get_sf(fresh: bool = False) -> Salesforce:
+    """Process-wide Salesforce session (login once, reuse HTTP keep-alive)."""
+    global _sf
+    with _sf_lock:
+        if _sf is None or fresh:
+            _sf = _login()
+        return _sf
+
+
+def reset_sf():
+    global _sf
+    with _sf_lock:
+        _sf = None
+
+
+def _sf_call(fn: Callable[[Salesforce], Any]) -> Any:
+    """
+    fn(sf) з process-wide сесією. Прострочена сесія — SalesforceExpiredSession
+    (simple_salesforce) або HTTP 401 (сирі Bulk-запити через sf.session) —
+    → один повтор після свіжого login-у.
+    """
+    try:
+        result = fn(get_sf())
+    except SalesforceExpiredSession:
+        return fn(get_sf(fresh=True))
+    if isinstance(result, requests.Response) and result.status_code == 401:
+        result.close()
+        return fn(get_sf(fresh=True))
+    return result
+
 
 def soql_query(soql: str):
+    """Small queries only — loads all records into memory."""
+    return _sf_call(lambda sf: sf.query_all(soql))
+
+
+# ---- Streaming SOQL (REST, nextRecordsUrl) ----------------------------------
+
+def soql_iter(soql: str, include_deleted: bool = False) -> Iterator[Dict[str, Any]]:
+    """Yields records page by page via query_all_iter; memory stays at one page (≤2000)."""
     sf = get_sf()
-    return sf.query_all(soql)
+    try:
+        first = sf.query_all_iter(soql, include_deleted=include_deleted)
+        record = next(first, None)
+    except SalesforceExpiredSession:
+        sf = get_sf(fresh=True)
+        first = sf.query_all_iter(soql, include_deleted=include_deleted)
+        record = next(first, None)
+    if record is None:
+        return
+    yield record
+    yield from first
+
+
+_from_re = re.compile(r"\bFROM\s+(\w+)(.*?)(?:\bORDER\s+BY\b.*)?$", re.IGNORECASE | re.DOTALL)
+
+
+def soql_count(soql: str) -> Optional[int]:
+    """COUNT() for the FROM/WHERE part of a query; None if the query can't be rewritten."""
+    m = _from_re.search(soql)
+    if not m or re.search(r"\b(LIMIT|GROUP\s+BY)\b", soql, re.IGNORECASE):
+        return None
+    count_soql = f"SELECT COUNT() FROM {m.group(1)}{m.group(2)}"
+    return _sf_call(lambda sf: sf.query(count_soql))["totalSize"]
+
+
+# ---- Bulk API 2.0 query jobs (CSV, streamed by locator pages) ---------------
+
+def _bulk_base(sf: Salesforce) -> str:
+    return f"https://{sf.sf_instance}/services/data/v{sf.sf_version}/jobs/query"
+
+
+def _bulk_headers(sf: Salesforce, accept: str = "application/json") -> Dict[str, str]:
+    return {
+        "Authorization": f"Bearer {sf.session_id}",
+        "Content-Type": "application/json",
+        "Accept": accept,
+    }
+
+
+def bulk2_query_iter(
+    soql: str,
+    include_deleted: bool = False,
+    page_records: int = BULK_PAGE_RECORDS,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Runs a Bulk API 2.0 query job and yields rows as dicts.
+    Результати читаються сторінками (Sforce-Locator) і парсяться CSV-стрімом
+    прямо з HTTP-відповіді — в памʼяті лише поточний рядок/буфер сокета.
+    Порожні CSV-значення повертаються як None.
+    """
+    # кожен запит — через _sf_call: job може йти довше, ніж живе сесія
+    job = _sf_call(lambda sf: sf.session.post(
+        _bulk_base(sf),
+        headers=_bulk_headers(sf),
+        json={
+            "operation": "queryAll" if include_deleted else "query",
+            "query": soql,
+            "contentType": "CSV",
+            "columnDelimiter": "COMMA",
+            "lineEnding": "LF",
+        },
+    ))
+    job.raise_for_status()
+    job_id = job.json()["id"]
+
+    deadline = time.monotonic() + BULK_TIMEOUT_SECONDS
+    while True:
+        info = _sf_call(lambda sf: sf.session.get(f"{_bulk_base(sf)}/{job_id}", headers=_bulk_headers(sf)))
+        info.raise_for_status()
+        state = info.json().get("state")
+        if state == "JobComplete":
+            break
+        if state in ("Failed", "Aborted"):
+            raise RuntimeError(f"Bulk query job {job_id} {state}: {info.json().get('errorMessage', '')}")
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Bulk query job {job_id} not complete after {BULK_TIMEOUT_SECONDS}s")
+        time.sleep(BULK_POLL_SECONDS)
+
+    locator = None
+    while True:
+        params = {"maxRecords": page_records}
+        if locator:
+            params["locator"] = locator
+        resp = _sf_call(lambda sf: sf.session.get(
+            f"{_bulk_base(sf)}/{job_id}/results",
+            headers=_bulk_headers(sf, accept="text/csv"),
+            params=params,
+            stream=True,
+        ))
+        resp.raise_for_status()
+        resp.raw.decode_content = True
+        with resp:
+            reader = csv.DictReader(io.TextIOWrapper(resp.raw, encoding="utf-8", newline=""))
+            for row in reader:
+                yield {k: (v if v != "" else None) for k, v in row.items()}
+        locator = resp.headers.get("Sforce-Locator")
+        if not locator or locator == "null":
+            break
+
+
+def soql_stream(soql: str, bulk: Optional[bool] = None, include_deleted: bool = False) -> Iterator[Dict[str, Any]]:
+    """
+    Generator API for extracts of any size.
+    bulk=None: Bulk API 2.0 лише якщо COUNT() > SF_BULK_THRESHOLD, інакше REST-сторінки.
+    NB: REST-записи містять 'attributes', Bulk-рядки — ні; значення з Bulk — рядки.
+    """
+    if bulk is None:
+        count = soql_count(soql)
+        bulk = count is not None and count > BULK_THRESHOLD
+    if bulk:
+        return bulk2_query_iter(soql, include_deleted=include_deleted)
+    return soql_iter(soql, include_deleted=include_deleted)
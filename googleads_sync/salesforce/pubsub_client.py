@@ -1,16 +1,18 @@
 # googleads_sync/salesforce/pubsub_client.py
 import os
+import queue
 import grpc
 import json
-from typing import Dict, Any, Generator, Tuple
+from typing import Dict, Any, Generator, Iterator, Tuple
 from fastavro import schemaless_reader, schemaless_writer
 from io import BytesIO
 
-from .client_rest import get_sf, soql_query
+from .client_rest import get_sf, reset_sf, soql_query
 from .grpc_stubs import pubsub_api_pb2 as pb2
 from .grpc_stubs import pubsub_api_pb2_grpc as pb2_grpc
 
 PUBSUB_ENDPOINT = os.getenv("SF_PUBSUB_ENDPOINT", "api.pubsub.salesforce.com:7443")
+MAX_NUM_REQUESTED = 100  # ліміт Pub/Sub API на один FetchRequest
 
 
 def _auth_metadata() -> Tuple[Tuple[str, str], ...]:
@@ -30,26 +32,55 @@ def _auth_metadata() -> Tuple[Tuple[str, str], ...]:
     )
 
 
+def is_unauthenticated(ex: Exception) -> bool:
+    """Сесія SF протухла (get_sf() кешує її на процес) — треба reset_sf() і новий login."""
+    return isinstance(ex, grpc.RpcError) and ex.code() == grpc.StatusCode.UNAUTHENTICATED
+
+
 class PubSubClient:
     def __init__(self):
         self.channel = grpc.secure_channel(PUBSUB_ENDPOINT, grpc.ssl_channel_credentials())
         self.stub = pb2_grpc.PubSubStub(self.channel)
         self._schema_cache: Dict[str, Dict[str, Any]] = {}
 
+    def _unary(self, method, req):
+        """Unary RPC; на UNAUTHENTICATED — один повтор зі свіжою сесією."""
+        try:
+            return method(req, metadata=_auth_metadata())
+        except grpc.RpcError as ex:
+            if not is_unauthenticated(ex):
+                raise
+            reset_sf()
+            return method(req, metadata=_auth_metadata())
+
     def get_schema(self, schema_id: str) -> Dict[str, Any]:
         if schema_id in self._schema_cache:
             return self._schema_cache[schema_id]
         req = pb2.SchemaRequest(schema_id=schema_id)
-        resp = self.stub.GetSchema(req, metadata=_auth_metadata())
+        resp = self._unary(self.stub.GetSchema, req)
         schema_json = json.loads(resp.schema_json)
         self._schema_cache[schema_id] = schema_json
         return schema_json
 
     def get_latest_schema_id_for_topic(self, topic_name: str) -> str:
         req = pb2.TopicRequest(topic_name=topic_name)
-        info = self.stub.GetTopic(req, metadata=_auth_metadata())
+        info = self._unary(self.stub.GetTopic, req)
         return info.schema_id
 
+    def fetch_stream(
+        self,
+        topic_name: str,
+        replay_preset: str = "LATEST",
+        replay_id: bytes | None = None,
+    ) -> "FetchStream":
+        return FetchStream(self, topic_name, replay_preset, replay_id)
+
+    def decode(self, schema_id: str, payload_bytes: bytes) -> Dict[str, Any]:
+        try:
+            return schemaless_reader(BytesIO(payload_bytes), self.get_schema(schema_id))
+        except Exception:
+            return {"_raw": payload_bytes.hex() if payload_bytes else None, "_schema_id": schema_id}
+
     def subscribe(
         self,
         topic_name: str,
@@ -57,28 +88,19 @@ class PubSubClient:
         replay_id: bytes | None = None,
         batch: int = 1,
     ) -> Generator[Dict[str, Any], None, None]:
-        sub_req = pb2.SubscriptionRequest(
-            topic_name=topic_name,
-            num_requested=batch,
-            replay_preset=getattr(pb2.ReplayPreset, replay_preset),
-            replay_id=replay_id or b"",
-        )
-        # Salesforce очікує stream SubscriptionRequest → stream FetchResponse
-        sub_stream = self.stub.Subscribe(iter([sub_req]), metadata=_auth_metadata())
-        for fetch_resp in sub_stream:
+        """Decoded events one by one; credit поповнюється по batch після кожної відповіді."""
+        stream = self.fetch_stream(topic_name, replay_preset, replay_id)
+        stream.request(batch)
+        for fetch_resp in stream:
             for event in fetch_resp.events:
-                payload_bytes = event.event.payload
                 schema_id = event.event.schema_id
-                try:
-                    schema = self.get_schema(schema_id)
-                    decoded = schemaless_reader(BytesIO(payload_bytes), schema)
-                except Exception:
-                    decoded = {"_raw": payload_bytes.hex() if payload_bytes else None, "_schema_id": schema_id}
                 yield {
                     "schema_id": schema_id,
                     "replay_id": event.replay_id,
-                    "payload": decoded,
+                    "payload": self.decode(schema_id, event.event.payload),
                 }
+            if fetch_resp.pending_num_requested == 0:
+                stream.request(batch)
 
     def publish_platform_event(self, topic_name: str, payload_dict: Dict[str, Any]) -> str:
         schema_id = self.get_latest_schema_id_for_topic(topic_name)
@@ -90,5 +112,48 @@ class PubSubClient:
             topic_name=topic_name,
             events=[pb2.ProducerEvent(schema_id=schema_id, payload=data)],
         )
-        resp = self.stub.Publish(req, metadata=_auth_metadata())
+        resp = self._unary(self.stub.Publish, req)
         return ",".join(e.replay_id.hex() for e in resp.results)
+
+
+class FetchStream:
+    """
+    Bidirectional Subscribe with explicit flow control.
+    Salesforce надсилає рівно стільки подій, скільки запитано (credit); request(n)
+    дозапитує — по кілька FetchRequest, бо один обмежений MAX_NUM_REQUESTED.
+    Ітерація повертає сирі FetchResponse (events, latest_replay_id, pending_num_requested).
+    """
+
+    def __init__(self, client: PubSubClient, topic_name: str, replay_preset: str, replay_id: bytes | None):
+        self.topic_name = topic_name
+        self._requests: "queue.Queue" = queue.Queue()
+        self._first = {
+            "replay_preset": getattr(pb2.ReplayPreset, replay_preset),
+            "replay_id": replay_id or b"",
+        }
+        self._sent_first = False
+        self._responses = client.stub.Subscribe(self._request_iter(), metadata=_auth_metadata())
+
+    def _request_iter(self) -> Iterator:
+        while True:
+            req = self._requests.get()
+            if req is None:
+                return
+            yield req
+
+    def request(self, n: int):
+        while n > 0:
+            chunk = min(n, MAX_NUM_REQUESTED)
+            kwargs = {"topic_name": self.topic_name, "num_requested": chunk}
+            if not self._sent_first:
+                kwargs.update(self._first)
+                self._sent_first = True
+            self._requests.put(pb2.FetchRequest(**kwargs))
+            n -= chunk
+
+    def close(self):
+        self._requests.put(None)
+        self._responses.cancel()
+
+    def __iter__(self):
+        return iter(self._responses)
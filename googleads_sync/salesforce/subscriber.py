@@ -0,0 +1,315 @@
+# googleads_sync/salesforce/subscriber.py
+"""
+Pub/Sub subscriber with gap detection and catch-up mode.
+
+Steady: невелике вікно credit (batch), декодування inline, коміт на кожну
+відповідь — мінімальна затримка.
+Catch-up (після простою / збереженого replay_id або коли lag між
+commitTimestamp і now перевищує PUBSUB_CATCHUP_LAG_SECONDS): у стрімі
+одночасно висить кілька FetchRequest (кожен ≤ 100 подій — ліміт API),
+Avro декодується пачками в пулі процесів, а SalesforceEvent / PendingChange
+пишуться bulk_create-ом у PUBSUB_LANES ordered lanes (hash SF record Id,
+services.lanes): події одного запису — по черзі, різних — паралельно.
+ReplayState просувається лише до low watermark по всіх lane-ах. Щойно lag
+падає нижче порогу — lane-и дренуються і назад у steady.
+"""
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import django
+import grpc
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone as djtz
+from fastavro import parse_schema, schemaless_reader
+
+from ..models import PendingChange, ReplayState, SalesforceEvent
+from ..services.lanes import OrderedLanes, partition
+from . import cdc
+from .client_rest import reset_sf
+from .pubsub_client import MAX_NUM_REQUESTED, PubSubClient, is_unauthenticated
+
+logger = logging.getLogger(__name__)
+
+CATCHUP_LAG_SECONDS = float(getattr(settings, "PUBSUB_CATCHUP_LAG_SECONDS", 300))
+CATCHUP_OUTSTANDING = int(getattr(settings, "PUBSUB_CATCHUP_OUTSTANDING", 5))  # FetchRequest-ів у польоті
+CATCHUP_CHUNK = int(getattr(settings, "PUBSUB_CATCHUP_CHUNK", 1000))  # подій на транзакцію
+DECODE_WORKERS = int(getattr(settings, "PUBSUB_DECODE_WORKERS", 4))  # 0 = inline
+LANES = int(getattr(settings, "PUBSUB_LANES", 4))  # ordered lanes для запису в catch-up
+
+# (schema_id, avro bytes, replay_id)
+RawEvent = Tuple[str, bytes, bytes]
+
+
+# ---- Avro decode (виконується і в пулі процесів) -----------------------------
+
+_parsed: Dict[str, Any] = {}
+
+
+def _decode_one(schema, schema_id: str, data: bytes) -> Dict[str, Any]:
+    try:
+        return schemaless_reader(BytesIO(data), schema)
+    except Exception:
+        return {"_raw": data.hex() if data else None, "_schema_id": schema_id}
+
+
+def decode_chunk(schemas: Dict[str, dict], items: Sequence[Tuple[str, bytes]]) -> List[Dict[str, Any]]:
+    """schemas — JSON-схеми з головного процесу; parse_schema кешується per-process."""
+    out = []
+    for schema_id, data in items:
+        schema = _parsed.get(schema_id)
+        if schema is None:
+            schema = _parsed[schema_id] = parse_schema(schemas[schema_id])
+        out.append(_decode_one(schema, schema_id, data))
+    return out
+
+
+# ---- persistence --------------------------------------------------------------
+
+def build_rows(topic_name: str, payloads: Sequence[Dict[str, Any]], received_at) -> Tuple[list, list]:
+    """(events, changes); changes — пари (event, PendingChange), id події з'явиться в write_rows."""
+    events, changes = [], []
+    for payload in payloads:
+        commit_at = cdc.commit_time(payload)
+        event = SalesforceEvent(
+            object_name=topic_name,
+            sf_id=cdc.record_id(payload),
+            payload=payload,
+            received_at=received_at,
+            commit_at=commit_at,
+        )
+        events.append(event)
+        changes += [(event, ch) for ch in cdc.to_pending_changes(payload, received_at, commit_at)]
+    return events, changes
+
+
+def write_rows(events: list, changes: list):
+    # Postgres повертає id з bulk_create — PendingChange посилається на свою подію
+    SalesforceEvent.objects.bulk_create(events, batch_size=1000)
+    if changes:
+        for event, ch in changes:
+            ch.source_event_id = event.pk
+        PendingChange.objects.bulk_create([ch for _, ch in changes], batch_size=1000)
+
+
+def persist_events(
+    topic_name: str,
+    state: ReplayState,
+    payloads: Sequence[Dict[str, Any]],
+    last_replay_id: bytes,
+    received_at=None,
+) -> Dict[str, int]:
+    """Bulk insert подій + PendingChange і просування replay_id — атомарно (at-least-once)."""
+    events, changes = build_rows(topic_name, payloads, received_at or djtz.now())
+    with transaction.atomic():
+        write_rows(events, changes)
+        st = ReplayState.objects.select_for_update().get(pk=state.pk)
+        st.set_replay(last_replay_id)
+    return {"events": len(events), "changes": len(changes)}
+
+
+def _persist_lane(events: list, changes: list):
+    with transaction.atomic():
+        write_rows(events, changes)
+
+
+def latest_commit(payloads: Iterable[Dict[str, Any]]):
+    return max((c for c in map(cdc.commit_time, payloads) if c), default=None)
+
+
+# ---- subscriber -----------------------------------------------------------------
+
+class Subscriber:
+    def __init__(self, topic_name: str, replay_preset: str = "LATEST", batch: int = 1, client: Optional[PubSubClient] = None):
+        self.topic_name = topic_name
+        self.replay_preset = replay_preset
+        self.steady_window = max(1, min(batch, MAX_NUM_REQUESTED))
+        self.client = client or PubSubClient()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_broken = False
+        self._lanes: Optional[OrderedLanes] = None
+        self._seq = 0                          # номер події в межах run()
+        self._replay_at: Dict[int, bytes] = {}  # seq → replay_id (ще не закомічені)
+        self._checkpointed: Optional[int] = None
+        self.stats = {"received": 0, "changes": 0, "catchup_chunks": 0, "mode_switches": 0}
+        self._got_response = False
+
+    # -- decode --
+
+    def _decode(self, raw: List[RawEvent], parallel: bool) -> List[Dict[str, Any]]:
+        schemas = {sid: self.client.get_schema(sid) for sid in {r[0] for r in raw}}
+        items = [(r[0], r[1]) for r in raw]
+        if parallel and DECODE_WORKERS > 0 and not self._pool_broken and len(items) > DECODE_WORKERS:
+            try:
+                if self._pool is None:
+                    # forkserver, не fork: gRPC-канал і потоки цього процесу не fork-safe
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=DECODE_WORKERS,
+                        mp_context=multiprocessing.get_context("forkserver"),
+                        initializer=django.setup,
+                    )
+                size = -(-len(items) // DECODE_WORKERS)
+                chunks = [items[i:i + size] for i in range(0, len(items), size)]
+                out: List[Dict[str, Any]] = []
+                for part in self._pool.map(decode_chunk, [schemas] * len(chunks), chunks):
+                    out += part
+                return out
+            except (AssertionError, BrokenProcessPool, OSError) as e:
+                # напр. daemon-процес Celery prefork не може мати дітей
+                logger.warning("Pub/Sub decode pool unavailable (%s); decoding inline", e)
+                self._pool_broken = True
+                self._shutdown_pool()
+        return decode_chunk(schemas, items)
+
+    def _shutdown_pool(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    # -- persistence --
+
+    def _flush(self, state: ReplayState, raw: List[RawEvent], catchup: bool):
+        """
+        Steady: одна транзакція разом з replay_id.
+        Catch-up: події розкладаються по lane-ах за SF record Id і пишуться
+        паралельно; replay_id просуває _checkpoint() до low watermark.
+        """
+        received_at = djtz.now()
+        payloads = self._decode(raw, parallel=catchup)
+        if catchup and LANES > 1:
+            if self._lanes is None:
+                self._lanes = OrderedLanes(LANES, name="pubsub-lane")
+            first = self._seq
+            self._seq += len(raw)
+            for i, (_sid, _data, replay_id) in enumerate(raw):
+                self._replay_at[first + i] = replay_id
+            seqs = range(first, self._seq)
+            by_lane = partition(zip(seqs, payloads), lambda item: cdc.record_id(item[1]), LANES)
+            for lane, items in by_lane.items():
+                # rows будуються тут, а не в lane: лічильник changes — без зворотного каналу з потоків
+                events, changes = build_rows(self.topic_name, [p for _, p in items], received_at)
+                self._lanes.submit_to(lane, [seq for seq, _ in items], _persist_lane, events, changes)
+                self.stats["changes"] += len(changes)
+            self.stats["received"] += len(payloads)
+            self._checkpoint(state)
+        else:
+            self._drain_lanes(state)
+            res = persist_events(self.topic_name, state, payloads, raw[-1][2], received_at)
+            self.stats["received"] += res["events"]
+            self.stats["changes"] += res["changes"]
+        if catchup:
+            self.stats["catchup_chunks"] += 1
+        return latest_commit(payloads)
+
+    def _checkpoint(self, state: ReplayState, raise_errors: bool = True):
+        """replay_id → найбільша позиція, до якої ВСІ lane-и все записали."""
+        if self._lanes is None:
+            return
+        if raise_errors:
+            self._lanes.raise_if_failed()
+        wm = self._lanes.watermark()
+        if wm is None or wm == self._checkpointed:
+            return
+        with transaction.atomic():
+            st = ReplayState.objects.select_for_update().get(pk=state.pk)
+            st.set_replay(self._replay_at[wm])
+        for seq in [s for s in self._replay_at if s <= wm]:
+            del self._replay_at[seq]
+        self._checkpointed = wm
+
+    def _drain_lanes(self, state: ReplayState):
+        """Перед steady-записом / виходом: дочекатись lane-ів і закрити checkpoint."""
+        if self._lanes is None:
+            return
+        try:
+            self._lanes.close()
+        finally:
+            # навіть якщо lane впав — фіксуємо те, що гарантовано записано
+            self._checkpoint(state, raise_errors=False)
+            self._lanes = None
+
+    def _is_behind(self, latest_commit, full_window: bool) -> bool:
+        """Gap: подія закомічена в SF давніше за поріг, або сервер віддав усе вікно (є ще)."""
+        if latest_commit is not None:
+            return (djtz.now() - latest_commit).total_seconds() > CATCHUP_LAG_SECONDS
+        return full_window
+
+    # -- main loop --
+
+    def run(self) -> Dict[str, Any]:
+        state, _ = ReplayState.objects.get_or_create(topic_name=self.topic_name)
+        reauthed = False
+        while True:
+            self._got_response = False
+            try:
+                self._consume(state)
+                break
+            except grpc.RpcError as ex:
+                # сесія SF протухла посеред stream-у: новий login і resume з checkpoint-а.
+                # Два UNAUTHENTICATED поспіль без жодної відповіді — проблема не в сесії.
+                if not is_unauthenticated(ex) or (reauthed and not self._got_response):
+                    raise
+                logger.info("Pub/Sub %s: session expired, re-authenticating", self.topic_name)
+                reset_sf()
+                reauthed = True
+                state.refresh_from_db()
+                self._replay_at.clear()  # lane-и злиті в _consume/finally; решта прийде знову
+        state.refresh_from_db()
+        return {**self.stats, "topic": self.topic_name, "replay": state.replay_id_hex}
+
+    def _consume(self, state: ReplayState):
+        preset = "CUSTOM" if state.replay_id else self.replay_preset
+        # збережений replay_id = ми були офлайн; починаємо в catch-up, поки не доженемо
+        catchup = bool(state.replay_id)
+        stream = self.client.fetch_stream(self.topic_name, preset, state.replay_id)
+        outstanding = 0
+        buffer: List[RawEvent] = []
+
+        def window() -> int:
+            return CATCHUP_OUTSTANDING * MAX_NUM_REQUESTED if catchup else self.steady_window
+
+        def top_up():
+            nonlocal outstanding
+            target = window()
+            # дозапитуємо, коли залишилось менше половини вікна (steady — коли 0)
+            if outstanding <= target // 2:
+                stream.request(target - outstanding)
+                outstanding = target
+
+        top_up()
+        try:
+            for resp in stream:
+                self._got_response = True
+                events = resp.events
+                outstanding = max(0, outstanding - len(events))
+                buffer += [(ev.event.schema_id, ev.event.payload, ev.replay_id) for ev in events]
+
+                if not events and not buffer and self._lanes is None and resp.latest_replay_id:
+                    # keepalive без подій: checkpoint, щоб replay_id не вийшов за retention
+                    st = ReplayState.objects.get(pk=state.pk)
+                    st.set_replay(resp.latest_replay_id)
+                elif buffer and (not catchup or len(buffer) >= CATCHUP_CHUNK or outstanding == 0 or len(events) < MAX_NUM_REQUESTED):
+                    newest = self._flush(state, buffer, catchup)
+                    buffer = []
+                    behind = self._is_behind(newest, len(events) >= MAX_NUM_REQUESTED)
+                    if behind != catchup:
+                        catchup = behind
+                        self.stats["mode_switches"] += 1
+                        logger.info("Pub/Sub %s: %s mode", self.topic_name, "catch-up" if catchup else "steady")
+                        if not catchup:
+                            self._drain_lanes(state)
+                            self._shutdown_pool()
+                else:
+                    self._checkpoint(state)
+                top_up()
+        finally:
+            # незбережений buffer не чіпаємо: replay_id не просунуто, SF віддасть знову
+            try:
+                self._drain_lanes(state)
+            finally:
+                self._shutdown_pool()
+                stream.close()
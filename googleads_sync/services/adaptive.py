@@ -0,0 +1,165 @@
+# googleads_sync/services/adaptive.py
+"""
+AIMD-контролер розміру batch-у і кількості паралельних mutate-запитів.
+
+- Успішний batch із латентністю в межах цілі → additive increase
+  (batch += BATCH_STEP; кожні INCREASE_EVERY успіхів ще +1 до concurrency).
+- Висока латентність або частка partial failures → multiplicative decrease batch-у.
+- Quota error → multiplicative decrease і batch-у, і concurrency.
+Стан зберігається в PushTuning(customer_id, resource) між запусками.
+"""
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, List, NamedTuple
+
+from django.conf import settings
+from django.db import connection
+
+from ..models import PendingChange, PushTuning
+from . import dead_letter, queue
+
+logger = logging.getLogger(__name__)
+
+MIN_BATCH = int(getattr(settings, "PUSH_MIN_BATCH", 10))
+MAX_BATCH = int(getattr(settings, "PUSH_MAX_BATCH", 2000))
+MAX_CONCURRENCY = int(getattr(settings, "PUSH_MAX_CONCURRENCY", 8))
+TARGET_LATENCY_MS = float(getattr(settings, "PUSH_TARGET_LATENCY_MS", 5000))
+MAX_FAILURE_RATE = float(getattr(settings, "PUSH_MAX_FAILURE_RATE", 0.2))
+# ordered lanes (services.lanes): фіксована кількість, concurrency ≤ lanes
+LANES = int(getattr(settings, "PUSH_LANES", MAX_CONCURRENCY))
+BATCH_STEP = 50
+INCREASE_EVERY = 3
+DECREASE = 0.5
+EWMA_ALPHA = 0.3
+
+
+class BatchStats(NamedTuple):
+    ops: int
+    ok: int
+    failed: int
+    latency: float        # seconds, лише сам API-виклик
+    quota_error: bool = False
+
+
+class AimdController:
+    def __init__(self, tuning: PushTuning):
+        self.tuning = tuning
+        self._streak = 0
+
+    @classmethod
+    def load(cls, customer_id: str, resource: str, default_batch: int = 200) -> "AimdController":
+        tuning, _ = PushTuning.objects.get_or_create(
+            customer_id=str(customer_id or ""),
+            resource=resource,
+            defaults={"batch_size": default_batch, "concurrency": 1},
+        )
+        return cls(tuning)
+
+    @property
+    def batch_size(self) -> int:
+        return self.tuning.batch_size
+
+    @property
+    def concurrency(self) -> int:
+        return self.tuning.concurrency
+
+    def observe(self, stats: BatchStats):
+        t = self.tuning
+        if stats.ops == 0 and not stats.quota_error:
+            return
+        latency_ms = stats.latency * 1000
+        t.ewma_latency_ms = latency_ms if not t.ewma_latency_ms else (
+            EWMA_ALPHA * latency_ms + (1 - EWMA_ALPHA) * t.ewma_latency_ms
+        )
+        failure_rate = stats.failed / stats.ops if stats.ops else 0.0
+
+        if stats.quota_error:
+            t.concurrency = max(1, int(t.concurrency * DECREASE))
+            t.batch_size = max(MIN_BATCH, int(t.batch_size * DECREASE))
+            self._streak = 0
+        elif failure_rate > MAX_FAILURE_RATE or t.ewma_latency_ms > TARGET_LATENCY_MS:
+            t.batch_size = max(MIN_BATCH, int(t.batch_size * DECREASE))
+            self._streak = 0
+        else:
+            t.batch_size = min(MAX_BATCH, t.batch_size + BATCH_STEP)
+            self._streak += 1
+            if self._streak >= INCREASE_EVERY:
+                t.concurrency = min(MAX_CONCURRENCY, t.concurrency + 1)
+                self._streak = 0
+
+    def save(self):
+        self.tuning.save(update_fields=["batch_size", "concurrency", "ewma_latency_ms", "updated_at"])
+
+
+def timed(fn, *args, **kwargs):
+    """(result, seconds) — для latency у BatchStats."""
+    started = time.monotonic()
+    result = fn(*args, **kwargs)
+    return result, time.monotonic() - started
+
+
+def _in_thread(process: Callable[[List[PendingChange]], BatchStats], rows: List[PendingChange]) -> BatchStats:
+    try:
+        return process(rows)
+    finally:
+        connection.close()  # DB-зʼєднання потоку пулу
+
+
+def run_adaptive(
+    controller: AimdController,
+    claim: Callable[[int, int, int], List[PendingChange]],
+    process: Callable[[List[PendingChange]], BatchStats],
+    lanes: int = LANES,
+) -> int:
+    """
+    Keeps up to controller.concurrency batches in flight; batch size and
+    concurrency are re-read after every completed batch. Returns ok count.
+    claim(batch_size, lane, lanes): кожен batch привʼязаний до lane
+    (key_hash % lanes) і lane має не більше одного batch-у в польоті —
+    зміни одного запису не обганяють одна одну.
+    Виняток із process() валить лише свій batch: його рядки повертаються в
+    чергу (mark_failed), контролер бачить повний failure, решта batch-ів іде далі.
+    """
+    lanes = max(1, lanes)
+    processed = 0
+    in_flight = {}  # future → (lane, rows)
+    drained = set()
+    start = 0
+    try:
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENCY) as pool:
+            while True:
+                # round-robin від різних lane-ів, щоб lane 0 не мав переваги
+                busy = {lane for lane, _rows in in_flight.values()}
+                for i in range(lanes):
+                    if len(in_flight) >= controller.concurrency:
+                        break
+                    lane = (start + i) % lanes
+                    if lane in drained or lane in busy:
+                        continue
+                    rows = claim(controller.batch_size, lane, lanes)
+                    if not rows:
+                        drained.add(lane)
+                        continue
+                    in_flight[pool.submit(_in_thread, process, rows)] = (lane, rows)
+                    busy.add(lane)
+                start += 1
+                if not in_flight:
+                    break
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    _lane, rows = in_flight.pop(fut)
+                    try:
+                        stats = fut.result()
+                    except Exception as e:
+                        logger.exception("push batch of %d rows failed", len(rows))
+                        queue.mark_failed(
+                            [r.id for r in rows], str(e), rows[0].lease_owner,
+                            details=dead_letter.error_details(e),
+                        )
+                        stats = BatchStats(ops=len(rows), ok=0, failed=len(rows), latency=0.0)
+                    controller.observe(stats)
+                    processed += stats.ok
+    finally:
+        controller.save()  # навчене за цей run не губиться навіть при падінні claim()
+    return processed
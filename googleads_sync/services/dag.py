@@ -0,0 +1,100 @@
+# googleads_sync/services/dag.py
+"""
+Declarative stage DAG → Celery canvas.
+
+Кожна слабозвʼязна компонента DAG стає окремою гілкою (chain рівнів топо-
+сортування, паралельні стадії одного рівня — group), усі гілки йдуть
+паралельно в одному chord, callback отримує результати всіх стадій.
+Час run-у ≈ найдовша гілка, а не сума всіх стадій.
+"""
+from typing import Callable, Dict, Iterable, List, NamedTuple, Tuple
+
+from celery import chain, chord, group
+from celery.canvas import Signature
+
+
+class Stage(NamedTuple):
+    name: str
+    deps: Tuple[str, ...] = ()
+    queue: str = "celery"
+
+
+def _index(stages: Iterable[Stage]) -> Dict[str, Stage]:
+    by_name = {s.name: s for s in stages}
+    for s in by_name.values():
+        unknown = [d for d in s.deps if d not in by_name]
+        if unknown:
+            raise ValueError(f"Stage {s.name!r} depends on unknown stages: {unknown}")
+    return by_name
+
+
+def levels(stages: Iterable[Stage]) -> List[List[Stage]]:
+    """Kahn topological sort grouped by depth; raises on cycles."""
+    by_name = _index(stages)
+    remaining = {name: set(s.deps) for name, s in by_name.items()}
+    out = []
+    while remaining:
+        ready = sorted(name for name, deps in remaining.items() if not deps)
+        if not ready:
+            raise ValueError(f"Cycle in stage DAG: {sorted(remaining)}")
+        out.append([by_name[n] for n in ready])
+        for n in ready:
+            del remaining[n]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+    return out
+
+
+def components(stages: Iterable[Stage]) -> List[List[Stage]]:
+    """Weakly connected components (незалежні гілки)."""
+    by_name = _index(stages)
+    neighbours: Dict[str, set] = {n: set() for n in by_name}
+    for s in by_name.values():
+        for d in s.deps:
+            neighbours[s.name].add(d)
+            neighbours[d].add(s.name)
+    seen, out = set(), []
+    for start in by_name:
+        if start in seen:
+            continue
+        stack, comp = [start], []
+        seen.add(start)
+        while stack:
+            n = stack.pop()
+            comp.append(by_name[n])
+            for m in neighbours[n] - seen:
+                seen.add(m)
+                stack.append(m)
+        out.append(comp)
+    return out
+
+
+def build_canvas(
+    stages: Iterable[Stage],
+    signature_for: Callable[[Stage], Signature],
+    callback: Signature,
+) -> Signature:
+    """
+    signature_for(stage) має повертати *mutable* signature (.s()), бо кожна
+    стадія отримує результати попередніх і передає їх далі разом зі своїм.
+    """
+    branches = []
+    for comp in components(stages):
+        parts = []
+        for level in levels(comp):
+            sigs = [signature_for(s).set(queue=s.queue) for s in level]
+            parts.append(sigs[0] if len(sigs) == 1 else group(sigs))
+        branches.append(parts[0] if len(parts) == 1 else chain(*parts))
+    return chord(group(branches), callback)
+
+
+def flatten_results(prev) -> List[dict]:
+    """Results arrive as dict / list / nested lists (group всередині chain)."""
+    if prev is None:
+        return []
+    if isinstance(prev, dict):
+        return [prev]
+    out = []
+    for item in prev:
+        out.extend(flatten_results(item))
+    return out
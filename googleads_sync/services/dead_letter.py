@@ -0,0 +1,136 @@
+# googleads_sync/services/dead_letter.py
+"""
+Dead-letter store для PendingChange, що остаточно перейшли в status='error'.
+
+services.queue пише сюди рядок щоразу, коли зміна здається (retry=False,
+вичерпані спроби, прострочений lease/horizon): повний текст помилки,
+структуровані коди Google Ads, історію спроб і оригінальний payload.
+replay() створює нові PendingChange з тих самих операцій — далі вони йдуть
+звичайним шляхом (claim_batch → adaptive push → rate limiter).
+"""
+from typing import Any, Dict, Iterable, List, Optional
+
+from django.db import transaction
+from django.db.models import QuerySet
+from django.utils import timezone as djtz
+from google.ads.googleads.errors import GoogleAdsException
+
+from ..models import DeadLetter, PendingChange
+
+STATUS_OPEN = "open"
+STATUS_REPLAYED = "replayed"
+STATUS_DISCARDED = "discarded"
+
+
+def _error_code(error_code) -> str:
+    """'quota_error.RESOURCE_EXHAUSTED' з proto-plus ErrorCode (oneof)."""
+    pb = type(error_code).pb(error_code)
+    field = pb.WhichOneof("error_code")
+    if not field:
+        return ""
+    return f"{field}.{getattr(error_code, field).name}"
+
+
+def google_ads_errors(failure) -> List[Dict[str, Any]]:
+    """GoogleAdsFailure → [{code, message, trigger, field_path, index}]."""
+    out = []
+    for err in failure.errors:
+        path = err.location.field_path_elements
+        out.append({
+            "code": _error_code(err.error_code),
+            "message": err.message,
+            "trigger": err.trigger.string_value if err.trigger else "",
+            "field_path": ".".join(e.field_name for e in path),
+            "index": path[0].index if path else None,
+        })
+    return out
+
+
+def error_details(ex: Exception) -> List[Dict[str, Any]]:
+    if isinstance(ex, GoogleAdsException):
+        details = google_ads_errors(ex.failure)
+        for d in details:
+            d["request_id"] = ex.request_id
+        return details
+    return [{"code": type(ex).__name__, "message": str(ex)}]
+
+
+def error_summary(details: Iterable[Dict[str, Any]]) -> str:
+    return "; ".join(d.get("message") or d.get("code") or "" for d in details)
+
+
+def record(rows: Iterable[PendingChange], error: str, details: Optional[List[Dict[str, Any]]] = None) -> int:
+    """rows — PendingChange у момент переходу в error (до update-у, з повним payload/history)."""
+    details = details or []
+    code = next((d["code"] for d in details if d.get("code")), "")
+    letters = [
+        DeadLetter(
+            pending_change_id=row.id,
+            pending_created_at=row.created_at,
+            resource=row.resource,
+            action=row.action,
+            payload=row.payload or {},
+            error_code=code,
+            error_message=error or "",
+            errors=details,
+            attempts=row.attempts,
+            history=row.error_history or [],
+        )
+        for row in rows
+    ]
+    DeadLetter.objects.bulk_create(letters, batch_size=1000)
+    return len(letters)
+
+
+def filter_letters(
+    resource: Optional[str] = None,
+    action: Optional[str] = None,
+    error_code: Optional[str] = None,
+    since=None,
+    until=None,
+    status: str = STATUS_OPEN,
+) -> QuerySet:
+    """error_code — префікс ('quota_error' або 'quota_error.RESOURCE_EXHAUSTED')."""
+    qs = DeadLetter.objects.filter(status=status)
+    if resource:
+        qs = qs.filter(resource=resource)
+    if action:
+        qs = qs.filter(action=action)
+    if error_code:
+        qs = qs.filter(error_code__startswith=error_code)
+    if since:
+        qs = qs.filter(created_at__gte=since)
+    if until:
+        qs = qs.filter(created_at__lt=until)
+    return qs.order_by("created_at", "id")
+
+
+def replay(letters: QuerySet, batch_size: int = 1000) -> Dict[str, int]:
+    """
+    Re-queues dead letters as fresh PendingChange rows (bulk, з priority).
+    Пачками: insert → NOTIFY → push задачі вже в роботі, поки готується наступна.
+    """
+    counts: Dict[str, int] = {}
+    letters = letters.filter(status=STATUS_OPEN)
+    while True:
+        with transaction.atomic():
+            batch = list(letters.select_for_update(skip_locked=True)[:batch_size])
+            if not batch:
+                break
+            changes = PendingChange.objects.bulk_create([
+                PendingChange(resource=dl.resource, action=dl.action, payload=dl.payload).assign_priority().assign_key()
+                for dl in batch
+            ])
+            now = djtz.now()
+            for dl, ch in zip(batch, changes):
+                dl.status = STATUS_REPLAYED
+                dl.replayed_at = now
+                dl.updated_at = now
+                dl.replay_change_id = ch.id
+                counts[dl.resource] = counts.get(dl.resource, 0) + 1
+            DeadLetter.objects.bulk_update(batch, ["status", "replayed_at", "replay_change_id", "updated_at"])
+    return counts
+
+
+def discard(letters: QuerySet) -> int:
+    return letters.update(status=STATUS_DISCARDED, updated_at=djtz.now())
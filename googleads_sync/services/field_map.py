@@ -0,0 +1,227 @@
+# googleads_sync/services/field_map.py
+"""
+Declarative SF ↔ GA field mapping, compiled once per schema.
+
+Field описує одну відповідність: ключ у нашому dict / моделі, шлях у GA
+(row або proto), SF/CDC поля-джерела, трансформації і GA enum. Mapping
+(оголошення — у services.mappers) компілює з цього:
+  - reader(): GA row → dict. Генерується Python-функція з прямими атрибутними
+    доступами (без hasattr / getattr на кожне поле), enum → name через таблицю;
+  - raw_reader(): те саме для raw protobuf GoogleAdsRow (search_stream_raw):
+    без proto-plus обгорток, enum — int → name за таблицею з descriptor-а,
+    зібраною один раз при компіляції (на першому рядку);
+  - writer(client): payload → поля proto + field mask. Невідомі SF-поля
+    ігноруються, тож CDC payload більше не setattr-иться на proto наосліп.
+"""
+import weakref
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+
+REGISTRY: Dict[str, "Mapping"] = {}
+
+
+class Field(NamedTuple):
+    name: str                          # ключ у dict / Django-моделі, ключ у payload["fields"]
+    ga: str                            # "campaign.name" — перший сегмент = обʼєкт у GA row
+    sf: Tuple[str, ...] = ()           # SF/CDC поля-джерела (перше присутнє)
+    from_ga: Optional[Callable] = None  # GA value → dict value
+    to_ga: Optional[Callable] = None   # payload value → GA value (None = пропустити поле)
+    enum: Optional[str] = None         # "CampaignStatusEnum.CampaignStatus": reader → name, writer → member
+    writable: bool = True
+    optional: bool = False             # поля може не бути в proto цієї версії API → default
+    default: Any = None
+
+
+class _NameTable(dict):
+    """enum number → name; невідомий номер (новіша версія API) → str(number)."""
+
+    def __missing__(self, number):
+        return str(number)
+
+
+def pb_enum_names(row_descriptor, path: str) -> Dict[int, str]:
+    """'campaign.status' → {number: name} з descriptor-а raw GoogleAdsRow."""
+    desc = row_descriptor
+    *parents, last = [_pb_name(p) for p in path.split(".")]
+    for name in parents:
+        desc = desc.fields_by_name[name].message_type
+    return _NameTable({v.number: v.name for v in desc.fields_by_name[last].enum_type.values})
+
+
+def _pb_name(attr: str) -> str:
+    # proto-plus додає "_" до імен, що збігаються з keyword-ами (type_ → type)
+    return attr[:-1] if attr.endswith("_") else attr
+
+
+def lazy_pb_reader(compile_fn: Callable[[Any], Callable[[Any], dict]]) -> Callable[[Any], dict]:
+    """compile_fn(row DESCRIPTOR) → read(row); компілюється на першому рядку, далі — напряму."""
+    read = None
+
+    def reader(row):
+        nonlocal read
+        if read is None:
+            read = compile_fn(row.DESCRIPTOR)
+        return read(row)
+    return reader
+
+
+def _enum_table() -> Callable[[Any], str]:
+    """Memoized enum → name (proto-plus IntEnum і raw int дають той самий ключ)."""
+    names: Dict[Any, str] = {}
+
+    def name(v):
+        try:
+            return names[v]
+        except KeyError:
+            names[v] = n = v.name if hasattr(v, "name") else str(v)
+            return n
+    return name
+
+
+class Mapping:
+    def __init__(self, name: str, fields: Iterable[Field]):
+        self.name = name
+        self.fields: Tuple[Field, ...] = tuple(fields)
+        self.by_name = {f.name: f for f in self.fields}
+        self.by_sf = {s: f for f in self.fields for s in f.sf}
+        self._reader: Optional[Callable[[Any], dict]] = None
+        self._raw_reader: Optional[Callable[[Any], dict]] = None
+        self._writers = weakref.WeakKeyDictionary()  # GoogleAdsClient → Writer (enum-и клієнта)
+        self._plain_writer: Optional["Writer"] = None
+        REGISTRY[name] = self
+
+    # ---- GA row → dict ------------------------------------------------------
+
+    def reader(self) -> Callable[[Any], dict]:
+        if self._reader is None:
+            self._reader = self._compile_reader()
+        return self._reader
+
+    def raw_reader(self) -> Callable[[Any], dict]:
+        """Reader для raw protobuf GoogleAdsRow; enum-таблиці — з descriptor-а першого рядка."""
+        if self._raw_reader is None:
+            self._raw_reader = lazy_pb_reader(self._compile_reader)
+        return self._raw_reader
+
+    def _compile_reader(self, pb_descriptor=None) -> Callable[[Any], dict]:
+        """pb_descriptor — GoogleAdsRow.DESCRIPTOR для raw protobuf; None — proto-plus."""
+        raw = pb_descriptor is not None
+        env: Dict[str, Any] = {}
+        roots: Dict[str, str] = {}
+        items = []
+        for i, f in enumerate(self.fields):
+            root, _, rest = f.ga.partition(".")
+            if raw:
+                rest = ".".join(_pb_name(p) for p in rest.split(".")) if rest else rest
+            var = roots.setdefault(root, f"r{len(roots)}")
+            expr = f"{var}.{rest}" if rest else var
+            if f.optional:
+                head, _, last = expr.rpartition(".")
+                expr = f"getattr({head}, {last!r}, _d{i})"
+                env[f"_d{i}"] = f.default
+            if f.enum and raw:
+                try:
+                    env[f"_e{i}"] = pb_enum_names(pb_descriptor, f.ga)
+                except KeyError:
+                    if not f.optional:
+                        raise
+                    env[f"_e{i}"] = _NameTable()  # поля немає в цій версії API → default через getattr
+                expr = f"_e{i}[{expr}]"
+            elif f.enum:
+                env[f"_e{i}"] = _enum_table()
+                expr = f"_e{i}({expr})"
+            if f.from_ga:
+                env[f"_c{i}"] = f.from_ga
+                expr = f"_c{i}({expr})"
+            items.append(f"        {f.name!r}: {expr},")
+        lines = ["def read(row):"]
+        lines += [f"    {var} = row.{root}" for root, var in roots.items()]
+        lines += ["    return {", *items, "    }"]
+        code = "\n".join(lines)
+        label = f"{self.name}:pb" if raw else self.name
+        exec(compile(code, f"<field_map:{label}>", "exec"), env)
+        read = env["read"]
+        read.__doc__ = f"Compiled {label} reader:\n{code}"
+        return read
+
+    # ---- payload → proto ----------------------------------------------------
+
+    def writer(self, client=None) -> "Writer":
+        """client — GoogleAdsClient для GA enum-ів; без нього enum-поля пишуться як є."""
+        if client is None:
+            if self._plain_writer is None:
+                self._plain_writer = Writer(self)
+            return self._plain_writer
+        writer = self._writers.get(client)
+        if writer is None:
+            writer = self._writers[client] = Writer(self, client)
+        return writer
+
+
+class Writer:
+    """Applies a payload to a GA proto; returns the generated field mask paths."""
+
+    def __init__(self, mapping: Mapping, client=None):
+        self.mapping = mapping
+        # (attr path у proto, converter) для кожного writable поля — один раз
+        self._plan: Dict[str, Tuple[Tuple[str, ...], Callable[[Any], Any], str]] = {}
+        for f in mapping.fields:
+            if not f.writable:
+                continue
+            path = tuple(f.ga.split(".")[1:])
+            self._plan[f.name] = (path, self._converter(f, client), ".".join(path))
+
+    @staticmethod
+    def _converter(f: Field, client) -> Callable[[Any], Any]:
+        to_ga = f.to_ga or (lambda v: v)
+        if not f.enum or client is None:
+            return to_ga
+        enum_type, _, member = f.enum.partition(".")
+        enum_cls = getattr(client.get_type(enum_type), member)
+        members = {m.name: m for m in enum_cls}
+
+        def convert(v):
+            v = to_ga(v)
+            return None if v is None else members.get(str(v).upper())
+        return convert
+
+    def values(self, payload: Dict[str, Any], changed_only: bool = True) -> Dict[str, Any]:
+        """
+        payload["fields"] — вже у наших ключах (reconcile); інакше CDC payload:
+        SF-поля з ChangeEventHeader.changedFields (changed_only) або всі, через by_sf.
+        """
+        if payload.get("fields"):
+            return {k: v for k, v in payload["fields"].items() if k in self._plan}
+        header = payload.get("ChangeEventHeader") or {}
+        names = (changed_only and header.get("changedFields")) or list(payload)
+        out = {}
+        for sf_name in names:
+            f = self.mapping.by_sf.get(sf_name)
+            if f is None or f.name not in self._plan or f.name in out or sf_name not in payload:
+                continue
+            # кілька джерел (order_id, external_id) — перше непорожнє за порядком Field.sf,
+            # а не за порядком ключів у payload
+            src = next((s for s in f.sf if payload.get(s) not in (None, "")), sf_name)
+            out[f.name] = payload[src]
+        return out
+
+    def apply(self, target, values: Dict[str, Any]) -> List[str]:
+        mask = []
+        for key, value in values.items():
+            path, convert, mask_path = self._plan[key]
+            value = convert(value)
+            if value is None:
+                continue
+            obj = target
+            for attr in path[:-1]:
+                obj = getattr(obj, attr)
+            setattr(obj, path[-1], value)
+            mask.append(mask_path)
+        return mask
+
+    def apply_payload(self, target, payload: Dict[str, Any], changed_only: bool = True) -> List[str]:
+        return self.apply(target, self.values(payload, changed_only))
+
+
+def get_mapping(name: str) -> Mapping:
+    return REGISTRY[name]
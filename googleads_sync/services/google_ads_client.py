@@ -1,7 +1,23 @@
 # googleads_sync/services/google_ads_client.py
+import hashlib
 import os
-from typing import Iterable
+import time
+from typing import Callable, Iterable, Optional, Tuple
+
+import grpc
+from django.conf import settings
 from google.ads.googleads.client import GoogleAdsClient
+from google.ads.googleads.errors import GoogleAdsException
+
+from . import metrics
+from .rate_limit import get_limiter, parse_rate
+
+GA_RATE_DEVELOPER_TOKEN = getattr(settings, "GA_RATE_DEVELOPER_TOKEN", "")  # "qps/burst"
+GA_RATE_CUSTOMER = getattr(settings, "GA_RATE_CUSTOMER", "")
+GA_QUOTA_MAX_RETRIES = int(getattr(settings, "GA_QUOTA_MAX_RETRIES", 3))
+GA_QUOTA_DEFAULT_DELAY = float(getattr(settings, "GA_QUOTA_DEFAULT_DELAY", 30))
+# GAQL streams без proto-plus (search_stream_raw + *_pb_to_dict маппери)
+GA_RAW_STREAM = bool(getattr(settings, "GA_RAW_STREAM", False))
 
 
 def _env(name: str, required: bool = True, default=None):
@@ -11,6 +27,25 @@ def _env(name: str, required: bool = True, default=None):
     return val
 
 
+def quota_retry_hint(ex: Exception) -> Tuple[Optional[float], str]:
+    """
+    (retry_delay seconds, rate_scope) для quota-помилок, інакше (None, "").
+    Google Ads кладе підказку в details.quota_error_details.retry_delay.
+    """
+    if isinstance(ex, GoogleAdsException):
+        for err in ex.failure.errors:
+            if err.error_code.quota_error:
+                details = err.details.quota_error_details
+                # proto-plus (use_proto_plus=True) віддає Duration як datetime.timedelta
+                delay = details.retry_delay.total_seconds()
+                return (delay or GA_QUOTA_DEFAULT_DELAY), details.rate_scope.name
+        if ex.error.code() == grpc.StatusCode.RESOURCE_EXHAUSTED:
+            return GA_QUOTA_DEFAULT_DELAY, ""
+    elif isinstance(ex, grpc.RpcError) and ex.code() == grpc.StatusCode.RESOURCE_EXHAUSTED:
+        return GA_QUOTA_DEFAULT_DELAY, ""
+    return None, ""
+
+
 class GoogleAds:
     def __init__(self):
         """
@@ -37,19 +72,114 @@ class GoogleAds:
         # з яким CID працювати в запитах
         self.customer_id = _env("GOOGLE_ADS_CUSTOMER_ID")
 
+        # спільні (Redis) bucket-и: на developer token і на customer
+        token_key = hashlib.sha1(config_dict["developer_token"].encode()).hexdigest()[:12]
+        self.limiter = get_limiter()
+        self.dev_bucket = parse_rate(GA_RATE_DEVELOPER_TOKEN, f"ga:dev:{token_key}")
+        self.customer_bucket = parse_rate(GA_RATE_CUSTOMER, f"ga:cust:{self.customer_id}")
+
         # ініціалізація клієнта та сервісів
         self.client: GoogleAdsClient = GoogleAdsClient.load_from_dict(config_dict)
         self.ga_service = self.client.get_service("GoogleAdsService")
         self.campaign_service = self.client.get_service("CampaignService")
 
-    def search_stream(self, gaql: str) -> Iterable:
+    def _block_for(self, ex: Exception) -> bool:
+        """Applies a server-hinted delay to the right bucket; False if not a quota error."""
+        delay, scope = quota_retry_hint(ex)
+        if delay is None:
+            return False
+        bucket = self.dev_bucket if scope == "DEVELOPER" else self.customer_bucket
+        bucket = bucket or self.dev_bucket
+        if bucket is None:
+            # GA_RATE_* не задані — нема bucket-а, на якому чекати: пауза тут, інакше retry одразу
+            time.sleep(delay)
+        else:
+            self.limiter.block(bucket, delay)
+        return True
+
+    def call(self, fn, *args, **kwargs):
+        """Rate-limited unary call; quota errors retry after the server-hinted delay."""
+        for attempt in range(GA_QUOTA_MAX_RETRIES + 1):
+            self.limiter.acquire([self.dev_bucket, self.customer_bucket])
+            metrics.add(api_calls=1)
+            try:
+                return fn(*args, **kwargs)
+            except (GoogleAdsException, grpc.RpcError) as ex:
+                if attempt == GA_QUOTA_MAX_RETRIES or not self._block_for(ex):
+                    raise
+
+    def _buckets(self, customer_id: Optional[str] = None) -> list:
+        if not customer_id or customer_id == self.customer_id:
+            return [self.dev_bucket, self.customer_bucket]
+        return [self.dev_bucket, parse_rate(GA_RATE_CUSTOMER, f"ga:cust:{customer_id}")]
+
+    def _stream_batches(self, gaql: str, customer_id: Optional[str] = None) -> Iterable:
+        """Raw protobuf SearchGoogleAdsStreamResponse batches (proto-plus лише знімається, без копії)."""
         request = self.client.get_type("SearchGoogleAdsStreamRequest")
-        request.customer_id = self.customer_id
+        request.customer_id = customer_id or self.customer_id
         request.query = gaql
-        stream = self.ga_service.search_stream(request=request)
-        for batch in stream:
-            for row in batch.results:
-                yield row
+        buckets = self._buckets(customer_id)
+        for attempt in range(GA_QUOTA_MAX_RETRIES + 1):
+            self.limiter.acquire(buckets)
+            metrics.add(api_calls=1)
+            yielded = False
+            try:
+                stream = self.ga_service.search_stream(request=request)
+                for batch in stream:
+                    pb = type(batch).pb(batch)
+                    metrics.add(rows_in=len(pb.results), bytes=pb.ByteSize())
+                    yielded = yielded or len(pb.results) > 0
+                    yield pb
+                return
+            except (GoogleAdsException, grpc.RpcError) as ex:
+                # після першого рядка повтор дав би дублікати — лише прокидаємо далі
+                if yielded or attempt == GA_QUOTA_MAX_RETRIES or not self._block_for(ex):
+                    raise
+
+    def search_stream(self, gaql: str) -> Iterable:
+        """GoogleAdsRow як proto-plus (зручно, але атрибути й enum-и повільні)."""
+        row_type = type(self.client.get_type("GoogleAdsRow"))
+        for pb in self._stream_batches(gaql):
+            for row in pb.results:
+                yield row_type.wrap(row)
+
+    def search_stream_raw(self, gaql: str, customer_id: Optional[str] = None) -> Iterable:
+        """
+        Batch-і raw protobuf SearchGoogleAdsStreamResponse: batch.results — raw
+        GoogleAdsRow. Для high-volume GAQL разом з Mapping.raw_reader() /
+        *_pb_to_dict мапперами (services.mappers). customer_id — інший акаунт
+        під тим самим login customer (MCC); за замовчуванням GOOGLE_ADS_CUSTOMER_ID.
+        """
+        return self._stream_batches(gaql, customer_id)
+
+    def search_stream_dicts(self, gaql: str, row_to_dict: Callable, pb_to_dict: Optional[Callable] = None) -> Iterable[dict]:
+        """GAQL → dict-и; з GA_RAW_STREAM (і pb_to_dict) — через raw protobuf."""
+        if GA_RAW_STREAM and pb_to_dict is not None:
+            for batch in self.search_stream_raw(gaql):
+                for row in batch.results:
+                    yield pb_to_dict(row)
+        else:
+            for row in self.search_stream(gaql):
+                yield row_to_dict(row)
+
+    def mutate_campaigns(self, operations: list, partial_failure: bool = False):
+        request = self.client.get_type("MutateCampaignsRequest")
+        request.customer_id = self.customer_id
+        request.operations.extend(operations)
+        request.partial_failure = partial_failure
+        return self.call(self.campaign_service.mutate_campaigns, request=request)
+
+    def upload_click_conversions(self, request):
+        service = self.client.get_service("ConversionUploadService")
+        return self.call(service.upload_click_conversions, request=request)
+
+    def upload_user_data(self, request):
+        service = self.client.get_service("UserDataService")
+        return self.call(service.upload_user_data, request=request)
+
+    def upload_conversion_adjustments(self, request):
+        service = self.client.get_service("ConversionAdjustmentUploadService")
+        return self.call(service.upload_conversion_adjustments, request=request)
 
     def pause_campaign(self, resource_name: str):
         op = self.client.get_type("CampaignOperation")()
@@ -59,7 +189,8 @@ class GoogleAds:
         mask = self.client.get_type("FieldMask")
         mask.paths.append("status")
         op.update_mask.CopyFrom(mask)
-        return self.campaign_service.mutate_campaigns(
+        return self.call(
+            self.campaign_service.mutate_campaigns,
             customer_id=self.customer_id,
             operations=[op],
         )
@@ -0,0 +1,162 @@
+# googleads_sync/services/id_resolver.py
+"""
+Bulk SF ↔ GA identity resolution поверх ExternalIdMap.
+
+Порядок пошуку: in-process LRU (TTL) → Redis (опційно, ID_MAP_REDIS_URL) → один
+SQL-запит на всі промахи. Нові відповідності (напр. результати GA create)
+пишуться батчем і одразу потрапляють у кеші (write-through).
+"""
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+from cachetools import TTLCache
+from django.conf import settings
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from ..models import ExternalIdMap
+
+LRU_SIZE = int(getattr(settings, "ID_MAP_LRU_SIZE", 50000))
+LRU_TTL = int(getattr(settings, "ID_MAP_LRU_TTL", 300))
+REDIS_URL = getattr(settings, "ID_MAP_REDIS_URL", "") or ""
+REDIS_TTL = int(getattr(settings, "ID_MAP_REDIS_TTL", 60 * 60 * 24))
+
+SF = "sf"
+GA = "ga"
+
+
+def _redis():
+    if not REDIS_URL:
+        return None
+    import redis  # optional: лише коли налаштований ID_MAP_REDIS_URL
+    return redis.Redis.from_url(REDIS_URL, decode_responses=True)
+
+
+class IdResolver:
+    """Resolves many ids per call; one instance per ExternalIdMap.kind."""
+
+    def __init__(self, kind: str, redis_client=None):
+        self.kind = kind
+        self._lock = threading.Lock()
+        self._cache = {SF: TTLCache(LRU_SIZE, LRU_TTL), GA: TTLCache(LRU_SIZE, LRU_TTL)}
+        self._redis = redis_client if redis_client is not None else _redis()
+
+    def _key(self, side: str, value: str) -> str:
+        return f"idmap:{self.kind}:{side}:{value}"
+
+    # ---- lookup -------------------------------------------------------------
+
+    def _resolve(self, side: str, values: Iterable[str]) -> Dict[str, str]:
+        wanted = {v for v in values if v}
+        found: Dict[str, str] = {}
+        cache = self._cache[side]
+        with self._lock:
+            for v in wanted:
+                hit = cache.get(v)
+                if hit is not None:
+                    found[v] = hit
+        missing = [v for v in wanted if v not in found]
+
+        if missing and self._redis is not None:
+            keys = [self._key(side, v) for v in missing]
+            from_redis = {v: hit for v, hit in zip(missing, self._redis.mget(keys)) if hit}
+            if from_redis:
+                found.update(from_redis)
+                with self._lock:
+                    cache.update(from_redis)
+                missing = [v for v in missing if v not in found]
+
+        if missing:
+            src, dst = ("sf_id", "ga_resource") if side == SF else ("ga_resource", "sf_id")
+            from_db = dict(
+                ExternalIdMap.objects.filter(kind=self.kind, **{f"{src}__in": missing})
+                .exclude(**{f"{dst}__isnull": True})
+                .values_list(src, dst)
+            )
+            found.update(from_db)
+            self._remember(from_db.items() if side == SF else ((s, g) for g, s in from_db.items()))
+        return found
+
+    def sf_to_ga(self, sf_ids: Iterable[str]) -> Dict[str, str]:
+        return self._resolve(SF, sf_ids)
+
+    def ga_to_sf(self, ga_resources: Iterable[str]) -> Dict[str, str]:
+        return self._resolve(GA, ga_resources)
+
+    # ---- write-through ------------------------------------------------------
+
+    def _remember(self, pairs: Iterable[Tuple[str, str]]):
+        pairs = [(s, g) for s, g in pairs if s and g]
+        if not pairs:
+            return
+        with self._lock:
+            for s, g in pairs:
+                self._cache[SF][s] = g
+                self._cache[GA][g] = s
+        if self._redis is not None:
+            pipe = self._redis.pipeline(transaction=False)
+            for s, g in pairs:
+                pipe.set(self._key(SF, s), g, ex=REDIS_TTL)
+                pipe.set(self._key(GA, g), s, ex=REDIS_TTL)
+            pipe.execute()
+
+    def forget(self, sf_id: Optional[str] = None, ga_resource: Optional[str] = None):
+        with self._lock:
+            if sf_id:
+                self._cache[SF].pop(sf_id, None)
+            if ga_resource:
+                self._cache[GA].pop(ga_resource, None)
+        if self._redis is not None:
+            keys = [self._key(SF, sf_id)] if sf_id else []
+            keys += [self._key(GA, ga_resource)] if ga_resource else []
+            if keys:
+                self._redis.delete(*keys)
+
+    def record_many(self, pairs: Iterable[Tuple[str, str]]) -> int:
+        """
+        Batch-inserts new (sf_id, ga_resource) pairs; existing ones are left untouched.
+        Returns how many of the given pairs are now stored.
+        """
+        pairs = [(s, g) for s, g in pairs if s and g]
+        if not pairs:
+            return 0
+        ExternalIdMap.objects.bulk_create(
+            [ExternalIdMap(kind=self.kind, sf_id=s, ga_resource=g) for s, g in pairs],
+            ignore_conflicts=True,
+            batch_size=1000,
+        )
+        # ignore_conflicts не каже, хто програв — кешуємо те, що реально в БД
+        stored = set(
+            ExternalIdMap.objects.filter(kind=self.kind)
+            .filter(Q(sf_id__in=[s for s, _ in pairs]) | Q(ga_resource__in=[g for _, g in pairs]))
+            .exclude(sf_id__isnull=True)
+            .exclude(ga_resource__isnull=True)
+            .values_list("sf_id", "ga_resource")
+        )
+        self._remember(stored)
+        return sum(1 for pair in pairs if pair in stored)
+
+
+_resolvers: Dict[str, IdResolver] = {}
+_resolvers_lock = threading.Lock()
+
+
+def get_resolver(kind: str) -> IdResolver:
+    with _resolvers_lock:
+        if kind not in _resolvers:
+            _resolvers[kind] = IdResolver(kind)
+        return _resolvers[kind]
+
+
+# Зміни через ORM/admin одразу відображаються в кешах цього процесу і в Redis.
+@receiver(post_save, sender=ExternalIdMap)
+def _idmap_saved(sender, instance: ExternalIdMap, **kwargs):
+    resolver = get_resolver(instance.kind)
+    resolver.forget(instance.sf_id, instance.ga_resource)
+    resolver._remember([(instance.sf_id, instance.ga_resource)])
+
+
+@receiver(post_delete, sender=ExternalIdMap)
+def _idmap_deleted(sender, instance: ExternalIdMap, **kwargs):
+    get_resolver(instance.kind).forget(instance.sf_id, instance.ga_resource)
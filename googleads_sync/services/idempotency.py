@@ -0,0 +1,143 @@
+# googleads_sync/services/idempotency.py
+"""
+Idempotency store для click conversion uploads (і enhanced conversions for leads).
+
+Ключ — sha256(conversion_action | тип:click id або хешовані email/phone | conversion_date_time | order_id),
+перші 16 байт, у ConversionKey (unique). reserve() одним
+INSERT … ON CONFLICT DO NOTHING RETURNING і перевіряє, і займає ключі всього
+batch-у; конфлікт з uploaded-ключем = дублікат, рядок відкидається ще до
+побудови запиту (конфлікт з чужою резервацією — retry пізніше).
+
+Перед БД стоїть in-process LRU лише з ПІДТВЕРДЖЕНИХ ключів: повторні CDC
+update-и того ж Lead-а відсікаються без запиту. Bloom filter тут не дає
+виграшу: для нового ключа INSERT однаково потрібен (це і є резервація), тож
+"точно ні" нічого не економить, а "можливо так" все одно йде в БД.
+Памʼять обмежена IDEMPOTENCY_LRU_SIZE; таблиця — IDEMPOTENCY_RETENTION_DAYS
+(GA не приймає конверсії для кліків, старших за 90 днів).
+"""
+import hashlib
+import threading
+from datetime import timedelta
+from typing import Dict, Iterable, Sequence, Set, Tuple
+
+from cachetools import LRUCache
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone as djtz
+
+from ..models import ConversionKey
+
+LRU_SIZE = int(getattr(settings, "IDEMPOTENCY_LRU_SIZE", 100000))
+# резервація без confirm/release довше за lease — воркер впав, ключ можна перехопити
+RESERVATION_SECONDS = int(getattr(settings, "IDEMPOTENCY_RESERVATION_SECONDS",
+                                  getattr(settings, "PENDING_CHANGE_LEASE_SECONDS", 300)))
+RETENTION_DAYS = int(getattr(settings, "IDEMPOTENCY_RETENTION_DAYS", 100))
+
+
+def conversion_key(conversion_action: str, conversion) -> bytes:
+    """
+    conversion — вже заповнений ClickConversion (значення в GA-форматі).
+    Enhanced conversions for leads без click id — ключ за хешованими user_identifiers.
+    """
+    click = (
+        f"gclid:{conversion.gclid}" if conversion.gclid
+        else f"gbraid:{conversion.gbraid}" if conversion.gbraid
+        else f"wbraid:{conversion.wbraid}" if conversion.wbraid
+        else "uid:" + ",".join(
+            ui.hashed_email or ui.hashed_phone_number for ui in conversion.user_identifiers
+        )
+    )
+    raw = "\x1f".join((conversion_action, click, conversion.conversion_date_time, conversion.order_id or ""))
+    return hashlib.sha256(raw.encode("utf-8")).digest()[:16]
+
+
+class ConversionKeys:
+    def __init__(self, lru_size: int = LRU_SIZE):
+        self._uploaded = LRUCache(lru_size)
+        self._lock = threading.Lock()
+
+    def _remember(self, digests: Iterable[bytes]):
+        with self._lock:
+            for d in digests:
+                self._uploaded[d] = True
+
+    def reserve(self, keys: Sequence[Tuple[bytes, int]]) -> Tuple[Set[int], Set[int], Set[int]]:
+        """
+        keys — [(digest, pending_change_id)] у порядку batch-у.
+        → (allowed: можна вантажити, duplicate: вже завантажено, busy: ключ зараз
+        тримає інший рядок — повторити пізніше). Дублікат у межах batch-у: лишається перший.
+        """
+        allowed: Set[int] = set()
+        dups: Set[int] = set()
+        first: Dict[bytes, int] = {}
+        with self._lock:
+            for i, (digest, _pk) in enumerate(keys):
+                if digest in self._uploaded or digest in first:
+                    dups.add(i)
+                else:
+                    first[digest] = i
+        if not first:
+            return allowed, dups, set()
+
+        table = connection.ops.quote_name(ConversionKey._meta.db_table)
+        digests = list(first)
+        with connection.cursor() as cur:
+            cur.execute(
+                f"""
+                INSERT INTO {table} (digest, pending_change_id, state, created_at)
+                SELECT d, p, %s, now() FROM unnest(%s::bytea[], %s::bigint[]) AS t(d, p)
+                ON CONFLICT (digest) DO NOTHING
+                RETURNING digest
+                """,
+                [ConversionKey.STATE_RESERVED, digests, [keys[first[d]][1] for d in digests]],
+            )
+            inserted = {bytes(row[0]) for row in cur.fetchall()}
+        allowed.update(first[d] for d in inserted)
+
+        conflicts = [d for d in digests if d not in inserted]
+        if conflicts:
+            stale = djtz.now() - timedelta(seconds=RESERVATION_SECONDS)
+            uploaded = []
+            existing = ConversionKey.objects.filter(digest__in=conflicts).values_list(
+                "digest", "pending_change_id", "state", "created_at",
+            )
+            for digest, owner_pk, state, created_at in existing:
+                digest = bytes(digest)
+                i = first[digest]
+                if state == ConversionKey.STATE_UPLOADED:
+                    uploaded.append(digest)
+                    dups.add(i)
+                elif owner_pk == keys[i][1]:
+                    allowed.add(i)  # retry того ж рядка — резервація вже наша
+                elif created_at < stale and ConversionKey.objects.filter(
+                    digest=digest, state=ConversionKey.STATE_RESERVED, created_at=created_at,
+                ).update(pending_change_id=keys[i][1], created_at=djtz.now()):
+                    allowed.add(i)  # покинута резервація (воркер впав) — перехопили
+            self._remember(uploaded)
+        # решта конфліктів: ключ тримає інший рядок або його щойно звільнили
+        busy = {first[d] for d in conflicts} - allowed - dups
+        return allowed, dups, busy
+
+    def confirm(self, digests: Iterable[bytes]) -> int:
+        digests = list(digests)
+        if not digests:
+            return 0
+        n = ConversionKey.objects.filter(digest__in=digests).update(state=ConversionKey.STATE_UPLOADED)
+        self._remember(digests)
+        return n
+
+    def release(self, digests: Iterable[bytes]) -> int:
+        """Upload не вдався — звільняємо резервацію, щоб retry міг завантажити."""
+        digests = list(digests)
+        if not digests:
+            return 0
+        return ConversionKey.objects.filter(digest__in=digests, state=ConversionKey.STATE_RESERVED).delete()[0]
+
+
+def purge(retention_days: int = RETENTION_DAYS) -> int:
+    """Ключі, старші за вікно конверсій GA, більше не можуть повторитись."""
+    cutoff = djtz.now() - timedelta(days=retention_days)
+    return ConversionKey.objects.filter(created_at__lt=cutoff).delete()[0]
+
+
+CONVERSION_KEYS = ConversionKeys()
@@ -0,0 +1,250 @@
+# googleads_sync/services/ingest.py
+"""
+HTTP ingest для org-ів без Pub/Sub: Salesforce Outbound Messages (SOAP) і
+Flow / Apex HTTP callouts (JSON, NDJSON).
+
+- Парсинг потоковий: XMLPullParser / NDJSON по рядках читають тіло шматками,
+  sObject-елементи звільняються одразу після розбору.
+- IngestBuffer (один на event loop воркера) збирає записи з усіх запитів і
+  пише їх одним bulk_create (SalesforceEvent + PendingChange) за раз —
+  group commit: запит не ходить у БД сам, а чекає спільного flush-а
+  (INGEST_DURABLE_ACK) або відповідає одразу після постановки в буфер.
+"""
+import asyncio
+import json
+import weakref
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from xml.etree.ElementTree import XMLPullParser
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone as djtz
+
+from ..models import PendingChange, SalesforceEvent
+from ..salesforce import cdc
+
+BATCH_SIZE = int(getattr(settings, "INGEST_BATCH_SIZE", 500))
+FLUSH_MS = int(getattr(settings, "INGEST_FLUSH_MS", 50))
+MAX_PENDING = int(getattr(settings, "INGEST_MAX_PENDING", 20000))  # понад це — 503, SF повторить
+DURABLE_ACK = bool(getattr(settings, "INGEST_DURABLE_ACK", True))
+READ_CHUNK = 64 * 1024
+
+XSI_TYPE = "{http://www.w3.org/2001/XMLSchema-instance}type"
+XSI_NIL = "{http://www.w3.org/2001/XMLSchema-instance}nil"
+
+OUTBOUND_ACK = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/">'
+    "<soapenv:Body>"
+    '<notificationsResponse xmlns="http://soap.sforce.com/2005/09/outbound">'
+    "<Ack>{ack}</Ack>"
+    "</notificationsResponse>"
+    "</soapenv:Body>"
+    "</soapenv:Envelope>"
+)
+
+# (object_name, payload, received_at)
+Item = Tuple[str, Dict[str, Any], Any]
+
+
+class IngestOverloaded(Exception):
+    pass
+
+
+def _local(tag: str) -> str:
+    return tag.rpartition("}")[2]
+
+
+def read_chunks(stream, size: int = READ_CHUNK) -> Iterator[bytes]:
+    while True:
+        chunk = stream.read(size)
+        if not chunk:
+            return
+        yield chunk
+
+
+# ---- parsers --------------------------------------------------------------------
+
+def parse_outbound_message(chunks: Iterable[bytes]) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    SOAP notifications → (OrganizationId, [CDC-подібний payload]).
+    Кожен <Notification><sObject xsi:type="sf:Lead">…</sObject></Notification>
+    стає payload-ом через cdc.from_record; Notification Id — у "_notification_id".
+    """
+    parser = XMLPullParser(events=("end",))
+    org_id = ""
+    records: List[Dict[str, Any]] = []
+    notification_id = ""
+    pending: List[Dict[str, Any]] = []
+    for chunk in chunks:
+        parser.feed(chunk)
+        for _event, elem in parser.read_events():
+            name = _local(elem.tag)
+            if name == "OrganizationId":
+                org_id = (elem.text or "").strip()
+            elif name == "Id" and elem.tag.startswith("{http://soap.sforce.com/2005/09/outbound}"):
+                notification_id = (elem.text or "").strip()
+            elif name == "sObject":
+                entity = (elem.get(XSI_TYPE) or "").rpartition(":")[2]
+                fields = {
+                    _local(child.tag): None if child.get(XSI_NIL) == "true" else child.text
+                    for child in elem
+                }
+                pending.append(cdc.from_record(fields, entity=entity))
+            elif name == "Notification":
+                for payload in pending:
+                    payload["_notification_id"] = notification_id
+                records += pending
+                pending, notification_id = [], ""
+                elem.clear()
+    parser.close()
+    return org_id, records
+
+
+def _record_payload(obj: Dict[str, Any], entity: Optional[str]) -> Dict[str, Any]:
+    if not isinstance(obj, dict):
+        # ValueError → 400 у view, а не 500 з AttributeError
+        raise ValueError(f"record must be a JSON object, got {type(obj).__name__}")
+    if obj.get("ChangeEventHeader"):
+        return obj  # вже CDC-формат
+    change_type = obj.pop("changeType", None)
+    return cdc.from_record(obj, entity=entity, change_type=change_type)
+
+
+def parse_json(body: bytes, entity: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Один обʼєкт, масив або {"records": [...]} (sObject з attributes.type або CDC payload)."""
+    data = json.loads(body or b"null")
+    if isinstance(data, dict) and isinstance(data.get("records"), list):
+        data = data["records"]
+    if isinstance(data, dict):
+        data = [data]
+    if not isinstance(data, list):
+        raise ValueError("JSON body must be an object or an array of objects")
+    return [_record_payload(obj, entity) for obj in data]
+
+
+def parse_ndjson(chunks: Iterable[bytes], entity: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    tail = b""
+    for chunk in chunks:
+        lines = (tail + chunk).split(b"\n")
+        tail = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield _record_payload(json.loads(line), entity)
+    if tail.strip():
+        yield _record_payload(json.loads(tail), entity)
+
+
+# ---- batching buffer ------------------------------------------------------------
+
+def write_items(items: List[Item]) -> Dict[str, int]:
+    events, changes = [], []
+    for object_name, payload, received_at in items:
+        commit_at = cdc.commit_time(payload)
+        event = SalesforceEvent(
+            object_name=object_name,
+            sf_id=cdc.record_id(payload),
+            payload=payload,
+            received_at=received_at,
+            commit_at=commit_at,
+        )
+        events.append(event)
+        changes += [(event, ch) for ch in cdc.to_pending_changes(payload, received_at, commit_at)]
+    with transaction.atomic():
+        SalesforceEvent.objects.bulk_create(events, batch_size=1000)
+        if changes:
+            for event, ch in changes:
+                ch.source_event_id = event.pk
+            PendingChange.objects.bulk_create([ch for _, ch in changes], batch_size=1000)
+    return {"events": len(events), "changes": len(changes)}
+
+
+class IngestBuffer:
+    """
+    Накопичує записи з конкурентних запитів; flush — коли набралось
+    BATCH_SIZE або минуло FLUSH_MS від першого запису в batch-і.
+    Один flush за раз: поки він іде в БД, наступний batch росте.
+    """
+
+    def __init__(self, batch_size: int = BATCH_SIZE, flush_ms: int = FLUSH_MS, max_pending: int = MAX_PENDING):
+        self.batch_size = batch_size
+        self.delay = flush_ms / 1000.0
+        self.max_pending = max_pending
+        self._items: List[Item] = []
+        self._waiters: List[asyncio.Future] = []
+        self._kick = asyncio.Event()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def pending(self) -> int:
+        return len(self._items)
+
+    def add(self, object_name: str, payloads: List[Dict[str, Any]]) -> asyncio.Future:
+        """Future завершується результатом flush-а, що записав ці payload-и."""
+        loop = asyncio.get_running_loop()
+        if len(self._items) + len(payloads) > self.max_pending:
+            raise IngestOverloaded(f"ingest buffer full ({len(self._items)} pending)")
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._run())
+        fut = loop.create_future()
+        if not payloads:
+            fut.set_result({"events": 0, "changes": 0})
+            return fut
+        if not self._items:
+            self._timer = loop.call_later(self.delay, self._kick.set)
+        now = djtz.now()
+        self._items += [(object_name, p, now) for p in payloads]
+        self._waiters.append(fut)
+        if len(self._items) >= self.batch_size:
+            self._kick.set()
+        return fut
+
+    async def _run(self):
+        while True:
+            await self._kick.wait()
+            self._kick.clear()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._items:
+                continue
+            items, waiters = self._items, self._waiters
+            self._items, self._waiters = [], []
+            try:
+                res = await sync_to_async(write_items, thread_sensitive=False)(items)
+            except Exception as e:
+                for fut in waiters:
+                    if not fut.done():
+                        fut.set_exception(e)
+            else:
+                for fut in waiters:
+                    if not fut.done():
+                        fut.set_result(res)
+            if self._items:
+                # за час flush-а набігло — наступний batch одразу, якщо вже повний
+                if len(self._items) >= self.batch_size:
+                    self._kick.set()
+                elif self._timer is None:
+                    self._timer = asyncio.get_running_loop().call_later(self.delay, self._kick.set)
+
+
+_buffers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, IngestBuffer]" = weakref.WeakKeyDictionary()
+
+
+def get_buffer() -> IngestBuffer:
+    loop = asyncio.get_running_loop()
+    buf = _buffers.get(loop)
+    if buf is None:
+        buf = _buffers[loop] = IngestBuffer()
+    return buf
+
+
+async def enqueue(object_name: str, payloads: List[Dict[str, Any]], durable: bool = DURABLE_ACK) -> int:
+    """durable=True — повертається після коміту batch-у (SF не втратить подію, якщо ми впадемо)."""
+    fut = get_buffer().add(object_name, payloads)
+    if durable:
+        await fut
+    else:
+        fut.add_done_callback(lambda f: f.exception())  # не лишати "exception never retrieved"
+    return len(payloads)
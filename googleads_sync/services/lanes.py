@@ -0,0 +1,128 @@
+# googleads_sync/services/lanes.py
+"""
+Key-partitioned ordered lanes.
+
+Подія / зміна потрапляє в lane = hash(ключ запису) % N. Усередині lane
+обробка строго послідовна (update → delete одного запису не переставляться),
+різні lane-и йдуть паралельно.
+
+OrderedLanes — потоки-виконавці з FIFO на lane і low watermark: найбільший
+seq, до якого включно ВСЕ завершено в усіх lane-ах. Checkpoint (replay_id)
+можна просувати лише до нього — at-least-once зберігається.
+Push-шлях використовує той самий key_hash на PendingChange (queue.claim_batch
+з lane=...), а не цей executor: там роботу роздає БД.
+"""
+import queue
+import threading
+import zlib
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from django.db import connections
+
+_STOP = object()
+
+
+def key_hash(key: Optional[str]) -> Optional[int]:
+    """Стабільний між процесами hash (crc32, 31 біт — влазить у PositiveIntegerField)."""
+    if not key:
+        return None
+    return zlib.crc32(str(key).encode("utf-8")) & 0x7FFFFFFF
+
+
+def lane_of(key: Optional[str], lanes: int) -> int:
+    h = key_hash(key)
+    return 0 if h is None else h % lanes
+
+
+class LaneError(RuntimeError):
+    pass
+
+
+class OrderedLanes:
+    """
+    submit(key, seqs, fn, *args): fn(*args) виконується в lane ключа після всіх
+    попередніх задач цього lane; seqs (монотонні номери подій) позначаються
+    завершеними разом із задачею. watermark() — low watermark по всіх lane-ах.
+    Перша помилка зупиняє lane (watermark далі не рухається) і перекидається
+    з raise_if_failed() / close().
+    """
+
+    def __init__(self, lanes: int, max_pending: int = 4, name: str = "lane"):
+        self.lanes = max(1, lanes)
+        self._queues: List["queue.Queue"] = [queue.Queue(maxsize=max_pending) for _ in range(self.lanes)]
+        self._lock = threading.Lock()
+        self._submitted: List[int] = []   # seqs у порядку submit (монотонні)
+        self._done: set = set()
+        self._watermark: Optional[int] = None
+        self._error: Optional[BaseException] = None
+        self._threads = [
+            threading.Thread(target=self._worker, args=(i,), name=f"{name}-{i}", daemon=True)
+            for i in range(self.lanes)
+        ]
+        for t in self._threads:
+            t.start()
+
+    def _worker(self, lane: int):
+        q = self._queues[lane]
+        try:
+            while True:
+                item = q.get()
+                if item is _STOP:
+                    return
+                seqs, fn, args = item
+                if self._error is not None:
+                    continue  # після помилки лише звільняємо чергу
+                try:
+                    fn(*args)
+                except BaseException as e:
+                    with self._lock:
+                        self._error = self._error or e
+                    continue
+                with self._lock:
+                    self._done.update(seqs)
+        finally:
+            # Django-зʼєднання thread-local: закриваємо свої
+            connections.close_all()
+
+    def submit(self, key: Optional[str], seqs: Iterable[int], fn: Callable, *args: Any):
+        self.submit_to(lane_of(key, self.lanes), seqs, fn, *args)
+
+    def submit_to(self, lane: int, seqs: Iterable[int], fn: Callable, *args: Any):
+        """Блокує, якщо lane має max_pending задач у черзі (backpressure)."""
+        self.raise_if_failed()
+        seqs = list(seqs)
+        with self._lock:
+            self._submitted.extend(seqs)
+        self._queues[lane].put((seqs, fn, args))
+
+    def watermark(self) -> Optional[int]:
+        with self._lock:
+            self._submitted.sort()
+            i = 0
+            while i < len(self._submitted) and self._submitted[i] in self._done:
+                self._done.discard(self._submitted[i])
+                i += 1
+            if i:
+                self._watermark = self._submitted[i - 1]
+                del self._submitted[:i]
+            return self._watermark
+
+    def raise_if_failed(self):
+        if self._error is not None:
+            raise LaneError(f"lane task failed: {self._error!r}") from self._error
+
+    def close(self, wait: bool = True):
+        for q in self._queues:
+            q.put(_STOP)
+        if wait:
+            for t in self._threads:
+                t.join()
+        self.raise_if_failed()
+
+
+def partition(items: Iterable[Any], key: Callable[[Any], Optional[str]], lanes: int) -> Dict[int, List[Any]]:
+    """Групує items по lane-ах, зберігаючи порядок усередині кожного."""
+    out: Dict[int, List[Any]] = {}
+    for item in items:
+        out.setdefault(lane_of(key(item), lanes), []).append(item)
+    return out
@@ -0,0 +1,103 @@
+# googleads_sync/services/latency.py
+"""
+End-to-end sync latency: SF commit → Pub/Sub received → enqueued → claimed → applied in GA.
+
+Часові мітки живуть на PendingChange (source_commit_at, source_received_at,
+created_at, claimed_at, applied_at). Перцентилі й гістограми рахує Postgres
+(percentile_cont / width_bucket) по застосованих змінах за період.
+"""
+from datetime import timedelta
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone as djtz
+
+from ..models import PendingChange
+
+# (назва, початок, кінець) — колонки PendingChange
+STAGES = (
+    ("sf_to_received", "source_commit_at", "source_received_at"),
+    ("received_to_enqueued", "source_received_at", "created_at"),
+    ("enqueued_to_claimed", "created_at", "claimed_at"),
+    ("claimed_to_applied", "claimed_at", "applied_at"),
+    ("end_to_end", "source_commit_at", "applied_at"),
+)
+PERCENTILES = (0.5, 0.9, 0.95, 0.99)
+# межі бакетів гістограми, секунди
+HISTOGRAM_BOUNDS = tuple(getattr(settings, "LATENCY_HISTOGRAM_BOUNDS", (1, 2, 5, 10, 30, 60, 300, 900, 3600)))
+
+
+def _seconds(start: str, end: str) -> str:
+    return f"EXTRACT(EPOCH FROM ({end} - {start}))"
+
+
+def report(since=None, until=None, resource: Optional[str] = None) -> List[Dict]:
+    """
+    [{resource, action, stage, count, p50, p90, p95, p99, max, histogram: [(≤bound, n), ...]}]
+    за applied_at у [since, until); за замовчуванням — останні 24 години.
+    """
+    until = until or djtz.now()
+    since = since or until - timedelta(days=1)
+    table = connection.ops.quote_name(PendingChange._meta.db_table)
+    pct_cols = ", ".join(
+        f"percentile_cont({p}) WITHIN GROUP (ORDER BY s)" for p in PERCENTILES
+    )
+    bounds = "ARRAY[" + ", ".join(str(float(b)) for b in HISTOGRAM_BOUNDS) + "]::float8[]"
+
+    out: List[Dict] = []
+    with connection.cursor() as cur:
+        for stage, start, end in STAGES:
+            where = [
+                "status = 'done'",
+                "applied_at >= %s",
+                "applied_at < %s",
+                # pruning партицій PendingChange: created_at не пізніше за applied_at
+                "created_at < %s",
+                f"{start} IS NOT NULL",
+                f"{end} IS NOT NULL",
+            ]
+            params = [since, until, until]
+            if resource:
+                where.append("resource = %s")
+                params.append(resource)
+            base = f"SELECT resource, action, GREATEST({_seconds(start, end)}, 0)::float8 AS s FROM {table} WHERE {' AND '.join(where)}"
+            cur.execute(
+                f"""
+                WITH d AS ({base})
+                SELECT resource, action, count(s), {pct_cols}, max(s),
+                       array_agg(b ORDER BY b) FILTER (WHERE b IS NOT NULL), array_agg(n ORDER BY b) FILTER (WHERE b IS NOT NULL)
+                FROM (
+                    SELECT resource, action, s, NULL::int AS b, NULL::bigint AS n FROM d
+                    UNION ALL
+                    SELECT resource, action, NULL, width_bucket(s, {bounds}), count(*) FROM d
+                    GROUP BY resource, action, width_bucket(s, {bounds})
+                ) x
+                GROUP BY resource, action
+                ORDER BY resource, action
+                """,
+                params,
+            )
+            for row in cur.fetchall():
+                res, action, count = row[0], row[1], row[2]
+                pcts = row[3:3 + len(PERCENTILES)]
+                max_s, buckets, counts = row[3 + len(PERCENTILES):]
+                out.append({
+                    "resource": res,
+                    "action": action,
+                    "stage": stage,
+                    "count": count,
+                    **{f"p{int(p * 100)}": v for p, v in zip(PERCENTILES, pcts)},
+                    "max": max_s,
+                    "histogram": _histogram(buckets or [], counts or []),
+                })
+    return out
+
+
+def _histogram(buckets: List[int], counts: List[int]) -> List[tuple]:
+    """width_bucket i → (верхня межа або '>last', кількість) для всіх бакетів."""
+    by_bucket = dict(zip(buckets, counts))
+    labels = [f"<{b}s" for b in HISTOGRAM_BOUNDS[:1]]
+    labels += [f"{lo}-{hi}s" for lo, hi in zip(HISTOGRAM_BOUNDS, HISTOGRAM_BOUNDS[1:])]
+    labels += [f">{HISTOGRAM_BOUNDS[-1]}s"]
+    return [(label, by_bucket.get(i, 0)) for i, label in enumerate(labels)]
@@ -1,20 +1,265 @@
-from datetime import datetime
+import re
+from datetime import date, datetime, timedelta, timezone
+
+from .field_map import Field, Mapping, lazy_pb_reader, pb_enum_names
 
 def to_dt(ts: str | None):
     if not ts:
         return None
     return datetime.fromisoformat(ts.replace("Z", "+00:00"))
 
-def campaign_row_to_dict(row):
+def epoch_ms_to_dt(ms) -> datetime | None:
+    """CDC ChangeEventHeader.commitTimestamp (epoch ms) → aware datetime."""
+    if not ms:
+        return None
+    return datetime.fromtimestamp(int(ms) / 1000.0, tz=timezone.utc)
+
+def _enum_name(v) -> str:
+    return v.name if hasattr(v, "name") else str(v)
+
+# ---- Snapshot mappers (GA row -> поля snapshot-моделі) ----------------------
+
+def campaign_snapshot_row_to_dict(row):
     c = row.campaign
     return {
-        "resource_name": c.resource_name,
-        "campaign_id": int(c.id),
+        "external_id": c.resource_name,
         "name": c.name,
-        "status": c.status.name if hasattr(c.status, "name") else str(c.status),
-        "advertising_channel_type": c.advertising_channel_type.name if hasattr(c.advertising_channel_type, "name") else str(c.advertising_channel_type),
-        "budget_micros": None,
-        "start_date": str(c.start_date) or None,
-        "end_date": str(c.end_date) or None,
-        "external_updated_at": to_dt(getattr(c, "last_modified_time", None)),
+        "status": _enum_name(c.status),
+        "channel_type": _enum_name(c.advertising_channel_type),
+        "campaign_budget_micros": int(row.campaign_budget.amount_micros) or None,
+        "raw_payload": {
+            "id": int(c.id),
+            "start_date": str(c.start_date),
+            "end_date": str(c.end_date),
+            "campaign_budget": c.campaign_budget,
+        },
+    }
+
+def ad_group_snapshot_row_to_dict(row):
+    g = row.ad_group
+    return {
+        "external_id": g.resource_name,
+        "campaign_external_id": g.campaign,
+        "name": g.name,
+        "status": _enum_name(g.status),
+        "type": _enum_name(g.type_),
+        "raw_payload": {
+            "id": int(g.id),
+            "cpc_bid_micros": int(g.cpc_bid_micros),
+        },
+    }
+
+def ad_snapshot_row_to_dict(row):
+    a = row.ad_group_ad
+    return {
+        "external_id": a.resource_name,
+        "ad_group_external_id": a.ad_group,
+        "name": a.ad.name,
+        "status": _enum_name(a.status),
+        "ad_type": _enum_name(a.ad.type_),
+        "raw_payload": {
+            "id": int(a.ad.id),
+            "campaign": row.campaign.resource_name,
+            "final_urls": list(a.ad.final_urls),
+        },
+    }
+
+# ---- Raw protobuf варіанти (GoogleAds.search_stream_raw) ---------------------
+# Ті самі dict-и, але з raw GoogleAdsRow: enum — int, таблиці name збираються з
+# descriptor-а на першому рядку; proto-plus "type_" у raw protobuf — "type".
+
+def _campaign_snapshot_pb(desc):
+    status = pb_enum_names(desc, "campaign.status")
+    channel = pb_enum_names(desc, "campaign.advertising_channel_type")
+
+    def read(row):
+        c = row.campaign
+        return {
+            "external_id": c.resource_name,
+            "name": c.name,
+            "status": status[c.status],
+            "channel_type": channel[c.advertising_channel_type],
+            "campaign_budget_micros": row.campaign_budget.amount_micros or None,
+            "raw_payload": {
+                "id": c.id,
+                "start_date": c.start_date,
+                "end_date": c.end_date,
+                "campaign_budget": c.campaign_budget,
+            },
+        }
+    return read
+
+def _ad_group_snapshot_pb(desc):
+    status = pb_enum_names(desc, "ad_group.status")
+    group_type = pb_enum_names(desc, "ad_group.type")
+
+    def read(row):
+        g = row.ad_group
+        return {
+            "external_id": g.resource_name,
+            "campaign_external_id": g.campaign,
+            "name": g.name,
+            "status": status[g.status],
+            "type": group_type[g.type],
+            "raw_payload": {
+                "id": g.id,
+                "cpc_bid_micros": g.cpc_bid_micros,
+            },
+        }
+    return read
+
+def _ad_snapshot_pb(desc):
+    status = pb_enum_names(desc, "ad_group_ad.status")
+    ad_type = pb_enum_names(desc, "ad_group_ad.ad.type")
+
+    def read(row):
+        a = row.ad_group_ad
+        return {
+            "external_id": a.resource_name,
+            "ad_group_external_id": a.ad_group,
+            "name": a.ad.name,
+            "status": status[a.status],
+            "ad_type": ad_type[a.ad.type],
+            "raw_payload": {
+                "id": a.ad.id,
+                "campaign": row.campaign.resource_name,
+                "final_urls": list(a.ad.final_urls),
+            },
+        }
+    return read
+
+def _campaign_metrics_pb(desc):
+    device = pb_enum_names(desc, "segments.device")
+
+    def read(row):
+        m = row.metrics
+        # порядок = services.campaign_metrics.COLUMNS (COPY у staging)
+        return (
+            row.customer.id,
+            row.campaign.id,
+            row.segments.date,
+            device[row.segments.device],
+            m.impressions,
+            m.clicks,
+            m.cost_micros,
+            m.conversions,
+            m.conversions_value,
+        )
+    return read
+
+campaign_snapshot_pb_to_dict = lazy_pb_reader(_campaign_snapshot_pb)
+ad_group_snapshot_pb_to_dict = lazy_pb_reader(_ad_group_snapshot_pb)
+ad_snapshot_pb_to_dict = lazy_pb_reader(_ad_snapshot_pb)
+campaign_metrics_pb_to_row = lazy_pb_reader(_campaign_metrics_pb)
+
+# ---- Reconciliation: нормалізація обох сторін до спільного вигляду ----------
+
+GA_STATUSES = ("ENABLED", "PAUSED", "REMOVED")
+
+def sf_campaign_to_dict(rec):
+    """SF Campaign (SOQL/Bulk row) → {"sf_id", "name", "status"} у термінах GA."""
+    status = (rec.get("Status") or "").upper()
+    if status not in GA_STATUSES:
+        is_active = rec.get("IsActive")
+        active = is_active is True or str(is_active).lower() == "true"
+        status = "ENABLED" if active else "PAUSED"
+    return {
+        "sf_id": rec.get("Id") or "",
+        "name": (rec.get("Name") or "").strip(),
+        "status": status,
+    }
+
+# ---- Declarative SF ↔ GA mappings (компілюються services.field_map) -------
+
+def _empty_to_none(v):
+    return str(v) or None
+
+def _sf_status(v):
+    s = (v or "").upper()
+    return s if s in GA_STATUSES else None
+
+def _sf_date(v):
+    """SF Date '2025-09-13' або CDC epoch days (int) → 'YYYY-MM-DD'."""
+    if v in (None, ""):
+        return None
+    if isinstance(v, int):
+        return (date(1970, 1, 1) + timedelta(days=v)).isoformat()
+    return str(v)[:10]
+
+def _sf_conversion_time(v):
+    # SF datetime → формат GA; значення, що вже у форматі GA, лишаємо як є
+    return sf_datetime_to_ga(v) if v and "T" in v else v
+
+CAMPAIGN = Mapping("campaign", [
+    Field("resource_name", "campaign.resource_name", writable=False),
+    Field("campaign_id", "campaign.id", from_ga=int, writable=False),
+    Field("name", "campaign.name", sf=("Name",), to_ga=lambda v: (v or "").strip() or None),
+    Field("status", "campaign.status", sf=("Status",), enum="CampaignStatusEnum.CampaignStatus", to_ga=_sf_status),
+    Field("advertising_channel_type", "campaign.advertising_channel_type",
+          enum="AdvertisingChannelTypeEnum.AdvertisingChannelType", writable=False),
+    Field("start_date", "campaign.start_date", sf=("StartDate",), from_ga=_empty_to_none, to_ga=_sf_date),
+    Field("end_date", "campaign.end_date", sf=("EndDate",), from_ga=_empty_to_none, to_ga=_sf_date),
+    Field("external_updated_at", "campaign.last_modified_time", from_ga=to_dt, writable=False, optional=True),
+])
+
+CLICK_CONVERSION = Mapping("click_conversion", [
+    Field("gclid", "click_conversion.gclid", sf=("gclid",)),
+    Field("gbraid", "click_conversion.gbraid", sf=("gbraid",)),
+    Field("wbraid", "click_conversion.wbraid", sf=("wbraid",)),
+    Field("conversion_date_time", "click_conversion.conversion_date_time", sf=("conversion_time",),
+          to_ga=_sf_conversion_time),
+    Field("conversion_value", "click_conversion.conversion_value", sf=("conversion_value",), to_ga=float),
+    Field("currency_code", "click_conversion.currency_code", sf=("currency_code",)),
+    Field("order_id", "click_conversion.order_id", sf=("order_id", "external_id"),
+          to_ga=lambda v: str(v) if v else None),
+])
+
+def _sf_amount(v):
+    return float(v) if v not in (None, "") else None
+
+# Opportunity → ConversionAdjustment.restatement_value (order_id і тип — у pipelines)
+CONVERSION_ADJUSTMENT = Mapping("conversion_adjustment", [
+    Field("adjusted_value", "conversion_adjustment.restatement_value.adjusted_value", sf=("Amount",),
+          to_ga=_sf_amount),
+    Field("currency_code", "conversion_adjustment.restatement_value.currency_code", sf=("CurrencyIsoCode",)),
+])
+
+# GA campaign row → dict для Campaign (згенерована функція, без hasattr на поле)
+campaign_row_to_dict = CAMPAIGN.reader()
+campaign_pb_to_dict = CAMPAIGN.raw_reader()
+
+def ga_campaign_to_reconcile_dict(row):
+    data = campaign_row_to_dict(row)
+    return {
+        "resource_name": data["resource_name"],
+        "name": (data["name"] or "").strip(),
+        "status": data["status"],
+    }
+
+_BASIC_OFFSET = re.compile(r"([+-]\d{2})(\d{2})$")
+
+def sf_datetime_to_ga(ts: str | None) -> str | None:
+    """
+    '2025-09-13T10:00:00.000+0000' / '2025-09-13T10:00:00Z' / '...+00:00'
+    → '2025-09-13 10:00:00+00:00' (формат GA conversions); мілісекунди не обовʼязкові.
+    Без offset — UTC (SF API віддає час в UTC).
+    """
+    if not ts:
+        return None
+    # fromisoformat до 3.11 не знає ні "Z", ні offset без двокрапки
+    dt = datetime.fromisoformat(_BASIC_OFFSET.sub(r"\1:\2", ts.strip().replace("Z", "+00:00")))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    tz = dt.strftime("%z")
+    return f"{dt.strftime('%Y-%m-%d %H:%M:%S')}{tz[:3]}:{tz[3:]}"
+
+def sf_lead_to_dict(rec, gclid_field: str):
+    return {
+        "sf_id": rec.get("Id") or "",
+        "gclid": rec.get(gclid_field) or "",
+        "status": rec.get("Status") or "",
+        "email": rec.get("Email") or "",
+        "phone": rec.get("Phone") or "",
+        # CreatedDate, не LastModifiedDate: час конверсії має бути стабільним між reconcile-ами
+        "conversion_time": sf_datetime_to_ga(rec.get("CreatedDate")),
     }
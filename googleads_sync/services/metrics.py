@@ -0,0 +1,45 @@
+# googleads_sync/services/metrics.py
+"""
+Per-stage counters (rows in/out, API calls, errors, bytes) для SyncStageRun.
+
+run_stage відкриває collect(); сервіси (GoogleAds, SF session, queue) лише
+викликають add(). Лічильник на процес, а не contextvar: Celery prefork виконує
+одну задачу на процес, а потоки пулів (adaptive push, sharded snapshots)
+мають рахуватись у ту ж стадію.
+"""
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+FIELDS = ("rows_in", "rows_out", "api_calls", "errors", "bytes")
+
+
+class Counters:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.values: Dict[str, int] = dict.fromkeys(FIELDS, 0)
+
+    def add(self, **deltas: int):
+        with self._lock:
+            for k, v in deltas.items():
+                self.values[k] += int(v or 0)
+
+
+_current: Optional[Counters] = None
+
+
+def add(**deltas: int):
+    """No-op поза стадією pipeline-а."""
+    counters = _current
+    if counters is not None:
+        counters.add(**deltas)
+
+
+@contextmanager
+def collect():
+    global _current
+    previous, _current = _current, Counters()
+    try:
+        yield _current
+    finally:
+        _current = previous
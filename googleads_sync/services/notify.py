@@ -0,0 +1,100 @@
+# googleads_sync/services/notify.py
+"""
+Event-driven push: PendingChange INSERT → pg_notify → listener → push task.
+
+Statement-level тригер (transition table) шле по одному NOTIFY на resource
+на statement, тож bulk_create на тисячі рядків дає одне повідомлення;
+однакові payload-и в межах транзакції Postgres ще й дедуплікує.
+Listener збирає повідомлення за вікно DEBOUNCE_MS і запускає push лише для
+зачеплених resource-ів. Beat-polling лишається страховкою.
+"""
+import logging
+import select
+import time
+from typing import Callable, Set
+
+from django.conf import settings
+from django.db import connection
+
+from ..models import PendingChange
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = getattr(settings, "PENDING_CHANGE_NOTIFY_CHANNEL", "pending_change")
+DEBOUNCE_MS = int(getattr(settings, "PENDING_CHANGE_NOTIFY_DEBOUNCE_MS", 500))
+IDLE_SECONDS = 30  # як часто перевіряти зʼєднання без повідомлень
+
+_FUNCTION = "googleads_sync_pendingchange_notify"
+_TRIGGER = "googleads_sync_pendingchange_notify_trg"
+
+
+def install_trigger(cur=None):
+    """Idempotent (CREATE OR REPLACE / DROP IF EXISTS); після convert_to_partitioned треба повторити."""
+    table = connection.ops.quote_name(PendingChange._meta.db_table)
+    statements = [
+        f"""
+        CREATE OR REPLACE FUNCTION {_FUNCTION}() RETURNS trigger AS $$
+        DECLARE r text;
+        BEGIN
+          FOR r IN SELECT DISTINCT resource FROM new_rows WHERE status = 'pending' LOOP
+            PERFORM pg_notify('{CHANNEL}', r);
+          END LOOP;
+          RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        f"DROP TRIGGER IF EXISTS {_TRIGGER} ON {table}",
+        f"""
+        CREATE TRIGGER {_TRIGGER} AFTER INSERT ON {table}
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION {_FUNCTION}()
+        """,
+    ]
+    if cur is not None:
+        for sql in statements:
+            cur.execute(sql)
+        return
+    with connection.cursor() as c:
+        for sql in statements:
+            c.execute(sql)
+
+
+def listen(dispatch: Callable[[Set[str]], None], debounce_ms: int = DEBOUNCE_MS):
+    """
+    Blocks on LISTEN; кожне повідомлення відкриває вікно debounce_ms, усі
+    resource-и, що прийшли за вікно, передаються в dispatch() одним викликом.
+    """
+    connection.ensure_connection()
+    connection.set_autocommit(True)  # NOTIFY доставляється лише поза транзакцією
+    conn = connection.connection
+    # raw psycopg2 (cursor / poll) кидає psycopg2.OperationalError — перекладаємо
+    # у django.db.*Error, які ловить reconnect-цикл listen_pending_changes
+    with connection.wrap_database_errors:
+        with conn.cursor() as cur:
+            cur.execute(f"LISTEN {CHANNEL}")
+        logger.info("Listening on %s (debounce %sms)", CHANNEL, debounce_ms)
+
+        while True:
+            if not _wait(conn, IDLE_SECONDS):
+                continue
+            resources = _drain(conn)
+            deadline = time.monotonic() + debounce_ms / 1000.0
+            while (left := deadline - time.monotonic()) > 0:
+                if _wait(conn, left):
+                    resources |= _drain(conn)
+            if resources:
+                dispatch(resources)
+
+
+def _wait(conn, timeout: float) -> bool:
+    readable, _, _ = select.select([conn], [], [], timeout)
+    if readable:
+        conn.poll()
+    return bool(conn.notifies)
+
+
+def _drain(conn) -> Set[str]:
+    out = {n.payload for n in conn.notifies}
+    conn.notifies.clear()
+    return out
+
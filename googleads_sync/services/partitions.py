@@ -0,0 +1,281 @@
+# googleads_sync/services/partitions.py
+"""
+Native Postgres RANGE-партиціювання для SalesforceEvent, PendingChange і
+CampaignDailyMetric.
+
+- convert_to_partitioned(): одноразова конвертація існуючої таблиці
+  (rename → partitioned parent → copy → drop legacy), індекси зберігаються.
+- ensure_partitions(): створює партиції на поточний період + N наперед.
+- drop_expired_partitions(): retention через DETACH + DROP цілих партицій
+  (без DELETE), опційно з архівом у <archive_dir>/<partition>.csv.gz.
+"""
+import gzip
+import os
+from datetime import date, datetime, timedelta
+from typing import List, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone as djtz
+
+from ..models import CampaignDailyMetric, PendingChange, SalesforceEvent
+from . import notify
+
+DAY = "day"
+MONTH = "month"
+
+
+class PartitionSpec(NamedTuple):
+    table: str
+    column: str
+    interval: str                 # "day" | "month"
+    retention_days: int           # 0 = не видаляти
+    # SQL-умова: якщо в партиції є такі рядки — не дропаємо її
+    keep_if: Optional[str] = None
+    # натуральний PK (вже з column); () — surrogate id + identity, PK (id, column)
+    primary_key: Tuple[str, ...] = ()
+
+
+def specs() -> List[PartitionSpec]:
+    return [
+        PartitionSpec(
+            table=SalesforceEvent._meta.db_table,
+            column=SalesforceEvent._meta.get_field("received_at").column,
+            interval=getattr(settings, "SF_EVENT_PARTITION_INTERVAL", DAY),
+            retention_days=int(getattr(settings, "SF_EVENT_RETENTION_DAYS", 30)),
+        ),
+        PartitionSpec(
+            table=PendingChange._meta.db_table,
+            column=PendingChange._meta.get_field("created_at").column,
+            interval=getattr(settings, "PENDING_CHANGE_PARTITION_INTERVAL", MONTH),
+            retention_days=int(getattr(settings, "PENDING_CHANGE_RETENTION_DAYS", 90)),
+            keep_if="status IN ('pending', 'processing')",
+        ),
+        PartitionSpec(
+            table=CampaignDailyMetric._meta.db_table,
+            column=CampaignDailyMetric._meta.get_field("date").column,
+            interval=getattr(settings, "CAMPAIGN_METRICS_PARTITION_INTERVAL", MONTH),
+            retention_days=int(getattr(settings, "CAMPAIGN_METRICS_RETENTION_DAYS", 0)),
+            primary_key=("customer_id", "campaign_id", "date", "device"),
+        ),
+    ]
+
+
+def spec_for(table: str) -> Optional[PartitionSpec]:
+    return next((s for s in specs() if s.table == table), None)
+
+
+# ---- Period helpers ---------------------------------------------------------
+
+def _period_start(d: date, interval: str) -> date:
+    return d.replace(day=1) if interval == MONTH else d
+
+
+def _next_period(d: date, interval: str) -> date:
+    if interval == MONTH:
+        return date(d.year + (d.month == 12), d.month % 12 + 1, 1)
+    return d + timedelta(days=1)
+
+
+def _partition_name(spec: PartitionSpec, start: date) -> str:
+    fmt = "%Y%m" if spec.interval == MONTH else "%Y%m%d"
+    return f"{spec.table}_p{start.strftime(fmt)}"
+
+
+def _parse_partition_start(spec: PartitionSpec, name: str) -> Optional[date]:
+    prefix = f"{spec.table}_p"
+    if not name.startswith(prefix):
+        return None
+    suffix = name[len(prefix):]
+    try:
+        if spec.interval == MONTH:
+            return datetime.strptime(suffix, "%Y%m").date()
+        return datetime.strptime(suffix, "%Y%m%d").date()
+    except ValueError:
+        return None
+
+
+# ---- Introspection ----------------------------------------------------------
+
+def _qn(name: str) -> str:
+    return connection.ops.quote_name(name)
+
+
+def is_partitioned(table: str) -> bool:
+    with connection.cursor() as cur:
+        cur.execute(
+            """
+            SELECT 1 FROM pg_partitioned_table pt
+            JOIN pg_class c ON c.oid = pt.partrelid
+            WHERE c.relname = %s AND c.relnamespace = 'public'::regnamespace
+            """,
+            [table],
+        )
+        return cur.fetchone() is not None
+
+
+def list_partitions(table: str) -> List[str]:
+    with connection.cursor() as cur:
+        cur.execute(
+            """
+            SELECT child.relname FROM pg_inherits i
+            JOIN pg_class parent ON parent.oid = i.inhparent
+            JOIN pg_class child ON child.oid = i.inhrelid
+            WHERE parent.relname = %s
+            ORDER BY child.relname
+            """,
+            [table],
+        )
+        return [r[0] for r in cur.fetchall()]
+
+
+# ---- Create / convert -------------------------------------------------------
+
+def _create_partition(cur, spec: PartitionSpec, start: date) -> Optional[str]:
+    name = _partition_name(spec, start)
+    end = _next_period(start, spec.interval)
+    cur.execute(
+        f"CREATE TABLE IF NOT EXISTS {_qn(name)} PARTITION OF {_qn(spec.table)} "
+        f"FOR VALUES FROM (%s) TO (%s)",
+        [start.isoformat(), end.isoformat()],
+    )
+    return name
+
+
+def ensure_partitions(spec: PartitionSpec, ahead: int = 3, since: Optional[date] = None) -> List[str]:
+    """Creates partitions from `since` (default: current period) up to `ahead` periods in the future."""
+    start = _period_start(since or djtz.now().date(), spec.interval)
+    last = _period_start(djtz.now().date(), spec.interval)
+    for _ in range(ahead):
+        last = _next_period(last, spec.interval)
+
+    existing = set(list_partitions(spec.table))
+    created = []
+    with transaction.atomic(), connection.cursor() as cur:
+        cur.execute(
+            f"CREATE TABLE IF NOT EXISTS {_qn(spec.table + '_default')} "
+            f"PARTITION OF {_qn(spec.table)} DEFAULT"
+        )
+        d = start
+        while d <= last:
+            name = _partition_name(spec, d)
+            if name not in existing:
+                _create_partition(cur, spec, d)
+                created.append(name)
+            d = _next_period(d, spec.interval)
+    return created
+
+
+def convert_to_partitioned(spec: PartitionSpec, ahead: int = 3) -> bool:
+    """
+    One-off conversion of a plain Django table into a RANGE-partitioned one.
+    PK стає (id, <column>) — Postgres вимагає ключ партиціювання в unique-індексах;
+    зі spec.primary_key лишається натуральний PK (column уже в ньому).
+    Повертає False, якщо таблиця вже партиційована.
+    """
+    if is_partitioned(spec.table):
+        return False
+
+    legacy = f"{spec.table}_legacy"
+    t, col = _qn(spec.table), _qn(spec.column)
+    # одна транзакція: вставки з інших процесів чекають на LOCK, а не падають
+    with transaction.atomic(), connection.cursor() as cur:
+        cur.execute(f"LOCK TABLE {t} IN ACCESS EXCLUSIVE MODE")
+        cur.execute(
+            "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s AND indexname NOT LIKE %s",
+            [spec.table, "%_pkey"],
+        )
+        index_defs = cur.fetchall()
+        cur.execute(f"SELECT min({col}) FROM {t}")
+        min_ts = cur.fetchone()[0]
+        max_id = 0
+        if not spec.primary_key:
+            cur.execute(f"SELECT COALESCE(max(id), 0) FROM {t}")
+            max_id = cur.fetchone()[0]
+
+        cur.execute(f"ALTER TABLE {t} RENAME TO {_qn(legacy)}")
+        cur.execute(
+            f"CREATE TABLE {t} (LIKE {_qn(legacy)} INCLUDING DEFAULTS) PARTITION BY RANGE ({col})"
+        )
+        if not spec.primary_key:
+            cur.execute(f"ALTER TABLE {t} ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY")
+            cur.execute(
+                "SELECT setval(pg_get_serial_sequence(%s, 'id'), %s, false)",
+                [spec.table, max_id + 1],
+            )
+
+        since = min_ts.date() if isinstance(min_ts, datetime) else min_ts
+        ensure_partitions(spec, ahead=ahead, since=since)
+
+        cur.execute(f"INSERT INTO {t} SELECT * FROM {_qn(legacy)}")
+        cur.execute(f"DROP TABLE {_qn(legacy)}")
+        pk = ", ".join(_qn(c) for c in spec.primary_key) if spec.primary_key else f"id, {col}"
+        cur.execute(f"ALTER TABLE {t} ADD CONSTRAINT {_qn(spec.table + '_pkey')} PRIMARY KEY ({pk})")
+        # індекси з оригінальними іменами — щоб Django-міграції й далі їх знаходили
+        # (defs зчитані до rename, тож вже посилаються на нову таблицю)
+        for _name, indexdef in index_defs:
+            cur.execute(indexdef)
+        if spec.table == PendingChange._meta.db_table:
+            # тригер лишився на legacy-таблиці — ставимо на новий parent
+            notify.install_trigger(cur)
+    return True
+
+
+# ---- Retention --------------------------------------------------------------
+
+def _archive_partition(cur, name: str, archive_dir: str) -> str:
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{name}.csv.gz")
+    with gzip.open(path, "wb") as fh:
+        cur.copy_expert(f"COPY {_qn(name)} TO STDOUT WITH (FORMAT csv, HEADER true)", fh)
+    return path
+
+
+def drop_expired_partitions(
+    spec: PartitionSpec,
+    archive_dir: Optional[str] = None,
+    dry_run: bool = False,
+) -> List[Tuple[str, Optional[str]]]:
+    """
+    Drops partitions whose whole range is older than retention_days.
+    Повертає [(partition, archive_path | None)].
+    """
+    if spec.retention_days <= 0:
+        return []
+    cutoff = djtz.now().date() - timedelta(days=spec.retention_days)
+    dropped = []
+    for name in list_partitions(spec.table):
+        start = _parse_partition_start(spec, name)
+        if start is None or _next_period(start, spec.interval) > cutoff:
+            continue
+        with transaction.atomic(), connection.cursor() as cur:
+            if spec.keep_if:
+                cur.execute(f"SELECT 1 FROM {_qn(name)} WHERE {spec.keep_if} LIMIT 1")
+                if cur.fetchone():
+                    continue
+            if dry_run:
+                dropped.append((name, None))
+                continue
+            path = _archive_partition(cur, name, archive_dir) if archive_dir else None
+            cur.execute(f"ALTER TABLE {_qn(spec.table)} DETACH PARTITION {_qn(name)}")
+            cur.execute(f"DROP TABLE {_qn(name)}")
+        dropped.append((name, path))
+    return dropped
+
+
+def maintain_partitions(ahead: int = 3, dry_run: bool = False) -> dict:
+    """Daily maintenance: pre-create upcoming partitions and apply retention."""
+    archive_dir = getattr(settings, "PARTITION_ARCHIVE_DIR", None) or None
+    result = {}
+    for spec in specs():
+        if not is_partitioned(spec.table):
+            result[spec.table] = {"partitioned": False}
+            continue
+        created = [] if dry_run else ensure_partitions(spec, ahead=ahead)
+        dropped = drop_expired_partitions(spec, archive_dir=archive_dir, dry_run=dry_run)
+        result[spec.table] = {
+            "partitioned": True,
+            "created": created,
+            "dropped": [name for name, _ in dropped],
+        }
+    return result
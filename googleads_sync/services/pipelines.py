@@ -1,17 +1,21 @@
-from datetime import timedelta
+from datetime import timedelta, timezone as dt_timezone
 import os
 import re
 import hashlib
-from typing import List, Tuple, Dict, Any, Optional
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
 
 from django.conf import settings
 from django.db import transaction
 from django.utils import timezone as djtz
 
 from .sf_bridge import publish_sf_platform_event
+from ..salesforce.client_rest import soql_query
 from ..models import Campaign, SyncCursor, PendingChange
-from .google_ads_client import GoogleAds
-from .mappers import campaign_row_to_dict
+from .google_ads_client import GoogleAds, quota_retry_hint
+from .mappers import CAMPAIGN, CLICK_CONVERSION, CONVERSION_ADJUSTMENT, campaign_pb_to_dict, campaign_row_to_dict
+from . import dead_letter, idempotency, queue
+from .id_resolver import get_resolver
+from .adaptive import AimdController, BatchStats, run_adaptive, timed
 
 RESOURCE = "campaign"
 
@@ -26,6 +30,26 @@ GA_CUSTOMER_ID = _getenv("GA_CUSTOMER_ID")  # e.g. "1234567890"
 GA_CONVERSION_ACTION = _getenv("GA_CONVERSION_ACTION")  # e.g. "customers/1234567890/conversionActions/111"
 GA_DEFAULT_CURRENCY = _getenv("GA_DEFAULT_CURRENCY", "USD")
 GA_CM_USER_LIST = _getenv("GA_CM_USER_LIST")  # e.g. "customers/1234567890/userLists/222"
+GA_ENHANCED_CONVERSIONS_LEADS = str(_getenv("GA_ENHANCED_CONVERSIONS_LEADS", "")).lower() in ("1", "true", "yes")
+GA_LEAD_ORDER_ID_FROM_SF_ID = str(_getenv("GA_LEAD_ORDER_ID_FROM_SF_ID", "true")).lower() in ("1", "true", "yes")
+GA_ADJUSTMENT_CONVERSION_ACTION = _getenv("GA_ADJUSTMENT_CONVERSION_ACTION") or GA_CONVERSION_ACTION
+# ліміти GA на один upload-запит
+MAX_CONVERSIONS_PER_REQUEST = 2000
+MAX_USER_DATA_OPS_PER_REQUEST = 100
+# partial failure коди, що означають "конверсія / adjustment вже є в GA"
+DUPLICATE_CONVERSION_CODES = frozenset({
+    "conversion_upload_error.CLICK_CONVERSION_ALREADY_EXISTS",
+    "conversion_upload_error.DUPLICATE_CLICK_CONVERSION_IN_REQUEST",
+})
+ALREADY_ADJUSTED_CODES = frozenset({
+    "conversion_adjustment_upload_error.CONVERSION_ALREADY_RETRACTED",
+})
+# конверсію завантажено щойно — GA ще не обробив її; adjustment повторюємо через години
+ADJUSTMENT_RETRY_LATER_CODES = frozenset({
+    "conversion_adjustment_upload_error.CONVERSION_NOT_FOUND",
+    "conversion_adjustment_upload_error.TOO_RECENT_CONVERSION",
+})
+GA_ADJUSTMENT_RETRY_HOURS = float(_getenv("GA_ADJUSTMENT_RETRY_HOURS", "2"))
 
 # ---- Cursor utils -----------------------------------------------------------
 
@@ -60,8 +84,7 @@ def pull_campaign_deltas() -> int:
     processed = 0
     latest_ts = since
 
-    for row in client.search_stream(gaql):
-        data = campaign_row_to_dict(row)
+    for data in client.search_stream_dicts(gaql, campaign_row_to_dict, campaign_pb_to_dict):
         with transaction.atomic():
             Campaign.objects.update_or_create(
                 resource_name=data["resource_name"],
@@ -78,95 +101,135 @@ def pull_campaign_deltas() -> int:
 
 # ---- Campaign mutations (SF -> GA) -----------------------------------------
 
+def _sf_record_id(payload: Dict[str, Any]) -> str:
+    """SF record Id from a CDC payload (Id або ChangeEventHeader.recordIds[0])."""
+    header = payload.get("ChangeEventHeader") or {}
+    return payload.get("Id") or (header.get("recordIds") or [""])[0] or ""
+
+def _partial_failure_errors(client: GoogleAds, resp) -> Dict[int, List[Dict[str, Any]]]:
+    """Operation index → structured errors from resp.partial_failure_error (GoogleAdsFailure details)."""
+    status = getattr(resp, "partial_failure_error", None)
+    if not status or not status.message:
+        return {}
+    failure_type = type(client.client.get_type("GoogleAdsFailure"))
+    errors: Dict[int, List[Dict[str, Any]]] = {}
+    for detail in status.details:
+        for err in dead_letter.google_ads_errors(failure_type.deserialize(detail.value)):
+            if err["index"] is not None:
+                errors.setdefault(err["index"], []).append(err)
+    return errors
+
+def _fail_partial(errors: Dict[int, List[Dict[str, Any]]], ids: List[int], owner: str):
+    # помилки валідації окремої операції — повтор не допоможе
+    for i, details in errors.items():
+        queue.mark_failed([ids[i]], dead_letter.error_summary(details), owner, retry=False, details=details)
+
+def _push_campaign_batch(client: GoogleAds, resolver, owner: str, to_process: List[PendingChange]) -> BatchStats:
+    """One claimed batch → one MutateCampaigns(partial_failure=True) call."""
+    # SF Id → GA resource_name одним запитом на весь batch (LRU/Redis/ExternalIdMap)
+    resolved = resolver.sf_to_ga(
+        _sf_record_id(ch.payload or {})
+        for ch in to_process
+        if ch.action != "create" and not (ch.payload or {}).get("resource_name")
+    )
+
+    # 1) Build operations OUTSIDE transaction
+    campaign_operation = client.client.get_type("CampaignOperation")
+    writer = CAMPAIGN.writer(client.client)  # SF/CDC поля → Campaign proto + field mask
+    ops = []
+    id_map = []
+    created_sf_ids = {}  # index в ops → SF Id (для запису ExternalIdMap)
+    for ch in to_process:
+        payload = ch.payload or {}
+        resource_name = payload.get("resource_name") or resolved.get(_sf_record_id(payload))
+        try:
+            if ch.action != "create" and not resource_name:
+                # create ще може бути в черзі — повторимо пізніше
+                msg = f"No GA mapping for SF id {_sf_record_id(payload)!r}"
+                queue.mark_failed([ch.id], msg, owner, details=[{"code": "NO_MAPPING", "message": msg}])
+                continue
+
+            if ch.action == "create":
+                op = campaign_operation()
+                c = op.create
+                writer.apply_payload(c, payload, changed_only=False)
+                if not c.name:
+                    c.name = "New Campaign"
+                AdvertisingChannelTypeEnum = client.client.get_type("AdvertisingChannelTypeEnum")
+                c.advertising_channel_type = payload.get(
+                    "advertising_channel_type", AdvertisingChannelTypeEnum.SEARCH
+                )
+                created_sf_ids[len(ops)] = _sf_record_id(payload)
+                ops.append(op); id_map.append(ch.id)
+
+            elif ch.action in ("update", "pause", "enable"):
+                op = campaign_operation()
+                c = op.update
+                c.resource_name = resource_name
+                if ch.action in ("pause", "enable"):
+                    paths = writer.apply(c, {"status": "PAUSED" if ch.action == "pause" else "ENABLED"})
+                else:
+                    paths = writer.apply_payload(c, payload)
+                if not paths:
+                    # жодне змінене SF-поле не має відповідника в GA — нічого відправляти
+                    queue.mark_done([ch.id], owner)
+                    continue
+                field_mask = client.client.get_type("FieldMask")
+                field_mask.paths.extend(paths)
+                op.update_mask.CopyFrom(field_mask)
+                ops.append(op); id_map.append(ch.id)
+
+            elif ch.action == "remove":
+                op = campaign_operation()
+                op.remove = resource_name
+                ops.append(op); id_map.append(ch.id)
+
+            else:
+                msg = f"Unsupported action: {ch.action}"
+                queue.mark_failed([ch.id], msg, owner, retry=False, details=[{"code": "UNSUPPORTED_ACTION", "message": msg}])
+
+        except Exception as e:
+            # невалідний payload — повтор не допоможе
+            queue.mark_failed([ch.id], str(e), owner, retry=False, details=dead_letter.error_details(e))
+
+    if not ops:
+        return BatchStats(ops=0, ok=0, failed=0, latency=0.0)
+
+    # 2) Execute mutation OUTSIDE transaction
+    try:
+        resp, latency = timed(client.mutate_campaigns, ops, partial_failure=True)
+    except Exception as e:
+        queue.mark_failed(id_map, str(e), owner, details=dead_letter.error_details(e))
+        delay, _scope = quota_retry_hint(e)
+        return BatchStats(ops=len(ops), ok=0, failed=len(ops), latency=0.0, quota_error=delay is not None)
+
+    errors = _partial_failure_errors(client, resp)
+    _fail_partial(errors, id_map, owner)
+    ok = [pk for i, pk in enumerate(id_map) if i not in errors]
+    # мапу — до mark_done: якщо запис впаде, рядок повториться, а не загубить SF ↔ GA зв'язок
+    resolver.record_many(
+        (sf_id, resp.results[i].resource_name) for i, sf_id in created_sf_ids.items() if i not in errors
+    )
+    queue.mark_done(ok, owner)
+    return BatchStats(ops=len(ops), ok=len(ok), failed=len(errors), latency=latency)
+
 def push_campaign_changes(batch_size: int = 200) -> int:
     """
     Processes PendingChange(resource='campaign', status='pending') in batches.
-    Uses select_for_update(skip_locked=True) under transaction.atomic().
+    Rows are leased via services.queue (owner + expiry), so several pushers
+    can run in parallel and rows of a crashed worker get reaped back to pending.
+    Batch size / in-flight requests are tuned by services.adaptive (batch_size —
+    лише стартове значення для нового customer-а).
     """
     client = GoogleAds()
-    processed = 0
-
-    while True:
-        # 1) Pull batch and mark 'processing'
-        with transaction.atomic():
-            to_process = list(
-                PendingChange.objects.filter(resource=RESOURCE, status="pending")
-                .order_by("created_at")
-                .select_for_update(skip_locked=True)[:batch_size]
-            )
-            if not to_process:
-                break
-            ids = [c.id for c in to_process]
-            PendingChange.objects.filter(id__in=ids).update(status="processing")
-
-        # 2) Build operations OUTSIDE transaction
-        campaign_operation = client.client.get_type("CampaignOperation")
-        ops = []
-        id_map = []
-        for ch in to_process:
-            payload = ch.payload or {}
-            try:
-                if ch.action == "create":
-                    op = campaign_operation()
-                    c = op.create
-                    c.name = payload.get("name", "New Campaign")
-                    AdvertisingChannelTypeEnum = client.client.get_type("AdvertisingChannelTypeEnum")
-                    c.advertising_channel_type = payload.get(
-                        "advertising_channel_type", AdvertisingChannelTypeEnum.SEARCH
-                    )
-                    ops.append(op); id_map.append(ch.id)
-
-                elif ch.action in ("update", "pause", "enable"):
-                    op = campaign_operation()
-                    c = op.update
-                    c.resource_name = payload["resource_name"]
-                    field_mask = client.client.get_type("FieldMask")
-                    CampaignStatusEnum = client.client.get_type("CampaignStatusEnum")
-                    if ch.action == "pause":
-                        c.status = CampaignStatusEnum.PAUSED
-                        field_mask.paths.append("status")
-                    elif ch.action == "enable":
-                        c.status = CampaignStatusEnum.ENABLED
-                        field_mask.paths.append("status")
-                    else:
-                        for key, value in (payload.get("fields") or {}).items():
-                            setattr(c, key, value)
-                            field_mask.paths.append(key)
-                    op.update_mask.CopyFrom(field_mask)
-                    ops.append(op); id_map.append(ch.id)
-
-                elif ch.action == "remove":
-                    op = campaign_operation()
-                    op.remove = payload["resource_name"]
-                    ops.append(op); id_map.append(ch.id)
-
-                else:
-                    with transaction.atomic():
-                        PendingChange.objects.filter(id=ch.id).update(
-                            status="error", error=f"Unsupported action: {ch.action}"
-                        )
-
-            except Exception as e:
-                with transaction.atomic():
-                    PendingChange.objects.filter(id=ch.id).update(
-                        status="error", error=str(e)[:1000]
-                    )
-
-        if not ops:
-            continue
-
-        # 3) Execute mutation OUTSIDE transaction
-        try:
-            client.mutate_campaigns(ops)
-            with transaction.atomic():
-                PendingChange.objects.filter(id__in=id_map).update(status="done", error="")
-            processed += len(ops)
-        except Exception as e:
-            err = str(e)[:1000]
-            with transaction.atomic():
-                PendingChange.objects.filter(id__in=id_map).update(status="error", error=err)
-
-    return processed
+    owner = queue.new_owner()
+    resolver = get_resolver(RESOURCE)
+    controller = AimdController.load(client.customer_id, RESOURCE, default_batch=batch_size)
+    return run_adaptive(
+        controller,
+        claim=lambda n, lane, lanes: queue.claim_batch(RESOURCE, n, owner, lane=lane, lanes=lanes),
+        process=lambda rows: _push_campaign_batch(client, resolver, owner, rows),
+    )
 
 # =============================================================================
 #                              L  E  A  D  S
@@ -176,50 +239,155 @@ def push_campaign_changes(batch_size: int = 200) -> int:
 # =============================================================================
 
 # ---- Helpers for hashing & normalization -----------------------------------
+# Спільні для Customer Match і enhanced conversions for leads (однакові правила Google).
 
 _email_re = re.compile(r"\s+")
 _phone_re = re.compile(r"[^\d]")
+_GMAIL_DOMAINS = ("gmail.com", "googlemail.com")
 
 def _sha256_lower(s: str) -> str:
     return hashlib.sha256(s.encode("utf-8")).hexdigest()
 
 def _norm_email(email: str) -> str:
-    return _email_re.sub("", (email or "").strip().lower())
+    email = _email_re.sub("", (email or "").strip().lower())
+    local, at, domain = email.partition("@")
+    if at and domain in _GMAIL_DOMAINS:
+        local = local.replace(".", "")  # gmail ігнорує крапки — Google нормалізує так само
+    return f"{local}{at}{domain}"
 
 def _norm_phone(phone: str) -> str:
-    return _phone_re.sub("", (phone or ""))
+    """E.164 без пробілів: '+' + цифри (код країни має бути у самому номері)."""
+    digits = _phone_re.sub("", (phone or ""))
+    return f"+{digits}" if digits else ""
+
+def _hashed_identifiers(p: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
+    """(sha256 email, sha256 phone) з payload: готові *_sha256 або сирі значення."""
+    email = p.get("email") or p.get("Email") or p.get("Email__c")
+    phone = p.get("phone") or p.get("Phone") or p.get("Phone__c")
+    email_h = p.get("email_sha256") or (_sha256_lower(_norm_email(email)) if email else None)
+    phone_n = _norm_phone(phone) if phone else ""
+    phone_h = p.get("phone_sha256") or (_sha256_lower(phone_n) if phone_n else None)
+    return email_h, phone_h
+
+def _user_identifiers(client: GoogleAds, p: Dict[str, Any]) -> list:
+    UserIdentifier = client.client.get_type("UserIdentifier")
+    email_h, phone_h = _hashed_identifiers(p)
+    identifiers = []
+    if email_h:
+        ui = UserIdentifier()
+        ui.hashed_email = email_h
+        identifiers.append(ui)
+    if phone_h:
+        ui = UserIdentifier()
+        ui.hashed_phone_number = phone_h
+        identifiers.append(ui)
+    return identifiers
+
+# ---- Chunked partial-failure uploads ----------------------------------------
+
+class UploadOutcome(NamedTuple):
+    ok: List[int]       # indexes в ops/ids, що пройшли (або "вже є" за ok_codes)
+    failed: List[int]
+    latency: float
+    quota_error: bool
+
+def _upload_chunked(
+    client: GoogleAds,
+    owner: str,
+    ops: list,
+    ids: List[int],
+    chunk_size: int,
+    send: Callable[[list], Any],
+    ok_codes: frozenset = frozenset(),
+    retry_codes: frozenset = frozenset(),
+    retry_base_seconds: Optional[float] = None,
+) -> UploadOutcome:
+    """
+    Вантажить ops шматками ≤ chunk_size (ліміт GA на запит), partial_failure.
+    Рядки PendingChange позначаються done / failed; помилки з ok_codes
+    (напр. "вже існує") — успіх, з retry_codes — retry з backoff від
+    retry_base_seconds, решта — dead letter. Падіння одного шматка не зачіпає інші.
+    """
+    ok: List[int] = []
+    failed: List[int] = []
+    latency = 0.0
+    quota_error = False
+    for start in range(0, len(ops), chunk_size):
+        part, part_ids = ops[start:start + chunk_size], ids[start:start + chunk_size]
+        try:
+            resp, took = timed(send, part)
+            latency += took
+            errors = {
+                i: details for i, details in _partial_failure_errors(client, resp).items()
+                if not all(d.get("code") in ok_codes for d in details)
+            }
+            later = {i for i, details in errors.items() if all(d.get("code") in retry_codes for d in details)}
+            for i in later:
+                queue.mark_failed(
+                    [part_ids[i]], dead_letter.error_summary(errors[i]), owner,
+                    details=errors[i], retry_base_seconds=retry_base_seconds,
+                )
+            _fail_partial({i: d for i, d in errors.items() if i not in later}, part_ids, owner)
+            done = [i for i in range(len(part)) if i not in errors]
+            queue.mark_done([part_ids[i] for i in done], owner)
+            ok += [start + i for i in done]
+            failed += [start + i for i in errors]
+        except Exception as e:
+            queue.mark_failed(part_ids, str(e), owner, details=dead_letter.error_details(e))
+            failed += range(start, start + len(part))
+            quota_error = quota_error or quota_retry_hint(e)[0] is not None
+    return UploadOutcome(ok, failed, latency, quota_error)
 
-# ---- SF -> GA (Lead): Upload Click Conversions / Customer Match -------------
+# ---- SF -> GA (Lead): Click Conversions / Enhanced Conversions / Customer Match
 
-def _build_click_conversions(client: GoogleAds, items: List[PendingChange]) -> Tuple[list, list]:
-    """Return (click_conversions, ids) from PendingChange payloads that have gclid/gbraid/wbraid."""
+def _build_click_conversions(client: GoogleAds, items: List[PendingChange], owner: str) -> Tuple[list, list, list]:
+    """
+    Return (click_conversions, ids, idempotency keys) from PendingChange payloads that have
+    gclid/gbraid/wbraid або (GA_ENHANCED_CONVERSIONS_LEADS) хешовані email/phone —
+    enhanced conversions for leads: ClickConversion.user_identifiers, click id не обовʼязковий.
+    Вже завантажені конверсії (services.idempotency) відкидаються до запиту: їхні
+    рядки — done, ключі, які тримає інший воркер, — retry пізніше.
+    """
     ClickConversion = client.client.get_type("ClickConversion")
+    writer = CLICK_CONVERSION.writer(client.client)
     click_conversions = []
     ids = []
     for ch in items:
         p = ch.payload or {}
-        gclid = p.get("gclid")
-        gbraid = p.get("gbraid")
-        wbraid = p.get("wbraid")
-        conv_time = p.get("conversion_time")  # RFC3339, e.g. "2025-09-13T10:00:00Z"
-        conv_value = float(p.get("conversion_value", 0.0))
-        currency = p.get("currency_code", GA_DEFAULT_CURRENCY)
-
-        if (gclid or gbraid or wbraid) and conv_time and GA_CONVERSION_ACTION:
+        values = writer.values(p, changed_only=False)
+        has_click_id = values.get("gclid") or values.get("gbraid") or values.get("wbraid")
+        identifiers = _user_identifiers(client, p) if GA_ENHANCED_CONVERSIONS_LEADS else []
+        if (has_click_id or identifiers) and values.get("conversion_date_time") and GA_CONVERSION_ACTION:
+            if GA_LEAD_ORDER_ID_FROM_SF_ID and not values.get("order_id"):
+                # order_id = SF Lead Id: GA відкидає повтори, а adjustments (Opportunity) знаходять конверсію
+                values["order_id"] = PendingChange.record_key(p) or None
             cc = ClickConversion()
-            if gclid: cc.gclid = gclid
-            if gbraid: cc.gbraid = gbraid
-            if wbraid: cc.wbraid = wbraid
             cc.conversion_action = GA_CONVERSION_ACTION
-            cc.conversion_date_time = conv_time
-            cc.conversion_value = conv_value
-            cc.currency_code = currency
-            order_id = p.get("order_id") or p.get("external_id")
-            if order_id:
-                cc.order_id = str(order_id)
+            cc.currency_code = GA_DEFAULT_CURRENCY
+            try:
+                writer.apply(cc, values)
+            except (TypeError, ValueError) as e:
+                # невалідне значення (напр. формат дати) — лише цей лід, не весь batch; повтор не допоможе
+                queue.mark_failed([ch.id], f"Invalid conversion value: {e}", owner, retry=False,
+                                  details=dead_letter.error_details(e))
+                continue
+            cc.user_identifiers.extend(identifiers)
             click_conversions.append(cc)
             ids.append(ch.id)
-    return click_conversions, ids
+    if not click_conversions:
+        return [], [], []
+
+    keys = [idempotency.conversion_key(GA_CONVERSION_ACTION, cc) for cc in click_conversions]
+    allowed, dups, busy = idempotency.CONVERSION_KEYS.reserve(list(zip(keys, ids)))
+    queue.mark_done([ids[i] for i in sorted(dups)], owner)
+    queue.mark_failed(
+        [ids[i] for i in sorted(busy)],
+        "Conversion is being uploaded by another worker",
+        owner,
+        details=[{"code": "IDEMPOTENCY_BUSY", "message": "Idempotency key reserved by another change"}],
+    )
+    keep = sorted(allowed)
+    return [click_conversions[i] for i in keep], [ids[i] for i in keep], [keys[i] for i in keep]
 
 def _build_user_data_ops(client: GoogleAds, items: List[PendingChange]) -> Tuple[list, list]:
     """
@@ -228,29 +396,13 @@ def _build_user_data_ops(client: GoogleAds, items: List[PendingChange]) -> Tuple
     """
     if not GA_CM_USER_LIST:
         return [], []
-    UserIdentifier = client.client.get_type("UserIdentifier")
     UserData = client.client.get_type("UserData")
     UserDataOperation = client.client.get_type("UserDataOperation")
 
     ops = []
     ids = []
     for ch in items:
-        p = ch.payload or {}
-        email = p.get("email") or p.get("Email") or p.get("Email__c")
-        phone = p.get("phone") or p.get("Phone") or p.get("Phone__c")
-        email_h = p.get("email_sha256") or ( _sha256_lower(_norm_email(email)) if email else None )
-        phone_h = p.get("phone_sha256") or ( _sha256_lower(_norm_phone(phone)) if phone else None )
-
-        identifiers = []
-        if email_h:
-            ui = UserIdentifier()
-            ui.hashed_email = email_h
-            identifiers.append(ui)
-        if phone_h:
-            ui = UserIdentifier()
-            ui.hashed_phone_number = phone_h
-            identifiers.append(ui)
-
+        identifiers = _user_identifiers(client, ch.payload or {})
         if not identifiers:
             continue
 
@@ -264,100 +416,203 @@ def _build_user_data_ops(client: GoogleAds, items: List[PendingChange]) -> Tuple
 
     return ops, ids
 
-def push_lead_changes(batch_size: int = 200) -> int:
+def _send_click_conversions(client: GoogleAds, conversions: list):
+    req = client.client.get_type("UploadClickConversionsRequest")
+    req.customer_id = GA_CUSTOMER_ID
+    req.conversions.extend(conversions)
+    # partial_failure=True allows per-row errors without failing the whole request
+    req.partial_failure = True
+    return client.upload_click_conversions(req)
+
+def _send_user_data(client: GoogleAds, operations: list):
+    req = client.client.get_type("UploadUserDataRequest")
+    req.customer_id = GA_CUSTOMER_ID
+    req.operations.extend(operations)
+    req.customer_match_user_list_metadata.user_list = GA_CM_USER_LIST
+    req.partial_failure = True
+    return client.upload_user_data(req)
+
+def _push_lead_batch(client: GoogleAds, owner: str, to_process: List[PendingChange]) -> BatchStats:
     """
-    Processes PendingChange(resource='lead'):
-      1) If gclid/gbraid/wbraid present => Upload Click Conversions
+    One claimed batch of PendingChange(resource='lead'):
+      1) If gclid/gbraid/wbraid (or, with enhanced conversions, email/phone) present
+         => Upload Click Conversions
       2) Else if (email/phone present) => Customer Match to GA_CM_USER_LIST
     """
-    processed = 0
-    client = GoogleAds()
-
-    while True:
-        with transaction.atomic():
-            to_process = list(
-                PendingChange.objects.filter(resource="lead", status="pending")
-                .order_by("created_at")
-                .select_for_update(skip_locked=True)[:batch_size]
-            )
-            if not to_process:
-                break
-            ids = [c.id for c in to_process]
-            PendingChange.objects.filter(id__in=ids).update(status="processing")
-
-        # ---- 1) Upload Click Conversions
-        click_convs, click_ids = _build_click_conversions(client, to_process)
-        if click_convs and GA_CUSTOMER_ID:
-            try:
-                service = client.client.get_service("ConversionUploadService")
-                req = client.client.get_type("UploadClickConversionsRequest")
-                req.customer_id = GA_CUSTOMER_ID
-                req.conversions.extend(click_convs)
-                # partial_failure=True allows per-row errors without failing the whole request
-                req.partial_failure = True
-                resp = service.UploadClickConversions(request=req)
-                # Mark successes; on partial failures, mark specific items as error
-                ok = []
-                err_map = {}
-                for i, res in enumerate(resp.results):
-                    # results aligns with input order
-                    if getattr(res, "gclid", "") or getattr(res, "gbraid", "") or getattr(res, "wbraid", ""):
-                        ok.append(click_ids[i])
-                if resp.partial_failure_error and resp.partial_failure_error.message:
-                    err_msg = resp.partial_failure_error.message
-                    # Conservatively mark all non-ok as error
-                    bad = set(click_ids) - set(ok)
-                    with transaction.atomic():
-                        if ok:
-                            PendingChange.objects.filter(id__in=ok).update(status="done", error="")
-                        if bad:
-                            PendingChange.objects.filter(id__in=list(bad)).update(status="error", error=err_msg[:1000])
-                    processed += len(ok)
-                else:
-                    with transaction.atomic():
-                        PendingChange.objects.filter(id__in=click_ids).update(status="done", error="")
-                    processed += len(click_ids)
-            except Exception as e:
-                with transaction.atomic():
-                    PendingChange.objects.filter(id__in=click_ids).update(status="error", error=str(e)[:1000])
-
-        # ---- 2) Customer Match (only those not already done/error)
-        remaining = list(
-            PendingChange.objects.filter(resource="lead", status="processing", id__in=ids)
-            .order_by("created_at")
+    ids = [c.id for c in to_process]
+    ok_count = failed_count = 0
+    latency = 0.0
+    quota_error = False
+
+    # ---- 1) Upload Click Conversions (+ enhanced conversions for leads)
+    click_convs, click_ids, click_keys = _build_click_conversions(client, to_process, owner)
+    if click_convs and GA_CUSTOMER_ID:
+        res = _upload_chunked(
+            client, owner, click_convs, click_ids, MAX_CONVERSIONS_PER_REQUEST,
+            send=lambda part: _send_click_conversions(client, part),
+            # GA вже має цю конверсію — це успіх для idempotency, не помилка
+            ok_codes=DUPLICATE_CONVERSION_CODES,
         )
-        cm_ops, cm_ids = _build_user_data_ops(client, remaining)
-        if cm_ops and GA_CUSTOMER_ID and GA_CM_USER_LIST:
-            try:
-                svc = client.client.get_service("UserDataService")
-                req = client.client.get_type("UploadUserDataRequest")
-                req.customer_id = GA_CUSTOMER_ID
-                req.operations.extend(cm_ops)
-                req.customer_match_user_list_metadata.user_list = GA_CM_USER_LIST
-                req.partial_failure = True
-                resp = svc.UploadUserData(request=req)
-
-                ok = cm_ids[:]  # if no partial failures, all good
-                if resp.partial_failure_error and resp.partial_failure_error.message:
-                    err_msg = resp.partial_failure_error.message
-                    # We don't have per-row mapping easily; conservative handling:
-                    with transaction.atomic():
-                        PendingChange.objects.filter(id__in=cm_ids).update(status="error", error=err_msg[:1000])
-                else:
-                    with transaction.atomic():
-                        PendingChange.objects.filter(id__in=cm_ids).update(status="done", error="")
-                    processed += len(ok)
-            except Exception as e:
-                with transaction.atomic():
-                    PendingChange.objects.filter(id__in=cm_ids).update(status="error", error=str(e)[:1000])
-
-        # Any items left in 'processing' at this point didn't match either path — mark error
-        with transaction.atomic():
-            PendingChange.objects.filter(id__in=ids, status="processing").update(
-                status="error", error="No applicable lead operation (need gclid/gbraid/wbraid or email/phone)."
-            )
+        idempotency.CONVERSION_KEYS.confirm(click_keys[i] for i in res.ok)
+        idempotency.CONVERSION_KEYS.release(click_keys[i] for i in res.failed)
+        ok_count += len(res.ok)
+        failed_count += len(res.failed)
+        latency += res.latency
+        quota_error = quota_error or res.quota_error
+    elif click_keys:
+        idempotency.CONVERSION_KEYS.release(click_keys)  # без GA_CUSTOMER_ID нічого не вантажили
+
+    # ---- 2) Customer Match (only those not already done/error)
+    remaining = list(
+        PendingChange.objects.filter(
+            resource="lead", status=queue.STATUS_PROCESSING, lease_owner=owner, id__in=ids
+        ).order_by("created_at")
+    )
+    cm_ops, cm_ids = _build_user_data_ops(client, remaining)
+    if cm_ops and GA_CUSTOMER_ID and GA_CM_USER_LIST:
+        res = _upload_chunked(
+            client, owner, cm_ops, cm_ids, MAX_USER_DATA_OPS_PER_REQUEST,
+            send=lambda part: _send_user_data(client, part),
+        )
+        ok_count += len(res.ok)
+        failed_count += len(res.failed)
+        latency += res.latency
+        quota_error = quota_error or res.quota_error
+
+    # Any items left in 'processing' at this point didn't match either path — mark error
+    queue.mark_failed(
+        ids,
+        "No applicable lead operation (need gclid/gbraid/wbraid or email/phone).",
+        owner,
+        retry=False,
+        details=[{"code": "NO_APPLICABLE_OPERATION", "message": "Need gclid/gbraid/wbraid or email/phone"}],
+    )
+    return BatchStats(
+        ops=len(click_convs) + len(cm_ops),
+        ok=ok_count,
+        failed=failed_count,
+        latency=latency,
+        quota_error=quota_error,
+    )
 
-    return processed
+def push_lead_changes(batch_size: int = 200) -> int:
+    """Lead uploads, batched and parallelised by the AIMD controller (див. push_campaign_changes)."""
+    client = GoogleAds()
+    owner = queue.new_owner()
+    controller = AimdController.load(GA_CUSTOMER_ID or client.customer_id, "lead", default_batch=batch_size)
+    return run_adaptive(
+        controller,
+        claim=lambda n, lane, lanes: queue.claim_batch("lead", n, owner, lane=lane, lanes=lanes),
+        process=lambda rows: _push_lead_batch(client, owner, rows),
+    )
+
+# ---- SF -> GA (Opportunity): Conversion Adjustments ---------------------------
+# Opportunity CDC → PendingChange(resource='opportunity', action='restate'|'retract').
+# Оригінальна конверсія шукається за order_id: payload["order_id"] або SF Id
+# Lead-а, з якого сконвертовано Opportunity (GA_LEAD_ORDER_ID_FROM_SF_ID).
+
+def _adjustment_order_ids(items: List[PendingChange]) -> Dict[int, str]:
+    """PendingChange.id → order_id; Lead.ConvertedOpportunityId одним SOQL на batch."""
+    out: Dict[int, str] = {}
+    opp_ids: Dict[str, List[int]] = {}
+    for ch in items:
+        p = ch.payload or {}
+        opp_id = PendingChange.record_key(p)
+        if p.get("order_id"):
+            out[ch.id] = str(p["order_id"])
+        elif opp_id:
+            opp_ids.setdefault(opp_id, []).append(ch.id)
+    if opp_ids:
+        in_list = ",".join(f"'{i}'" for i in opp_ids if re.fullmatch(r"[A-Za-z0-9]{15,18}", i))
+        if in_list:
+            res = soql_query(f"SELECT Id, ConvertedOpportunityId FROM Lead WHERE ConvertedOpportunityId IN ({in_list})")
+            for rec in res.get("records", []):
+                for pk in opp_ids.get(rec["ConvertedOpportunityId"], []):
+                    out[pk] = rec["Id"]
+    return out
+
+def _adjustment_time(ch: PendingChange) -> str:
+    """adjustment_date_time: коли зміну закомітили в SF (або поставили в чергу)."""
+    ts = (ch.source_commit_at or ch.created_at).astimezone(dt_timezone.utc)
+    return ts.strftime("%Y-%m-%d %H:%M:%S+00:00")
+
+def _build_conversion_adjustments(client: GoogleAds, items: List[PendingChange], owner: str) -> Tuple[list, list]:
+    ConversionAdjustment = client.client.get_type("ConversionAdjustment")
+    adjustment_type = client.client.get_type("ConversionAdjustmentTypeEnum").ConversionAdjustmentType
+    writer = CONVERSION_ADJUSTMENT.writer(client.client)
+    order_ids = _adjustment_order_ids(items)
+    adjustments, ids, missing = [], [], []
+    for ch in items:
+        order_id = order_ids.get(ch.id)
+        if not order_id:
+            missing.append(ch.id)
+            continue
+        adj = ConversionAdjustment()
+        adj.conversion_action = GA_ADJUSTMENT_CONVERSION_ACTION
+        adj.order_id = order_id
+        adj.adjustment_date_time = _adjustment_time(ch)
+        if ch.action == "retract":
+            adj.adjustment_type = adjustment_type.RETRACTION
+        else:
+            adj.adjustment_type = adjustment_type.RESTATEMENT
+            adj.restatement_value.currency_code = GA_DEFAULT_CURRENCY
+            mask = writer.apply_payload(adj, ch.payload or {}, changed_only=False)
+            if "restatement_value.adjusted_value" not in mask:
+                missing.append(ch.id)
+                continue
+        adjustments.append(adj)
+        ids.append(ch.id)
+    queue.mark_failed(
+        missing,
+        "No original conversion to adjust (order_id / converted Lead / Amount missing).",
+        owner,
+        retry=False,
+        details=[{"code": "NO_ORIGINAL_CONVERSION", "message": "Cannot resolve order_id or restatement value"}],
+    )
+    return adjustments, ids
+
+def _send_conversion_adjustments(client: GoogleAds, adjustments: list):
+    req = client.client.get_type("UploadConversionAdjustmentsRequest")
+    req.customer_id = GA_CUSTOMER_ID
+    req.conversion_adjustments.extend(adjustments)
+    req.partial_failure = True  # для цього методу GA вимагає partial_failure=True
+    return client.upload_conversion_adjustments(req)
+
+def _push_adjustment_batch(client: GoogleAds, owner: str, to_process: List[PendingChange]) -> BatchStats:
+    try:
+        adjustments, ids = _build_conversion_adjustments(client, to_process, owner)
+    except Exception as e:  # SOQL (order_id lookup) недоступний — весь batch у retry
+        queue.mark_failed([ch.id for ch in to_process], str(e), owner, details=dead_letter.error_details(e))
+        return BatchStats(ops=0, ok=0, failed=len(to_process), latency=0.0)
+    if not adjustments:
+        return BatchStats(ops=0, ok=0, failed=len(to_process), latency=0.0)
+    res = _upload_chunked(
+        client, owner, adjustments, ids, MAX_CONVERSIONS_PER_REQUEST,
+        send=lambda part: _send_conversion_adjustments(client, part),
+        ok_codes=ALREADY_ADJUSTED_CODES,
+        retry_codes=ADJUSTMENT_RETRY_LATER_CODES,
+        retry_base_seconds=GA_ADJUSTMENT_RETRY_HOURS * 3600,
+    )
+    return BatchStats(
+        ops=len(adjustments),
+        ok=len(res.ok),
+        failed=len(res.failed) + len(to_process) - len(ids),
+        latency=res.latency,
+        quota_error=res.quota_error,
+    )
+
+def push_adjustment_changes(batch_size: int = 200) -> int:
+    """Opportunity restatements / retractions → UploadConversionAdjustments (AIMD, lanes)."""
+    if not (GA_ADJUSTMENT_CONVERSION_ACTION and GA_CUSTOMER_ID):
+        return 0
+    client = GoogleAds()
+    owner = queue.new_owner()
+    controller = AimdController.load(GA_CUSTOMER_ID, "opportunity", default_batch=batch_size)
+    return run_adaptive(
+        controller,
+        claim=lambda n, lane, lanes: queue.claim_batch("opportunity", n, owner, lane=lane, lanes=lanes),
+        process=lambda rows: _push_adjustment_batch(client, owner, rows),
+    )
 
 # ---- GA -> SF (Lead): publish PE from Lead Forms ---------------------------
 
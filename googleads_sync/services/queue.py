@@ -0,0 +1,289 @@
+# googleads_sync/services/queue.py
+"""
+Lease-based work queue over PendingChange.
+
+claim_batch() атомарно забирає pending-рядки (select_for_update skip_locked),
+записує власника lease і час його завершення. Якщо воркер падає посеред batch,
+reap_expired_leases() повертає такі рядки назад у pending.
+Кожна невдала спроба дописується в error_history; рядки, що остаточно
+переходять у error, копіюються в DeadLetter (services.dead_letter).
+"""
+import os
+import socket
+import uuid
+from datetime import timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, F, JSONField, OuterRef, Q, Value
+from django.db.models.functions import Mod
+from django.db.models.expressions import CombinedExpression
+from django.utils import timezone as djtz
+
+from ..models import PendingChange
+from . import dead_letter, metrics
+
+STATUS_PENDING = "pending"
+STATUS_PROCESSING = "processing"
+STATUS_DONE = "done"
+STATUS_ERROR = "error"
+
+LEASE_SECONDS = int(getattr(settings, "PENDING_CHANGE_LEASE_SECONDS", 300))
+MAX_ATTEMPTS = int(getattr(settings, "PENDING_CHANGE_MAX_ATTEMPTS", 5))
+RETRY_BASE_SECONDS = int(getattr(settings, "PENDING_CHANGE_RETRY_BASE_SECONDS", 30))
+# нижня межа created_at у hot-path запитах → partition pruning (див. services.partitions)
+CLAIM_HORIZON_DAYS = int(getattr(settings, "PENDING_CHANGE_CLAIM_HORIZON_DAYS", 14))
+# частка batch-у на кожен priority (weighted fair: low не голодує під час backlog-у high)
+PRIORITY_WEIGHTS = {
+    int(k): int(v) for k, v in getattr(settings, "PENDING_CHANGE_PRIORITY_WEIGHTS", {0: 6, 1: 3, 2: 1}).items()
+}
+
+
+def _horizon():
+    return djtz.now() - timedelta(days=CLAIM_HORIZON_DAYS)
+
+
+def new_owner() -> str:
+    """Unique lease owner id: host:pid:random (один на виклик push_*)."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def _batch_shares(batch_size: int) -> List[tuple]:
+    """[(priority, slots)] за вагами, у порядку priority; кожен рівень з вагою > 0 має ≥ 1 слот."""
+    total = sum(w for w in PRIORITY_WEIGHTS.values() if w > 0) or 1
+    return [
+        (p, max(1, batch_size * w // total))
+        for p, w in sorted(PRIORITY_WEIGHTS.items())
+        if w > 0
+    ]
+
+
+def _blocked_by_earlier(resource: str, horizon):
+    """
+    Exists: у того ж ключа (key_hash) є зміна в роботі або старіша pending
+    (у т.ч. та, що чекає retry). Тож claim бере лише "голову" кожного ключа —
+    зміни одного запису застосовуються строго по черзі навіть між воркерами.
+    """
+    return Exists(
+        PendingChange.objects.filter(
+            resource=resource,
+            key_hash=OuterRef("key_hash"),
+            created_at__gte=horizon,
+        ).filter(
+            Q(status=STATUS_PROCESSING)
+            | Q(status=STATUS_PENDING, created_at__lt=OuterRef("created_at"))
+            | Q(status=STATUS_PENDING, created_at=OuterRef("created_at"), id__lt=OuterRef("id"))
+        )
+    )
+
+
+def claim_batch(
+    resource: str,
+    batch_size: int,
+    owner: str,
+    lease_seconds: int = LEASE_SECONDS,
+    lane: Optional[int] = None,
+    lanes: int = 1,
+) -> List[PendingChange]:
+    """
+    Claims up to batch_size pending rows, weighted-fair across priorities:
+    спершу кожен priority отримує свою частку batch-у (PRIORITY_WEIGHTS), потім
+    невикористані слоти добираються в порядку priority. Усередині priority —
+    (created_at, id). Rows whose next_attempt_at is in the future are skipped.
+    Per-record order: лише найстаріша незавершена зміна кожного key_hash.
+    lane/lanes — лише ключі з key_hash % lanes == lane (рядки без ключа — у будь-якому lane).
+    """
+    now = djtz.now()
+    horizon = _horizon()
+    with transaction.atomic():
+        base = PendingChange.objects.filter(
+            resource=resource,
+            status=STATUS_PENDING,
+            next_attempt_at__lte=now,
+            created_at__gte=horizon,
+        ).exclude(_blocked_by_earlier(resource, horizon))
+        if lane is not None and lanes > 1:
+            base = base.annotate(lane=Mod("key_hash", lanes)).filter(Q(key_hash__isnull=True) | Q(lane=lane))
+
+        def take(priority: int, limit: int, exclude: List[int]) -> List[PendingChange]:
+            qs = base.filter(priority=priority)
+            if exclude:
+                qs = qs.exclude(id__in=exclude)
+            return list(qs.order_by("created_at", "id").select_for_update(skip_locked=True)[:limit])
+
+        rows: List[PendingChange] = []
+        shares = _batch_shares(batch_size)
+        for priority, slots in shares:
+            rows += take(priority, min(slots, batch_size - len(rows)), [])
+            if len(rows) >= batch_size:
+                break
+        for priority, _slots in shares:
+            if len(rows) >= batch_size:
+                break
+            rows += take(priority, batch_size - len(rows), [r.id for r in rows if r.priority == priority])
+        if not rows:
+            return []
+        ids = [r.id for r in rows]
+        expires = now + timedelta(seconds=lease_seconds)
+        PendingChange.objects.filter(id__in=ids).update(
+            status=STATUS_PROCESSING,
+            lease_owner=owner,
+            lease_expires_at=expires,
+            attempts=F("attempts") + 1,
+            claimed_at=now,
+        )
+    metrics.add(rows_in=len(rows))
+    for r in rows:
+        r.status = STATUS_PROCESSING
+        r.lease_owner = owner
+        r.lease_expires_at = expires
+        r.attempts += 1
+        r.claimed_at = now
+    return rows
+
+
+def _owned(ids: Iterable[int], owner: Optional[str]):
+    qs = PendingChange.objects.filter(id__in=list(ids), status=STATUS_PROCESSING)
+    # якщо lease вже перехопив інший воркер — не чіпаємо його рядки
+    return qs.filter(lease_owner=owner) if owner else qs
+
+
+def extend_lease(ids: Iterable[int], owner: str, lease_seconds: int = LEASE_SECONDS) -> int:
+    return _owned(ids, owner).update(lease_expires_at=djtz.now() + timedelta(seconds=lease_seconds))
+
+
+def mark_done(ids: Iterable[int], owner: Optional[str] = None) -> int:
+    with transaction.atomic():
+        done = _owned(ids, owner).update(
+            status=STATUS_DONE, error="", lease_owner="", lease_expires_at=None, applied_at=djtz.now(),
+        )
+    metrics.add(rows_out=done)
+    return done
+
+
+def _history_entry(error: str, details: Optional[List[Dict[str, Any]]], now) -> dict:
+    return {
+        "at": now.isoformat(),
+        "error": (error or "")[:1000],
+        "codes": [d.get("code") for d in details or [] if d.get("code")],
+    }
+
+
+def _append_history(entry: dict):
+    # jsonb || jsonb — дописуємо одним UPDATE, без читання рядків
+    return CombinedExpression(
+        F("error_history"), "||", Value([entry], output_field=JSONField()), output_field=JSONField(),
+    )
+
+
+def _give_up(qs, error: str, details: Optional[List[Dict[str, Any]]], now) -> int:
+    """status='error' + копія в DeadLetter (повний текст помилки, історія, payload)."""
+    rows = list(qs.select_for_update())
+    if not rows:
+        return 0
+    entry = _history_entry(error, details, now)
+    for r in rows:
+        r.error_history = list(r.error_history or []) + [entry]
+    dead_letter.record(rows, error, details)
+    return PendingChange.objects.filter(id__in=[r.id for r in rows]).update(
+        status=STATUS_ERROR,
+        error=(error or "")[:1000],
+        lease_owner="",
+        lease_expires_at=None,
+        error_history=_append_history(entry),
+    )
+
+
+def mark_failed(
+    ids: Iterable[int],
+    error: str,
+    owner: Optional[str] = None,
+    retry: bool = True,
+    details: Optional[List[Dict[str, Any]]] = None,
+    retry_base_seconds: Optional[float] = None,
+) -> int:
+    """
+    retry=True: повертає рядки у pending з експоненційним backoff,
+    поки attempts < MAX_ATTEMPTS; далі — остаточний status='error'.
+    retry=False: одразу 'error' (напр. невалідний payload).
+    details — структуровані помилки (dead_letter.error_details) для DeadLetter.
+    retry_base_seconds — база backoff замість RETRY_BASE_SECONDS (помилки, що минають за години).
+    """
+    err = (error or "")[:1000]
+    now = djtz.now()
+    updated = 0
+    with transaction.atomic():
+        qs = _owned(ids, owner)
+        if not retry:
+            given_up = _give_up(qs, error, details, now)
+            metrics.add(errors=given_up)
+            return given_up
+
+        updated += _give_up(qs.filter(attempts__gte=MAX_ATTEMPTS), error, details, now)
+        entry = _history_entry(error, details, now)
+        by_attempts = {}
+        for pk, attempts in qs.filter(attempts__lt=MAX_ATTEMPTS).values_list("id", "attempts"):
+            by_attempts.setdefault(attempts, []).append(pk)
+        for attempts, pks in by_attempts.items():
+            delay = (retry_base_seconds or RETRY_BASE_SECONDS) * (2 ** max(attempts - 1, 0))
+            updated += PendingChange.objects.filter(id__in=pks).update(
+                status=STATUS_PENDING,
+                error=err,
+                lease_owner="",
+                lease_expires_at=None,
+                next_attempt_at=now + timedelta(seconds=delay),
+                error_history=_append_history(entry),
+            )
+    metrics.add(errors=updated)
+    return updated
+
+
+def reap_expired_leases(limit: int = 5000) -> int:
+    """Returns rows with an expired lease back to the queue (crashed workers)."""
+    now = djtz.now()
+    with transaction.atomic():
+        ids = list(
+            PendingChange.objects.filter(
+                status=STATUS_PROCESSING, lease_expires_at__lt=now, created_at__gte=_horizon()
+            )
+            .order_by("lease_expires_at")
+            .select_for_update(skip_locked=True)
+            .values_list("id", flat=True)[:limit]
+        )
+        if not ids:
+            return 0
+        # рядки, що вже вичерпали спроби, більше не повертаємо в чергу
+        exhausted = _give_up(
+            PendingChange.objects.filter(id__in=ids, attempts__gte=MAX_ATTEMPTS),
+            "Lease expired after max attempts",
+            [{"code": "LEASE_EXPIRED", "message": "Lease expired after max attempts"}],
+            now,
+        )
+        return exhausted + PendingChange.objects.filter(id__in=ids, status=STATUS_PROCESSING).update(
+            status=STATUS_PENDING,
+            lease_owner="",
+            lease_expires_at=None,
+            next_attempt_at=now,
+        )
+
+
+def expire_stale(limit: int = 5000) -> int:
+    """
+    Pending/processing rows older than the claim horizon are never claimed again;
+    закриваємо їх як error, щоб retention міг дропнути їхні партиції.
+    """
+    with transaction.atomic():
+        ids = list(
+            PendingChange.objects.filter(
+                status__in=(STATUS_PENDING, STATUS_PROCESSING), created_at__lt=_horizon()
+            )
+            .select_for_update(skip_locked=True)
+            .values_list("id", flat=True)[:limit]
+        )
+        if not ids:
+            return 0
+        msg = f"Expired: not processed within {CLAIM_HORIZON_DAYS} days"
+        return _give_up(
+            PendingChange.objects.filter(id__in=ids), msg, [{"code": "EXPIRED", "message": msg}], djtz.now(),
+        )
@@ -0,0 +1,171 @@
+# googleads_sync/services/rate_limit.py
+"""
+Distributed token-bucket rate limiter (Redis + Lua) для Google Ads і Salesforce.
+
+- Bucket = (key, rate токенів/с, burst). burst > rate дає "кредит" на сплески.
+- acquire() атомарно списує по токену з УСІХ bucket-ів запиту (напр.
+  developer token + customer), або повертає скільки чекати.
+- block() — server-hinted затримка (retry_delay / REQUEST_LIMIT_EXCEEDED):
+  bucket закривається для всіх воркерів до вказаного моменту.
+Без RATE_LIMIT_REDIS_URL працює in-process (лише в межах одного процесу).
+"""
+import threading
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from django.conf import settings
+
+REDIS_URL = getattr(settings, "RATE_LIMIT_REDIS_URL", "") or ""
+MAX_WAIT_SECONDS = float(getattr(settings, "RATE_LIMIT_MAX_WAIT_SECONDS", 120))
+
+
+class Bucket(NamedTuple):
+    key: str
+    rate: float   # tokens per second
+    burst: float  # bucket capacity
+
+
+class RateLimitTimeout(Exception):
+    pass
+
+
+def parse_rate(spec: str, key: str) -> Optional[Bucket]:
+    """'10/20' → Bucket(key, rate=10, burst=20); '10' → burst = rate; '' / '0' → без ліміту."""
+    if not spec:
+        return None
+    rate, _, burst = str(spec).partition("/")
+    rate_f = float(rate)
+    if rate_f <= 0:
+        return None
+    return Bucket(key, rate_f, float(burst) if burst else rate_f)
+
+
+# KEYS = bucket keys; ARGV = requested, then (rate, burst) per key.
+# Повертає {1, 0} якщо списано, або {0, wait_ms}.
+_ACQUIRE_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local requested = tonumber(ARGV[1])
+local state = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+  local rate = tonumber(ARGV[2 * i])
+  local burst = tonumber(ARGV[2 * i + 1])
+  local d = redis.call('HMGET', key, 'tokens', 'ts', 'blocked_until')
+  local tokens = tonumber(d[1]) or burst
+  local ts = tonumber(d[2]) or now
+  local blocked = tonumber(d[3]) or 0
+  tokens = math.min(burst, tokens + math.max(0, now - ts) * rate / 1000)
+  state[i] = tokens
+  if blocked > now then
+    wait = math.max(wait, blocked - now)
+  elseif tokens < requested then
+    wait = math.max(wait, math.ceil((requested - tokens) * 1000 / rate))
+  end
+end
+for i, key in ipairs(KEYS) do
+  local rate = tonumber(ARGV[2 * i])
+  local burst = tonumber(ARGV[2 * i + 1])
+  local tokens = state[i]
+  if wait == 0 then tokens = tokens - requested end
+  redis.call('HSET', key, 'tokens', tokens, 'ts', now)
+  redis.call('PEXPIRE', key, math.ceil(burst * 1000 / rate) + 60000)
+end
+if wait == 0 then return {1, 0} end
+return {0, wait}
+"""
+
+_BLOCK_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local until_ms = now + tonumber(ARGV[1])
+local cur = tonumber(redis.call('HGET', KEYS[1], 'blocked_until')) or 0
+if until_ms > cur then
+  redis.call('HSET', KEYS[1], 'blocked_until', until_ms)
+  redis.call('PEXPIRE', KEYS[1], tonumber(ARGV[1]) + 60000)
+end
+return until_ms
+"""
+
+
+class _RedisBackend:
+    def __init__(self, url: str):
+        import redis  # optional: лише коли налаштований RATE_LIMIT_REDIS_URL
+        self.r = redis.Redis.from_url(url)
+        self._acquire = self.r.register_script(_ACQUIRE_LUA)
+        self._block = self.r.register_script(_BLOCK_LUA)
+
+    def try_acquire(self, buckets: List[Bucket], tokens: float) -> float:
+        args = [tokens]
+        for b in buckets:
+            args += [b.rate, b.burst]
+        ok, wait_ms = self._acquire(keys=[f"rl:{b.key}" for b in buckets], args=args)
+        return 0.0 if int(ok) else int(wait_ms) / 1000.0
+
+    def block(self, key: str, seconds: float):
+        self._block(keys=[f"rl:{key}"], args=[int(seconds * 1000)])
+
+
+class _LocalBackend:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state: Dict[str, list] = {}  # key -> [tokens, ts, blocked_until]
+
+    def try_acquire(self, buckets: List[Bucket], tokens: float) -> float:
+        now = time.monotonic()
+        with self._lock:
+            wait, states = 0.0, []
+            for b in buckets:
+                st = self._state.setdefault(b.key, [b.burst, now, 0.0])
+                st[0] = min(b.burst, st[0] + (now - st[1]) * b.rate)
+                st[1] = now
+                states.append(st)
+                if st[2] > now:
+                    wait = max(wait, st[2] - now)
+                elif st[0] < tokens:
+                    wait = max(wait, (tokens - st[0]) / b.rate)
+            if wait == 0:
+                for st in states:
+                    st[0] -= tokens
+            return wait
+
+    def block(self, key: str, seconds: float):
+        with self._lock:
+            st = self._state.setdefault(key, [0.0, time.monotonic(), 0.0])
+            st[2] = max(st[2], time.monotonic() + seconds)
+
+
+class RateLimiter:
+    def __init__(self, backend=None):
+        self.backend = backend or (_RedisBackend(REDIS_URL) if REDIS_URL else _LocalBackend())
+
+    def acquire(self, buckets: Iterable[Optional[Bucket]], tokens: float = 1, max_wait: float = MAX_WAIT_SECONDS) -> float:
+        """Blocks until all buckets have `tokens`; returns seconds waited."""
+        buckets = [b for b in buckets if b is not None]
+        if not buckets:
+            return 0.0
+        waited = 0.0
+        while True:
+            wait = self.backend.try_acquire(buckets, tokens)
+            if wait <= 0:
+                return waited
+            if waited + wait > max_wait:
+                raise RateLimitTimeout(f"Rate limit wait {waited + wait:.1f}s > {max_wait}s for {[b.key for b in buckets]}")
+            time.sleep(wait)
+            waited += wait
+
+    def block(self, bucket: Optional[Bucket], seconds: float):
+        if bucket is not None and seconds > 0:
+            self.backend.block(bucket.key, seconds)
+
+
+_limiter: Optional[RateLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter() -> RateLimiter:
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter()
+        return _limiter
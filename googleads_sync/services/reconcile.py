@@ -0,0 +1,271 @@
+# googleads_sync/services/reconcile.py
+"""
+Nightly bidirectional reconciliation SF ↔ GA (hash-partitioned join).
+
+1) Обидві сторони стрімляться (SOQL/Bulk 2.0 і GAQL), нормалізуються мапперами
+   і розкладаються у N spill-файлів за crc32(key) % N разом із digest-ом.
+2) Кожен partition join-иться окремо: у памʼяті лише одна сторона одного
+   partition-а (~records / N), тож памʼять обмежена незалежно від обсягу.
+3) Розбіжності (create / update / pause / enable / remove) пишуться як
+   PendingChange через bulk_create; ключі з уже pending-змінами пропускаються.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import zlib
+from datetime import timedelta
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.utils import timezone as djtz
+
+from ..models import Lead, PendingChange
+from ..salesforce.client_rest import soql_stream
+from . import queue
+from .google_ads_client import GoogleAds
+from .id_resolver import get_resolver
+from .mappers import ga_campaign_to_reconcile_dict, sf_campaign_to_dict, sf_lead_to_dict
+
+PARTITIONS = int(getattr(settings, "RECONCILE_PARTITIONS", 64))
+WRITE_BATCH = 1000
+SF_LEAD_GCLID_FIELD = getattr(settings, "SF_LEAD_GCLID_FIELD", "GCLID__c")
+
+CAMPAIGN_FIELDS = ("name", "status")
+LEAD_FIELDS = ("gclid", "status")
+
+
+def digest(data: dict, fields: Iterable[str]) -> str:
+    blob = json.dumps([data.get(f) for f in fields], separators=(",", ":"), default=str)
+    return hashlib.blake2b(blob.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class _Spill:
+    """N append-only jsonl files for one side of the join."""
+
+    def __init__(self, directory: str, side: str, partitions: int):
+        self.paths = [os.path.join(directory, f"{side}-{i:04d}.jsonl") for i in range(partitions)]
+        self._files = [open(p, "w", encoding="utf-8") for p in self.paths]
+        self.count = 0
+
+    def add(self, key: str, data: dict, fields: Iterable[str]):
+        i = zlib.crc32(key.encode("utf-8")) % len(self._files)
+        self._files[i].write(json.dumps([key, digest(data, fields), data], default=str) + "\n")
+        self.count += 1
+
+    def close(self):
+        for f in self._files:
+            f.close()
+
+    def read(self, i: int) -> Iterator[Tuple[str, str, dict]]:
+        with open(self.paths[i], encoding="utf-8") as fh:
+            for line in fh:
+                key, dig, data = json.loads(line)
+                yield key, dig, data
+
+
+def _chunks(it: Iterable, size: int) -> Iterator[list]:
+    buf = []
+    for x in it:
+        buf.append(x)
+        if len(buf) >= size:
+            yield buf
+            buf = []
+    if buf:
+        yield buf
+
+
+def _join(
+    left: _Spill,
+    right: _Spill,
+    diff: Callable[[Optional[dict], Optional[dict]], List[PendingChange]],
+) -> Iterator[PendingChange]:
+    """left = SF (завантажується в памʼять), right = цільова сторона (стрім)."""
+    for i in range(len(left.paths)):
+        sf_side: Dict[str, Tuple[str, dict]] = {key: (dig, data) for key, dig, data in left.read(i)}
+        for key, dig, data in right.read(i):
+            sf = sf_side.pop(key, None)
+            if sf is None:
+                yield from diff(None, data)
+            elif sf[0] != dig:
+                yield from diff(sf[1], data)
+        for _dig, data in sf_side.values():
+            yield from diff(data, None)
+
+
+def _write_changes(resource: str, changes: Iterable[PendingChange], dry_run: bool) -> Iterator[List[PendingChange]]:
+    """
+    bulk_create, пропускаючи ключі, для яких уже є pending/processing зміна;
+    yield-ить по batch-у реально вставлені (dry_run — ті, що були б) зміни.
+    Перевірка — по key_hash у межах claim horizon (pendingchange_key_idx +
+    partition pruning); колізія hash-а лише відкладає зміну до наступного reconcile.
+    """
+    for batch in _chunks(changes, WRITE_BATCH):
+        batch = [ch.assign_priority().assign_key() for ch in batch]
+        busy = set(
+            PendingChange.objects.filter(
+                resource=resource,
+                status__in=("pending", "processing"),
+                key_hash__in={ch.key_hash for ch in batch},
+                created_at__gte=djtz.now() - timedelta(days=queue.CLAIM_HORIZON_DAYS),
+            ).values_list("key_hash", flat=True)
+        )
+        fresh = [ch for ch in batch if ch.key_hash not in busy]
+        if not dry_run:
+            PendingChange.objects.bulk_create(fresh, batch_size=WRITE_BATCH)
+        yield fresh
+
+
+def _count(counts: Dict[str, int], changes: Iterable[PendingChange]) -> Dict[str, int]:
+    for ch in changes:
+        counts[ch.action] = counts.get(ch.action, 0) + 1
+    return counts
+
+
+# ---- Campaigns --------------------------------------------------------------
+
+def _campaign_diff(sf: Optional[dict], ga: Optional[dict]) -> List[PendingChange]:
+    if ga is not None and ga["status"] == "REMOVED":
+        return []  # видалене в GA вже не оживити — нічого не робимо
+    if ga is None:
+        return [PendingChange(
+            resource="campaign", action="create",
+            payload={"Id": sf["sf_id"], "Name": sf["name"], "Status": sf["status"]},
+        )]
+    if sf is None:
+        return [PendingChange(
+            resource="campaign", action="remove",
+            payload={"Id": ga["sf_id"], "resource_name": ga["resource_name"]},
+        )]
+    out = []
+    base = {"Id": sf["sf_id"], "resource_name": ga["resource_name"]}
+    if sf["name"] != ga["name"]:
+        out.append(PendingChange(
+            resource="campaign", action="update", payload={**base, "fields": {"name": sf["name"]}},
+        ))
+    if sf["status"] != ga["status"] and sf["status"] in ("PAUSED", "ENABLED"):
+        action = "pause" if sf["status"] == "PAUSED" else "enable"
+        out.append(PendingChange(resource="campaign", action=action, payload=dict(base)))
+    return out
+
+
+def reconcile_campaigns(partitions: int = PARTITIONS, dry_run: bool = False) -> dict:
+    resolver = get_resolver("campaign")
+    client = GoogleAds()
+    gaql = """
+        SELECT
+          campaign.resource_name,
+          campaign.id,
+          campaign.name,
+          campaign.status,
+          campaign.advertising_channel_type,
+          campaign.start_date,
+          campaign.end_date
+        FROM campaign
+    """
+    with tempfile.TemporaryDirectory(prefix="reconcile-campaign-") as tmp:
+        sf_spill = _Spill(tmp, "sf", partitions)
+        for rec in soql_stream("SELECT Id, Name, Status, IsActive FROM Campaign"):
+            data = sf_campaign_to_dict(rec)
+            sf_spill.add(data["sf_id"], data, CAMPAIGN_FIELDS)
+        sf_spill.close()
+
+        ga_spill = _Spill(tmp, "ga", partitions)
+        unmanaged = 0
+        rows = (ga_campaign_to_reconcile_dict(r) for r in client.search_stream(gaql))
+        for chunk in _chunks(rows, 1000):
+            # GA → SF Id через ExternalIdMap; кампанії без мапи створені не нами
+            sf_ids = resolver.ga_to_sf(d["resource_name"] for d in chunk)
+            for data in chunk:
+                sf_id = sf_ids.get(data["resource_name"])
+                if not sf_id:
+                    unmanaged += 1
+                    continue
+                data["sf_id"] = sf_id
+                ga_spill.add(sf_id, data, CAMPAIGN_FIELDS)
+        ga_spill.close()
+
+        counts: Dict[str, int] = {}
+        for written in _write_changes("campaign", _join(sf_spill, ga_spill, _campaign_diff), dry_run):
+            _count(counts, written)
+    return {
+        "sf": sf_spill.count,
+        "ga": ga_spill.count,
+        "ga_unmanaged": unmanaged,
+        "changes": counts,
+        "dry_run": dry_run,
+    }
+
+
+# ---- Leads ------------------------------------------------------------------
+# GA не віддає список "лідів" для порівняння (лише конверсії), тому цільовою
+# стороною є локальна таблиця Lead — те, що ми вже відправили в GA.
+
+def _lead_diff(sf: Optional[dict], local: Optional[dict]) -> List[PendingChange]:
+    if sf is None:
+        return []  # лід видалено в SF — конверсію не відкликаємо
+    return [PendingChange(
+        resource="lead",
+        action="create" if local is None else "update",
+        payload={
+            "Id": sf["sf_id"],
+            "gclid": sf["gclid"],
+            "email": sf["email"],
+            "phone": sf["phone"],
+            "conversion_time": sf["conversion_time"],
+            "status": sf["status"],
+        },
+    )]
+
+
+def reconcile_leads(partitions: int = PARTITIONS, dry_run: bool = False) -> dict:
+    soql = (
+        f"SELECT Id, Status, Email, Phone, CreatedDate, {SF_LEAD_GCLID_FIELD} "
+        f"FROM Lead WHERE {SF_LEAD_GCLID_FIELD} != null"
+    )
+    with tempfile.TemporaryDirectory(prefix="reconcile-lead-") as tmp:
+        sf_spill = _Spill(tmp, "sf", partitions)
+        for rec in soql_stream(soql):
+            data = sf_lead_to_dict(rec, SF_LEAD_GCLID_FIELD)
+            sf_spill.add(data["sf_id"], data, LEAD_FIELDS)
+        sf_spill.close()
+
+        local_spill = _Spill(tmp, "local", partitions)
+        for sf_id, click_id, status in (
+            Lead.objects.exclude(sf_id__isnull=True)
+            .values_list("sf_id", "ga_click_id", "status")
+            .iterator(chunk_size=5000)
+        ):
+            local_spill.add(sf_id, {"sf_id": sf_id, "gclid": click_id or "", "status": status}, LEAD_FIELDS)
+        local_spill.close()
+
+        counts: Dict[str, int] = {}
+        for written in _write_changes("lead", _join(sf_spill, local_spill, _lead_diff), dry_run):
+            _count(counts, written)
+            if not dry_run and written:
+                # фіксуємо стан лише для поставлених у чергу змін, щоб наступний reconcile
+                # не дублював їх; ліди з уже pending-зміною лишаються "несинхронізованими"
+                now = djtz.now()
+                Lead.objects.bulk_create(
+                    [
+                        Lead(
+                            sf_id=ch.payload["Id"],
+                            ga_click_id=ch.payload["gclid"],
+                            status=ch.payload["status"],
+                            last_synced_at=now,
+                        )
+                        for ch in written
+                    ],
+                    update_conflicts=True,
+                    unique_fields=["sf_id"],
+                    update_fields=["ga_click_id", "status", "last_synced_at"],
+                    batch_size=WRITE_BATCH,
+                )
+    return {"sf": sf_spill.count, "local": local_spill.count, "changes": counts, "dry_run": dry_run}
+
+
+def run_full_reconcile(dry_run: bool = False) -> dict:
+    return {
+        "campaigns": reconcile_campaigns(dry_run=dry_run),
+        "leads": reconcile_leads(dry_run=dry_run),
+    }
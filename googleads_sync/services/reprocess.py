@@ -0,0 +1,251 @@
+# googleads_sync/services/reprocess.py
+"""
+Повторна обробка збереженої історії SalesforceEvent → PendingChange.
+
+Після виправлення мапінгу (salesforce.cdc) зміни перевиводяться з уже
+отриманих подій, а не з нової підписки:
+  - події стрімляться server-side cursor-ом (.iterator(chunk_size)), payload
+    читається як text — json.loads, як і сам мапінг, іде у воркерах;
+  - chunk-и мапляться паралельно (ProcessPoolExecutor), результати
+    пишуться bulk_create-ом у головному процесі, у порядку подій;
+  - diff з уже наявними PendingChange по події-джерелу (source_event_id,
+    resource, action): вставляються лише відсутні; dry_run — лише рахує.
+    Рядки без source_event_id (записані до його появи) зіставляються як
+    мультимножина (resource, action, key_hash, source_received_at): події
+    одного flush-а мають спільний received_at, тож кількість має значення.
+"""
+import json
+import logging
+import multiprocessing
+from collections import Counter, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Deque, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+import django
+from django.conf import settings
+from django.db.models import Q, QuerySet, TextField
+from django.db.models.functions import Cast
+
+from ..models import PendingChange, SalesforceEvent
+from ..salesforce import cdc
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = int(getattr(settings, "REPROCESS_CHUNK_SIZE", 2000))
+WORKERS = int(getattr(settings, "REPROCESS_WORKERS", 4))
+WRITE_BATCH = 1000
+
+# (SalesforceEvent.id, raw payload json, received_at, commit_at)
+EventRow = Tuple[int, str, datetime, Optional[datetime]]
+# (resource, action, source_event_id) — ідентичність PendingChange для diff
+ChangeKey = Tuple[str, str, int]
+# (resource, action, key_hash, source_received_at) — рядки без source_event_id
+LegacyKey = Tuple[str, str, Optional[int], Optional[datetime]]
+
+_CHANGE_FIELDS = (
+    "resource", "action", "payload", "priority", "key_hash",
+    "source_commit_at", "source_received_at", "source_event_id",
+)
+
+
+def map_chunk(rows: Sequence[EventRow]) -> List[Dict[str, Any]]:
+    """Воркер: сирі події → kwargs для PendingChange (model instances не тягаємо між процесами)."""
+    out = []
+    for event_id, raw, received_at, commit_at in rows:
+        for ch in cdc.to_pending_changes(json.loads(raw), received_at, commit_at):
+            ch.source_event_id = event_id
+            out.append({f: getattr(ch, f) for f in _CHANGE_FIELDS})
+    return out
+
+
+def iter_events(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    topics: Sequence[str] = (),
+    chunk_size: int = CHUNK_SIZE,
+) -> Iterator[List[EventRow]]:
+    """Chunk-и подій у порядку (received_at, id); server-side cursor, без кешу queryset-а."""
+    rows = (
+        _events(since, until, topics)
+        .order_by("received_at", "id")
+        .annotate(raw=Cast("payload", TextField()))
+        .values_list("id", "raw", "received_at", "commit_at")
+        .iterator(chunk_size=chunk_size)
+    )
+    chunk: List[EventRow] = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def existing_keys(
+    since: Optional[datetime],
+    until: Optional[datetime],
+    topics: Sequence[str] = (),
+) -> Tuple[Set[ChangeKey], Counter]:
+    """
+    (ключі рядків із source_event_id, Counter LegacyKey рядків без нього).
+    topics — лише зміни подій цих topic-ів; рядки без source_event_id — ті,
+    що мають received_at однієї з цих подій (інакше їх не зіставити).
+    """
+    qs = PendingChange.objects.filter(source_received_at__isnull=False)
+    if since:
+        qs = qs.filter(source_received_at__gte=since)
+    if until:
+        qs = qs.filter(source_received_at__lt=until)
+    if topics:
+        events = _events(since, until, topics)
+        qs = qs.filter(
+            Q(source_event_id__in=events.values("id"))
+            | Q(source_event_id__isnull=True, source_received_at__in=events.values("received_at"))
+        )
+    keys: Set[ChangeKey] = set()
+    legacy: Counter = Counter()
+    rows = (
+        qs.order_by()
+        .values_list("resource", "action", "source_event_id", "key_hash", "source_received_at")
+        .iterator(chunk_size=10000)
+    )
+    for resource, action, event_id, key_hash, received_at in rows:
+        if event_id is None:
+            legacy[(resource, action, key_hash, received_at)] += 1
+        else:
+            keys.add((resource, action, event_id))
+    return keys, legacy
+
+
+def _key(kw: Dict[str, Any]) -> ChangeKey:
+    return kw["resource"], kw["action"], kw["source_event_id"]
+
+
+def _legacy_key(kw: Dict[str, Any]) -> LegacyKey:
+    return kw["resource"], kw["action"], kw["key_hash"], kw["source_received_at"]
+
+
+def _events(since: Optional[datetime], until: Optional[datetime], topics: Sequence[str]) -> QuerySet:
+    qs = SalesforceEvent.objects.all()
+    if since:
+        qs = qs.filter(received_at__gte=since)
+    if until:
+        qs = qs.filter(received_at__lt=until)
+    if topics:
+        qs = qs.filter(object_name__in=list(topics))
+    return qs
+
+
+@dataclass
+class ReprocessResult:
+    events: int = 0
+    derived: Counter = field(default_factory=Counter)   # "resource.action" → з подій
+    added: Counter = field(default_factory=Counter)     # відсутні серед наявних (вставлено / було б)
+    stale: Counter = field(default_factory=Counter)     # наявні, яких новий мапінг не дає
+    samples: List[str] = field(default_factory=list)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "events": self.events,
+            "derived": dict(self.derived),
+            "added": dict(self.added),
+            "stale": dict(self.stale),
+        }
+
+
+class Reprocessor:
+    def __init__(
+        self,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        topics: Sequence[str] = (),
+        workers: int = WORKERS,
+        chunk_size: int = CHUNK_SIZE,
+        dry_run: bool = False,
+        force: bool = False,
+        max_samples: int = 20,
+    ):
+        self.since, self.until, self.topics = since, until, tuple(topics)
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.dry_run = dry_run
+        self.force = force  # вставити все, навіть якщо такий PendingChange уже є
+        self.max_samples = max_samples
+        self.result = ReprocessResult()
+        self._existing: Set[ChangeKey] = set()
+        self._legacy: Counter = Counter()
+        self._buffer: List[PendingChange] = []
+
+    def _map_all(self) -> Iterator[Tuple[int, List[Dict[str, Any]]]]:
+        """(кількість подій у chunk-у, kwargs змін) у порядку chunk-ів; ≤ 2×workers chunk-ів у польоті."""
+        chunks = iter_events(self.since, self.until, self.topics, self.chunk_size)
+        if self.workers > 1:
+            try:
+                # forkserver: воркери не успадковують DB-зʼєднання і потоки батьківського процесу
+                with ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("forkserver"),
+                    initializer=django.setup,
+                ) as pool:
+                    inflight: Deque[Tuple[int, Future]] = deque()
+                    for chunk in chunks:
+                        inflight.append((len(chunk), pool.submit(map_chunk, chunk)))
+                        if len(inflight) >= 2 * self.workers:
+                            n, fut = inflight.popleft()
+                            yield n, fut.result()
+                    while inflight:
+                        n, fut = inflight.popleft()
+                        yield n, fut.result()
+                return
+            except (AssertionError, BrokenProcessPool, OSError) as e:
+                if self.result.events:
+                    raise  # частину вже записано — не змішувати з inline-проходом
+                # напр. daemon-процес Celery prefork не може мати дітей
+                logger.warning("reprocess pool unavailable (%s); mapping inline", e)
+                chunks = iter_events(self.since, self.until, self.topics, self.chunk_size)
+        for chunk in chunks:
+            yield len(chunk), map_chunk(chunk)
+
+    def _flush(self):
+        if self._buffer and not self.dry_run:
+            PendingChange.objects.bulk_create(self._buffer, batch_size=WRITE_BATCH)
+        self._buffer = []
+
+    def run(self) -> ReprocessResult:
+        res = self.result
+        self._existing, self._legacy = existing_keys(self.since, self.until, self.topics)
+        unmatched = set(self._existing)
+        for n_events, changes in self._map_all():
+            res.events += n_events
+            for kw in changes:
+                label = f"{kw['resource']}.{kw['action']}"
+                res.derived[label] += 1
+                key, legacy = _key(kw), _legacy_key(kw)
+                if key in self._existing:
+                    unmatched.discard(key)
+                    matched = True
+                elif self._legacy[legacy] > 0:
+                    self._legacy[legacy] -= 1  # один наявний рядок покриває одну виведену зміну
+                    matched = True
+                else:
+                    matched = False
+                if matched and not self.force:
+                    continue
+                res.added[label] += 1
+                if len(res.samples) < self.max_samples:
+                    res.samples.append(f"+ {label} {PendingChange.record_key(kw['payload'])} @ {kw['source_received_at']}")
+                self._buffer.append(PendingChange(status="pending", **kw))
+            if len(self._buffer) >= WRITE_BATCH:
+                self._flush()
+        self._flush()
+        for resource, action, _event_id in unmatched:
+            res.stale[f"{resource}.{action}"] += 1
+        for (resource, action, _h, _at), n in self._legacy.items():
+            # з --topic рядок без source_event_id може належати іншому topic-у того ж flush-а
+            if n > 0 and not self.topics:
+                res.stale[f"{resource}.{action}"] += n
+        return res
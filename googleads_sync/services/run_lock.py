@@ -0,0 +1,104 @@
+# googleads_sync/services/run_lock.py
+"""
+Lease-based run lock for sync pipelines (рядок RunLock на group + customer).
+
+Advisory lock Postgres тримається сесією, а pipeline — це ланцюжок Celery-задач
+на різних воркерах, тому lock — це lease: власник (run id) і expires_at.
+Стадії продовжують lease heartbeat-ом; якщо run помер, lease спливає і
+наступний тригер забирає lock.
+"""
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import Optional
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone as djtz
+
+from ..models import RunLock
+
+logger = logging.getLogger(__name__)
+
+LEASE_SECONDS = int(getattr(settings, "RUN_LOCK_LEASE_SECONDS", 900))
+HEARTBEAT_SECONDS = max(1, LEASE_SECONDS // 3)
+
+
+def lock_name(group: str, customer_id: Optional[str]) -> str:
+    return f"{group}:{customer_id or 'default'}"
+
+
+def acquire(name: str, owner: str, pipeline: str, lease_seconds: int = LEASE_SECONDS) -> bool:
+    """True якщо lock вільний, прострочений або вже наш."""
+    RunLock.objects.get_or_create(name=name)
+    now = djtz.now()
+    with transaction.atomic():
+        lock = RunLock.objects.select_for_update().get(name=name)
+        if lock.owner and lock.owner != owner and lock.expires_at and lock.expires_at > now:
+            return False
+        if lock.owner and lock.owner != owner:
+            logger.warning("Run lock %s: lease of %s (%s) expired, taking over", name, lock.owner, lock.pipeline)
+        lock.owner = owner
+        lock.pipeline = pipeline
+        lock.acquired_at = now
+        lock.heartbeat_at = now
+        lock.expires_at = now + timedelta(seconds=lease_seconds)
+        lock.save()
+    return True
+
+
+def heartbeat(name: str, owner: str, lease_seconds: int = LEASE_SECONDS) -> bool:
+    """Extends the lease; False якщо lock уже не наш (прострочився і його забрали)."""
+    now = djtz.now()
+    return bool(
+        RunLock.objects.filter(name=name, owner=owner).update(
+            heartbeat_at=now, expires_at=now + timedelta(seconds=lease_seconds),
+        )
+    )
+
+
+def release(name: str, owner: str) -> str:
+    """Frees the lock; повертає pipeline, який треба перезапустити (coalesce), або ""."""
+    with transaction.atomic():
+        lock = RunLock.objects.select_for_update().filter(name=name, owner=owner).first()
+        if lock is None:
+            return ""
+        rerun = lock.rerun_pipeline
+        lock.owner = ""
+        lock.expires_at = None
+        lock.rerun_pipeline = ""
+        lock.save(update_fields=["owner", "expires_at", "rerun_pipeline"])
+    return rerun
+
+
+def request_rerun(name: str, pipeline: str) -> bool:
+    """Coalesce: поточний власник після release стартує pipeline ще раз (один на всі тригери)."""
+    return bool(RunLock.objects.filter(name=name).exclude(owner="").update(rerun_pipeline=pipeline))
+
+
+@contextmanager
+def keep_alive(name: Optional[str], owner: Optional[str], interval: float = HEARTBEAT_SECONDS):
+    """Heartbeat у фоновому потоці, поки виконується довга стадія."""
+    if not name or not owner:
+        yield
+        return
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(interval):
+                if not heartbeat(name, owner):
+                    logger.warning("Run lock %s lost by %s", name, owner)
+                    return
+        finally:
+            connection.close()
+
+    heartbeat(name, owner)
+    thread = threading.Thread(target=beat, name=f"run-lock-{name}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join(timeout=5)
@@ -0,0 +1,247 @@
+# googleads_sync/services/snapshots.py
+"""
+GA → snapshot-таблиці (campaign / ad group / ad) з дедуплікацією за content hash.
+
+На початку run-у один раз вантажимо індекс {external_id: останній hash},
+далі стрімимо GAQL і пишемо bulk_create лише для сутностей, чий hash змінився.
+"""
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List
+
+from django.db import connection
+from django.db.models import Model
+from django.utils import timezone as djtz
+
+from ..models import (
+    Campaign,
+    GoogleAdsAdGroupSnapshot,
+    GoogleAdsAdSnapshot,
+    GoogleAdsCampaignSnapshot,
+    SyncCursor,
+)
+from .google_ads_client import GoogleAds
+from .mappers import (
+    ad_group_snapshot_pb_to_dict,
+    ad_group_snapshot_row_to_dict,
+    ad_snapshot_pb_to_dict,
+    ad_snapshot_row_to_dict,
+    campaign_snapshot_pb_to_dict,
+    campaign_snapshot_row_to_dict,
+)
+
+CAMPAIGN_GAQL = """
+    SELECT
+      campaign.resource_name,
+      campaign.id,
+      campaign.name,
+      campaign.status,
+      campaign.advertising_channel_type,
+      campaign.start_date,
+      campaign.end_date,
+      campaign.campaign_budget,
+      campaign_budget.amount_micros
+    FROM campaign
+"""
+
+AD_GROUP_GAQL = """
+    SELECT
+      ad_group.resource_name,
+      ad_group.id,
+      ad_group.name,
+      ad_group.status,
+      ad_group.type,
+      ad_group.campaign,
+      ad_group.cpc_bid_micros
+    FROM ad_group
+"""
+
+AD_GAQL = """
+    SELECT
+      ad_group_ad.resource_name,
+      ad_group_ad.status,
+      ad_group_ad.ad_group,
+      ad_group_ad.ad.id,
+      ad_group_ad.ad.name,
+      ad_group_ad.ad.type,
+      ad_group_ad.ad.final_urls,
+      campaign.resource_name
+    FROM ad_group_ad
+"""
+
+
+def content_hash(data: dict) -> str:
+    """Stable sha256 over the normalized entity (sorted keys, no whitespace)."""
+    blob = json.dumps(data, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def load_hash_index(model, **filters) -> Dict[str, str]:
+    """{external_id: content_hash} останнього snapshot-у (DISTINCT ON по external_id)."""
+    qs = model.objects.filter(**filters)
+    rows = (
+        qs.order_by("external_id", "-snapshot_at")
+        .distinct("external_id")
+        .values_list("external_id", "content_hash")
+    )
+    return dict(rows.iterator(chunk_size=5000))
+
+
+class SnapshotWriter:
+    """Buffers changed snapshots and flushes them with bulk_create."""
+
+    def __init__(self, model, hash_index: Dict[str, str], batch_size: int = 1000):
+        self.model = model
+        self.index = hash_index
+        self.batch_size = batch_size
+        self.snapshot_at = djtz.now()
+        self._buffer: List[Model] = []
+        self.seen = 0
+        self.written = 0
+
+    def add(self, data: dict) -> bool:
+        self.seen += 1
+        h = content_hash(data)
+        if self.index.get(data["external_id"]) == h:
+            return False
+        self.index[data["external_id"]] = h
+        self._buffer.append(self.model(**data, content_hash=h, snapshot_at=self.snapshot_at))
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+        return True
+
+    def flush(self):
+        if self._buffer:
+            self.model.objects.bulk_create(self._buffer, batch_size=self.batch_size)
+            self.written += len(self._buffer)
+            self._buffer = []
+
+    def stats(self) -> dict:
+        return {"seen": self.seen, "written": self.written}
+
+
+def _write_stream(client: GoogleAds, gaql: str, model, row_to_dict: Callable, pb_to_dict: Callable, **index_filters) -> dict:
+    writer = SnapshotWriter(model, load_hash_index(model, **index_filters))
+    for data in client.search_stream_dicts(gaql, row_to_dict, pb_to_dict):
+        writer.add(data)
+    writer.flush()
+    return writer.stats()
+
+
+def snapshot_campaigns(client: GoogleAds | None = None) -> dict:
+    return _write_stream(client or GoogleAds(), CAMPAIGN_GAQL, GoogleAdsCampaignSnapshot,
+                         campaign_snapshot_row_to_dict, campaign_snapshot_pb_to_dict)
+
+
+def snapshot_ad_groups(client: GoogleAds | None = None) -> dict:
+    return _write_stream(client or GoogleAds(), AD_GROUP_GAQL, GoogleAdsAdGroupSnapshot,
+                         ad_group_snapshot_row_to_dict, ad_group_snapshot_pb_to_dict)
+
+
+def snapshot_ads(client: GoogleAds | None = None) -> dict:
+    return _write_stream(client or GoogleAds(), AD_GAQL, GoogleAdsAdSnapshot,
+                         ad_snapshot_row_to_dict, ad_snapshot_pb_to_dict)
+
+
+
+
+# ---- Sharded ad group / ad pulls -------------------------------------------
+# Великі акаунти: один stream по ad_group_ad не вкладається в soft time limit.
+# Ділимо на shard-и за списками campaign.id; кожен shard має власний checkpoint
+# у SyncCursor (resource="snap:<kind>:<first>-<last>"), тож впалий shard можна
+# перезапустити окремо, а вже завершені в межах run-у пропускаються.
+
+SHARD_KINDS = ("ad_groups", "ads")
+
+
+def campaign_shards(shard_size: int = 50) -> List[List[int]]:
+    ids = list(Campaign.objects.order_by("campaign_id").values_list("campaign_id", flat=True))
+    return [ids[i:i + shard_size] for i in range(0, len(ids), shard_size)]
+
+
+def shard_key(kind: str, campaign_ids: List[int]) -> str:
+    return f"snap:{kind}:{campaign_ids[0]}-{campaign_ids[-1]}"
+
+
+def _shard_done(key: str, run_started_at) -> bool:
+    return bool(run_started_at) and SyncCursor.objects.filter(resource=key, cursor__gte=run_started_at).exists()
+
+
+def snapshot_shard(kind: str, campaign_ids: List[int], run_started_at=None, client: GoogleAds | None = None) -> dict:
+    """Snapshots ad groups or ads of the given campaigns; idempotent within one run."""
+    if kind not in SHARD_KINDS:
+        raise ValueError(f"Unknown shard kind: {kind}")
+    key = shard_key(kind, campaign_ids)
+    if _shard_done(key, run_started_at):
+        return {"shard": key, "skipped": True}
+
+    client = client or GoogleAds()
+    where = f" WHERE campaign.id IN ({', '.join(str(int(i)) for i in campaign_ids)})"
+    campaign_resources = list(
+        Campaign.objects.filter(campaign_id__in=campaign_ids).values_list("resource_name", flat=True)
+    )
+    if kind == "ad_groups":
+        stats = _write_stream(
+            client, AD_GROUP_GAQL + where, GoogleAdsAdGroupSnapshot,
+            ad_group_snapshot_row_to_dict, ad_group_snapshot_pb_to_dict,
+            campaign_external_id__in=campaign_resources,
+        )
+    else:
+        ad_groups = GoogleAdsAdGroupSnapshot.objects.filter(
+            campaign_external_id__in=campaign_resources
+        ).values("external_id")
+        stats = _write_stream(
+            client, AD_GAQL + where, GoogleAdsAdSnapshot,
+            ad_snapshot_row_to_dict, ad_snapshot_pb_to_dict,
+            ad_group_external_id__in=ad_groups,
+        )
+
+    SyncCursor.objects.update_or_create(resource=key, defaults={"cursor": djtz.now()})
+    return {"shard": key, **stats}
+
+
+def _snapshot_shard_in_thread(*args, **kwargs) -> dict:
+    try:
+        return snapshot_shard(*args, **kwargs)
+    finally:
+        # кожен потік має власне DB-зʼєднання — закриваємо, щоб не текли
+        connection.close()
+
+
+def snapshot_sharded(kind: str, shard_size: int = 50, max_workers: int = 4, run_started_at=None) -> dict:
+    """In-process variant: shards via a bounded thread pool (gRPC client is shared)."""
+    run_started_at = run_started_at or djtz.now()
+    client = GoogleAds()
+    results, failed = [], []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(_snapshot_shard_in_thread, kind, ids, run_started_at, client): ids
+            for ids in campaign_shards(shard_size)
+        }
+        for fut in as_completed(futures):
+            try:
+                results.append(fut.result())
+            except Exception as e:
+                failed.append({"shard": shard_key(kind, futures[fut]), "error": str(e)[:500]})
+    return {
+        "kind": kind,
+        "shards": len(futures),
+        "written": sum(r.get("written", 0) for r in results),
+        "failed": failed,
+    }
+
+
+def snapshot_all(shard_size: int = 50, max_workers: int = 4) -> dict:
+    """
+    Campaigns, потім ad groups і ads shard-ами — синхронно, в межах виклику
+    (DAG-стадія завершується лише коли всі snapshot-и записані).
+    Впалі shard-и ad groups зупиняють ads: вони залежать від ad group snapshot-ів.
+    """
+    run_started_at = djtz.now()
+    out = {"campaigns": snapshot_campaigns(), "run_started_at": run_started_at.isoformat()}
+    for kind in SHARD_KINDS:
+        res = out[kind] = snapshot_sharded(kind, shard_size, max_workers, run_started_at)
+        if res["failed"]:
+            raise RuntimeError(f"{kind}: {len(res['failed'])} shard(s) failed: {res['failed'][:3]}")
+    return out
@@ -0,0 +1,126 @@
+# googleads_sync/services/sync_runs.py
+"""
+SyncRun / SyncStageRun ledger: що кожна стадія pipeline-а зробила і за скільки.
+
+start_run() — у тригері (той самий run_id, що й у RunLock), stage()
+обгортає виконання стадії в run_stage і пише SyncStageRun з лічильниками
+services.metrics і рухом SyncCursor; finish_run() підсумовує стадії.
+throughput() — історія для capacity planning (rows/s по годинах / днях).
+"""
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone as djtz
+
+from ..models import SyncCursor, SyncRun, SyncStageRun
+from . import metrics
+
+TRUNC = {"hour": TruncHour, "day": TruncDay}
+
+
+def start_run(run_id: str, pipeline: str, customer_id: str = "") -> SyncRun:
+    run, _ = SyncRun.objects.get_or_create(
+        run_id=run_id, defaults={"pipeline": pipeline, "customer_id": customer_id or ""},
+    )
+    return run
+
+
+def _cursors() -> Dict[str, str]:
+    return {r: c.isoformat() for r, c in SyncCursor.objects.values_list("resource", "cursor")}
+
+
+class StageRecord:
+    """Що стадія може доповнити сама (result/error) перед записом."""
+
+    def __init__(self):
+        self.result = None
+        self.error = ""
+
+
+@contextmanager
+def stage(run_id: Optional[str], pipeline: str, name: str, queue: str = ""):
+    if not run_id:
+        yield StageRecord()
+        return
+    run = start_run(run_id, pipeline)
+    before = _cursors()
+    started = djtz.now()
+    record = StageRecord()
+    with metrics.collect() as counters:
+        try:
+            yield record
+        finally:
+            finished = djtz.now()
+            after = _cursors()
+            moved = {k for k in set(before) | set(after) if before.get(k) != after.get(k)}
+            values = dict(counters.values)
+            if isinstance(record.result, dict) and isinstance(record.result.get("processed"), int):
+                values["rows_out"] = max(values["rows_out"], record.result["processed"])
+            values["errors"] += 1 if record.error else 0
+            SyncStageRun.objects.update_or_create(
+                run=run,
+                stage=name,
+                defaults={
+                    "queue": queue,
+                    "started_at": started,
+                    "finished_at": finished,
+                    "duration_ms": (finished - started).total_seconds() * 1000,
+                    "cursor_before": {k: before.get(k) for k in moved},
+                    "cursor_after": {k: after.get(k) for k in moved},
+                    "result": record.result,
+                    "error": record.error or "",
+                    **values,
+                },
+            )
+
+
+def finish_run(run_id: Optional[str]) -> Optional[SyncRun]:
+    run = SyncRun.objects.filter(run_id=run_id).first() if run_id else None
+    if run is None:
+        return None
+    totals = run.stages.aggregate(
+        **{f: Sum(f) for f in metrics.FIELDS},
+        n=Count("id"),
+        failed=Count("id", filter=~Q(error="")),
+    )
+    for f in metrics.FIELDS:
+        setattr(run, f, totals[f] or 0)
+    if totals["failed"] == 0:
+        run.status = "success"
+    elif totals["failed"] < totals["n"]:
+        run.status = "partial"
+    else:
+        run.status = "failed"
+    run.finished_at = djtz.now()
+    run.save()
+    return run
+
+
+def throughput(pipeline: Optional[str] = None, stage: Optional[str] = None, since=None, bucket: str = "day") -> List[Dict]:
+    """[{period, stage, runs, rows_out, api_calls, errors, seconds, rows_per_second}] по періодах."""
+    qs = SyncStageRun.objects.all()
+    if pipeline:
+        qs = qs.filter(run__pipeline=pipeline)
+    if stage:
+        qs = qs.filter(stage=stage)
+    if since:
+        qs = qs.filter(started_at__gte=since)
+    rows = (
+        qs.annotate(period=TRUNC[bucket]("started_at"))
+        .values("period", "stage")
+        .annotate(
+            runs=Count("id"),
+            rows_out=Sum("rows_out"),
+            api_calls=Sum("api_calls"),
+            errors=Sum("errors"),
+            ms=Sum("duration_ms"),
+        )
+        .order_by("-period", "stage")
+    )
+    out = []
+    for r in rows:
+        seconds = (r.pop("ms") or 0) / 1000.0
+        out.append({**r, "seconds": seconds, "rows_per_second": (r["rows_out"] or 0) / seconds if seconds else None})
+    return out
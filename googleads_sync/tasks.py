@@ -1,17 +1,68 @@
 # googleads_sync/tasks.py
+from datetime import datetime
+
+import logging
+import os
+import uuid
+
 from celery import shared_task, chain, group
+from django.conf import settings
+from django.utils import timezone as djtz
+
+from .services import idempotency, run_lock, sync_runs
+from .services.campaign_metrics import pull_campaign_metrics
+from .services.dag import Stage, build_canvas, flatten_results
 from .services.pipelines import (
     pull_campaign_deltas,
     push_campaign_changes,
     pull_lead_deltas,       # ADD
     push_lead_changes,      # ADD
+    push_adjustment_changes,
 )
+from .services.queue import reap_expired_leases, expire_stale
+from .services.partitions import maintain_partitions
+from .services.reconcile import run_full_reconcile
+from .services.snapshots import SHARD_KINDS, campaign_shards, snapshot_all, snapshot_campaigns, snapshot_shard
+
+logger = logging.getLogger(__name__)
+
+# Черги: ga-read (GAQL), ga-write (mutate / uploads), pubsub (SF Pub/Sub), celery (оркестрація)
+Q_GA_READ = "ga-read"
+Q_GA_WRITE = "ga-write"
+Q_PUBSUB = "pubsub"
+
+# Pipelines with the same lock group never overlap for one customer (спільні SyncCursor / PendingChange)
+RUN_LOCK_GROUPS = getattr(settings, "RUN_LOCK_GROUPS", {})
+RUN_LOCK_POLICIES = getattr(settings, "RUN_LOCK_POLICIES", {})  # skip | queue | coalesce
+RUN_LOCK_QUEUE_RETRY_SECONDS = int(getattr(settings, "RUN_LOCK_QUEUE_RETRY_SECONDS", 60))
+RUN_LOCK_QUEUE_MAX_RETRIES = int(getattr(settings, "RUN_LOCK_QUEUE_MAX_RETRIES", 30))
 
 @shared_task(bind=True, name="ads_sync.pull_campaign_deltas")
 def pull_campaign_deltas_task(self):
     processed = pull_campaign_deltas()
     return {"processed": processed}
 
+@shared_task(bind=True, name="ads_sync.snapshot_shard", autoretry_for=(Exception,), retry_backoff=15, retry_jitter=True, max_retries=3)
+def snapshot_shard_task(self, kind, campaign_ids, run_started_at=None):
+    started = datetime.fromisoformat(run_started_at) if run_started_at else None
+    return snapshot_shard(kind, campaign_ids, started)
+
+@shared_task(bind=True, name="ads_sync.snapshot_google_ads")
+def snapshot_google_ads_task(self, _prev=None, shard_size=50, max_parallel=4, run_started_at=None, **_):
+    """
+    campaigns → *Snapshot одразу; ad groups / ads — shard-ами по campaign.id,
+    хвилями по max_parallel задач. Для resume передай той самий run_started_at:
+    shard-и, завершені після нього, буде пропущено.
+    """
+    campaigns = snapshot_campaigns()
+    run_started_at = run_started_at or djtz.now().isoformat()
+    waves = []
+    for kind in SHARD_KINDS:  # ad_groups перед ads (hash index ads залежить від ad groups)
+        sigs = [snapshot_shard_task.si(kind, ids, run_started_at) for ids in campaign_shards(shard_size)]
+        waves += [group(sigs[i:i + max_parallel]) for i in range(0, len(sigs), max_parallel)]
+    res = chain(*waves).apply_async() if waves else None
+    return {"campaigns": campaigns, "run_started_at": run_started_at, "shards_id": res.id if res else None}
+
 @shared_task(bind=True, name="ads_sync.push_campaign_changes")
 def push_campaign_changes_task(self, _prev=None, **_):
     processed = push_campaign_changes()
@@ -23,29 +74,168 @@ def push_lead_changes_task(self, _prev=None, **_):
     processed = push_lead_changes()
     return {"processed": processed}
 
+@shared_task(bind=True, name="ads_sync.push_adjustment_changes")
+def push_adjustment_changes_task(self, _prev=None, **_):
+    """Opportunity restate / retract → UploadConversionAdjustments."""
+    processed = push_adjustment_changes()
+    return {"processed": processed}
+
 @shared_task(bind=True, name="ads_sync.pull_lead_deltas")
 def pull_lead_deltas_task(self, _prev=None, **_):
     processed = pull_lead_deltas()
     return {"processed": processed}
 
+@shared_task(bind=True, name="ads_sync.pull_campaign_metrics")
+def pull_campaign_metrics_task(self, _prev=None, lookback_days=None, **_):
+    """Daily metrics за ковзним вікном → CampaignDailyMetric (COPY → staging → merge)."""
+    if lookback_days:
+        return pull_campaign_metrics(lookback_days=lookback_days)
+    return pull_campaign_metrics()
+
+@shared_task(bind=True, name="ads_sync.reap_pending_change_leases")
+def reap_pending_change_leases_task(self):
+    """Повертає у pending рядки, чий lease прострочено (воркер впав посеред batch)."""
+    return {"reaped": reap_expired_leases()}
+
+@shared_task(bind=True, name="ads_sync.maintain_partitions")
+def maintain_partitions_task(self):
+    """Щоденно: закриває застарілі pending, створює наступні партиції, дропає прострочені."""
+    expired = expire_stale()
+    return {"expired": expired, "tables": maintain_partitions(), "conversion_keys_purged": idempotency.purge()}
+
+# ---- Stage DAG ---------------------------------------------------------------
+
+STAGE_FUNCS = {
+    "pull_campaign_deltas": lambda: {"processed": pull_campaign_deltas()},
+    # не snapshot_google_ads_task: його shard-хвилі йдуть окремо від canvas-а, і run (та lock)
+    # завершився б раніше за запис snapshot-ів — shard-и тут виконуються в межах стадії
+    "snapshot_google_ads": lambda: snapshot_all(),
+    "push_campaign_changes": lambda: {"processed": push_campaign_changes()},
+    "push_lead_changes": lambda: {"processed": push_lead_changes()},
+    "pull_lead_deltas": lambda: {"processed": pull_lead_deltas()},
+    "push_adjustment_changes": lambda: {"processed": push_adjustment_changes()},
+    "pull_campaign_metrics": lambda: pull_campaign_metrics(),
+    "reconcile": lambda: run_full_reconcile(),
+}
+
+SYNC_STAGES = (
+    Stage("pull_campaign_deltas", queue=Q_GA_READ),
+    Stage("snapshot_google_ads", deps=("pull_campaign_deltas",), queue=Q_GA_READ),
+    Stage("push_campaign_changes", deps=("pull_campaign_deltas",), queue=Q_GA_WRITE),
+    # lead-гілка не залежить від campaign-гілки → іде паралельно
+    Stage("push_lead_changes", queue=Q_GA_WRITE),
+    Stage("pull_lead_deltas", deps=("push_lead_changes",), queue=Q_GA_READ),
+    # adjustment-и посилаються на вже завантажені конверсії (order_id) → після lead push
+    Stage("push_adjustment_changes", deps=("push_lead_changes",), queue=Q_GA_WRITE),
+)
+
+NIGHTLY_STAGES = (
+    Stage("pull_campaign_deltas", queue=Q_GA_READ),
+    Stage("reconcile", deps=("pull_campaign_deltas",), queue=Q_GA_READ),
+    Stage("push_campaign_changes", deps=("reconcile",), queue=Q_GA_WRITE),
+    Stage("push_lead_changes", deps=("reconcile",), queue=Q_GA_WRITE),
+    # незалежна гілка: вікно re-attribution перечитується цілком щоночі
+    Stage("pull_campaign_metrics", queue=Q_GA_READ),
+)
+
+@shared_task(bind=True, name="ads_sync.run_stage")
+def run_stage(self, _prev=None, stage=None, pipeline=None, lock=None, run_id=None, deps=()):
+    """
+    Generic DAG stage: виконує STAGE_FUNCS[stage] і повертає результати
+    попередніх стадій + свій, щоб callback chord-а бачив увесь run.
+    Поки стадія працює, heartbeat продовжує lease run lock-а.
+    Якщо залежність (deps) упала або була пропущена — стадія пропускається
+    з помилкою, тож і її залежні теж не виконуються.
+    """
+    started = djtz.now()
+    queue = (self.request.delivery_info or {}).get("routing_key", "")
+    failed = sorted({r["stage"] for r in flatten_results(_prev) if r.get("error")} & set(deps or ()))
+    with sync_runs.stage(run_id, pipeline, stage, queue=queue) as ledger:
+        if failed:
+            logger.warning("Stage %s of %s skipped: upstream %s failed", stage, pipeline, ", ".join(failed))
+            result, error = None, f"skipped: upstream stage failed: {', '.join(failed)}"
+        else:
+            try:
+                with run_lock.keep_alive(lock, run_id):
+                    result, error = STAGE_FUNCS[stage](), None
+            except Exception as e:
+                # стадія не валить сусідні гілки; помилку видно в результатах run-у
+                logger.exception("Stage %s of %s failed", stage, pipeline)
+                result, error = None, str(e)[:1000]
+        ledger.result, ledger.error = result, error
+    record = {
+        "stage": stage,
+        "started_at": started.isoformat(),
+        "finished_at": djtz.now().isoformat(),
+        "result": result,
+        "error": error,
+        "skipped": bool(failed),
+    }
+    return flatten_results(_prev) + [record]
+
+@shared_task(bind=True, name="ads_sync.record_pipeline_run")
+def record_pipeline_run(self, results, pipeline=None, lock=None, run_id=None):
+    stages = {r["stage"]: r for r in flatten_results(results)}  # одна стадія могла прийти кількома шляхами
+    for name, r in stages.items():
+        logger.info("pipeline=%s stage=%s error=%s result=%s", pipeline, name, r["error"], r["result"])
+    sync_runs.finish_run(run_id)
+    rerun = run_lock.release(lock, run_id) if lock else ""
+    if rerun:
+        # тригери, що прийшли під час run-у, злились в один повторний запуск
+        PIPELINE_TASKS[rerun].delay()
+    return {"pipeline": pipeline, "stages": stages, "rerun": rerun or None}
+
+def _start_dag(pipeline: str, stages, lock=None, run_id=None) -> str:
+    ctx = {"pipeline": pipeline, "lock": lock, "run_id": run_id}
+    canvas = build_canvas(
+        stages,
+        lambda st: run_stage.s(stage=st.name, deps=list(st.deps), **ctx),
+        record_pipeline_run.s(**ctx),
+    )
+    return canvas.apply_async().id
+
+def _customer_id() -> str:
+    return os.getenv("GOOGLE_ADS_CUSTOMER_ID") or getattr(settings, "GA_CUSTOMER_ID", "") or ""
+
+def _start_locked(task, pipeline: str, stages) -> dict:
+    """
+    Starts the DAG only if this run gets the lock. Overlapping trigger → policy:
+      skip     — нічого не робимо;
+      queue    — повторюємо тригер через RUN_LOCK_QUEUE_RETRY_SECONDS;
+      coalesce — власник lock-а перезапустить pipeline один раз після завершення.
+    """
+    name = run_lock.lock_name(RUN_LOCK_GROUPS.get(pipeline, pipeline), _customer_id())
+    run_id = task.request.id or uuid.uuid4().hex
+    if not run_lock.acquire(name, run_id, pipeline):
+        policy = RUN_LOCK_POLICIES.get(pipeline, "skip")
+        if policy == "queue":
+            raise task.retry(countdown=RUN_LOCK_QUEUE_RETRY_SECONDS, max_retries=RUN_LOCK_QUEUE_MAX_RETRIES)
+        if policy == "coalesce":
+            run_lock.request_rerun(name, pipeline)
+        logger.info("pipeline=%s lock %s busy, policy=%s", pipeline, name, policy)
+        return {"lock": name, "started": False, "policy": policy}
+    sync_runs.start_run(run_id, pipeline, _customer_id())
+    try:
+        dag_id = _start_dag(pipeline, stages, lock=name, run_id=run_id)
+    except Exception:
+        run_lock.release(name, run_id)
+        raise
+    return {"lock": name, "started": True, "dag_id": dag_id}
+
 @shared_task(bind=True, name="ads_sync.sync_google_ads_pipeline")
 def sync_google_ads_pipeline(self):
-    workflow = chain(
-        pull_campaign_deltas_task.s(),
-        push_campaign_changes_task.si(),   # immutable
-        push_lead_changes_task.si(),       # SF → GA для lead
-        pull_lead_deltas_task.si(),        # GA → SF (Platform Event)
-    )
-    res = workflow.apply_async()
-    return {"chain_id": res.id}
+    return _start_locked(self, "sync_google_ads", SYNC_STAGES)
+
+@shared_task(bind=True, name="ads_sync.reconcile")
+def reconcile_task(self, _prev=None, dry_run=False, **_):
+    return run_full_reconcile(dry_run=dry_run)
 
 @shared_task(bind=True, name="ads_sync.nightly_full_reconcile")
 def nightly_full_reconcile(self):
-    g = group([
-        pull_campaign_deltas_task.s(),
-        push_campaign_changes_task.si(),
-        push_lead_changes_task.si(),
-        pull_lead_deltas_task.si(),
-    ])
-    res = g.apply_async()
-    return {"group_id": res.id}
+    # reconcile пише PendingChange → push-и лише після нього (без гонок за таблиці)
+    return _start_locked(self, "nightly_full_reconcile", NIGHTLY_STAGES)
+
+PIPELINE_TASKS = {
+    "sync_google_ads": sync_google_ads_pipeline,
+    "nightly_full_reconcile": nightly_full_reconcile,
+}
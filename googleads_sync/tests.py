@@ -1,3 +1,485 @@
-from django.test import TestCase
+import enum
+import threading
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase
+
+from .models import PendingChange, SalesforceEvent
+from .salesforce import cdc
+from .services import ingest, queue, reprocess
+from .services.lanes import LaneError, OrderedLanes
+from .services.mappers import CAMPAIGN, CLICK_CONVERSION, to_dt
+
+T0 = datetime(2025, 3, 1, 12, 0, tzinfo=timezone.utc)
+T0_MS = int(T0.timestamp() * 1000)
+
+
+def cdc_payload(entity, change_type, record_id="00Q000000000001AAA", changed=(), **fields):
+    return {
+        **fields,
+        "ChangeEventHeader": {
+            "entityName": entity,
+            "changeType": change_type,
+            "recordIds": [record_id],
+            "changedFields": list(changed),
+            "commitTimestamp": T0_MS,
+        },
+    }
+
+
+class CampaignActionTests(SimpleTestCase):
+    def action(self, change_type, changed=(), **fields):
+        changes = cdc.to_pending_changes(cdc_payload("Campaign", change_type, "701000000000001AAA", changed, **fields))
+        return [(c.resource, c.action) for c in changes]
+
+    def test_create(self):
+        self.assertEqual(self.action("CREATE", Name="Spring"), [("campaign", "create")])
+
+    def test_status_change_pauses_or_enables(self):
+        self.assertEqual(self.action("UPDATE", ["Status"], Status="Paused"), [("campaign", "pause")])
+        self.assertEqual(self.action("UPDATE", ["Status"], Status="ENABLED"), [("campaign", "enable")])
+
+    def test_status_present_but_not_changed_is_update(self):
+        self.assertEqual(self.action("UPDATE", ["Name"], Name="X", Status="PAUSED"), [("campaign", "update")])
+
+    def test_other_status_is_update(self):
+        self.assertEqual(self.action("UPDATE", ["Status"], Status="Planned"), [("campaign", "update")])
+
+    def test_delete_removes(self):
+        self.assertEqual(self.action("DELETE"), [("campaign", "remove")])
+
+    def test_undelete_is_ignored(self):
+        self.assertEqual(self.action("UNDELETE"), [])
+
+
+class LeadActionTests(SimpleTestCase):
+    def test_actions(self):
+        for change_type, action in (("CREATE", "create"), ("UPDATE", "update"), ("DELETE", "remove")):
+            [change] = cdc.to_pending_changes(cdc_payload("Lead", change_type, Email="a@example.com"))
+            self.assertEqual((change.resource, change.action), ("lead", action))
+
+    def test_gap_events_are_ignored(self):
+        self.assertEqual(cdc.to_pending_changes(cdc_payload("Lead", "GAP_UPDATE")), [])
+
+
+class OpportunityActionTests(SimpleTestCase):
+    def action(self, change_type, changed=(), **fields):
+        return cdc.opportunity_action(cdc_payload("Opportunity", change_type, "006000000000001AAA", changed, **fields))
+
+    def test_amount_change_restates(self):
+        self.assertEqual(self.action("UPDATE", ["Amount"], Amount=1500), "restate")
+
+    def test_cleared_amount_is_ignored(self):
+        self.assertIsNone(self.action("UPDATE", ["Amount"], Amount=None))
+
+    def test_lost_stage_retracts(self):
+        self.assertEqual(self.action("UPDATE", ["StageName"], StageName="Closed Lost"), "retract")
+        self.assertEqual(self.action("UPDATE", ["StageName", "Amount"], StageName=" closed lost ", Amount=10), "retract")
+
+    def test_delete_retracts(self):
+        self.assertEqual(self.action("DELETE"), "retract")
+
+    def test_unrelated_change_is_ignored(self):
+        self.assertIsNone(self.action("UPDATE", ["Description"], Description="x", Amount=10))
+        self.assertIsNone(self.action("UNDELETE"))
+
+    def test_snapshot_without_changed_fields_uses_all_fields(self):
+        payload = cdc.from_record({"Id": "006000000000001AAA", "Amount": 10, "StageName": "Prospecting"}, "Opportunity")
+        self.assertEqual(cdc.opportunity_action(payload), "restate")
+        [change] = cdc.to_pending_changes(payload)
+        self.assertEqual((change.resource, change.action), ("opportunity", "restate"))
+
+
+class FromRecordTests(SimpleTestCase):
+    def test_created_snapshot(self):
+        payload = cdc.from_record({
+            "attributes": {"type": "Lead"},
+            "Id": "00Q000000000001AAA",
+            "Email": "a@example.com",
+            "CreatedDate": "2025-03-01T12:00:00.000Z",
+            "LastModifiedDate": "2025-03-01T12:00:00.000Z",
+        })
+        self.assertNotIn("attributes", payload)
+        self.assertEqual(payload["Email"], "a@example.com")
+        self.assertEqual(payload["ChangeEventHeader"], {
+            "entityName": "Lead",
+            "changeType": "CREATE",
+            "recordIds": ["00Q000000000001AAA"],
+            "changedFields": [],
+            "commitTimestamp": T0_MS,
+        })
+
+    def test_modified_snapshot_is_update(self):
+        payload = cdc.from_record({
+            "Id": "00Q000000000001AAA",
+            "CreatedDate": "2025-03-01T11:00:00.000Z",
+            "LastModifiedDate": "2025-03-01T12:00:00.000Z",
+        }, "Lead")
+        self.assertEqual(payload["ChangeEventHeader"]["changeType"], "UPDATE")
+        self.assertEqual(cdc.commit_time(payload), T0)
+
+    def test_explicit_change_type(self):
+        payload = cdc.from_record({"Id": "00Q000000000001AAA"}, "Lead", change_type="delete")
+        self.assertEqual(payload["ChangeEventHeader"]["changeType"], "DELETE")
+        self.assertIsNone(payload["ChangeEventHeader"]["commitTimestamp"])
+
+
+class ToPendingChangesTests(SimpleTestCase):
+    def test_change_fields(self):
+        payload = cdc_payload("Lead", "CREATE", Email="a@example.com")
+        [change] = cdc.to_pending_changes(payload, received_at=T0 + timedelta(seconds=2))
+        self.assertEqual(change.status, "pending")
+        self.assertIs(change.payload, payload)
+        self.assertEqual(change.source_commit_at, T0)
+        self.assertEqual(change.source_received_at, T0 + timedelta(seconds=2))
+        self.assertEqual(change.priority, PendingChange.priority_for("lead", "create"))
+        self.assertEqual(change.key_hash, PendingChange(payload=payload).assign_key().key_hash)
+
+    def test_explicit_commit_at_wins(self):
+        [change] = cdc.to_pending_changes(cdc_payload("Lead", "UPDATE"), commit_at=T0 - timedelta(hours=1))
+        self.assertEqual(change.source_commit_at, T0 - timedelta(hours=1))
+
+    def test_platform_event_without_header(self):
+        self.assertEqual(cdc.to_pending_changes({"Id": "e1", "CreatedDate": T0_MS}), [])
+
+    def test_unknown_entity(self):
+        self.assertEqual(cdc.to_pending_changes(cdc_payload("Account", "CREATE")), [])
+
+
+class ReprocessDiffTests(TestCase):
+    def event(self, payload, received_at=T0):
+        return SalesforceEvent.objects.create(
+            object_name="/data/LeadChangeEvent",
+            sf_id=cdc.record_id(payload),
+            payload=payload,
+            received_at=received_at,
+            commit_at=cdc.commit_time(payload),
+        )
+
+    def existing(self, event, **overrides):
+        [change] = cdc.to_pending_changes(event.payload, event.received_at, event.commit_at)
+        change.source_event_id = event.pk
+        for name, value in overrides.items():
+            setattr(change, name, value)
+        change.save()
+        return change
+
+    def run_dry(self):
+        return reprocess.Reprocessor(since=T0 - timedelta(minutes=1), workers=1, dry_run=True).run()
+
+    def test_same_flush_updates_of_one_record_are_distinct(self):
+        # два UPDATE одного Lead в одному flush-і: спільний received_at
+        first = self.event(cdc_payload("Lead", "UPDATE", changed=["Email"], Email="a@example.com"))
+        self.event(cdc_payload("Lead", "UPDATE", changed=["Phone"], Phone="+380000000000"))
+        self.existing(first)
+
+        res = self.run_dry()
+
+        self.assertEqual(res.events, 2)
+        self.assertEqual(res.derived["lead.update"], 2)
+        self.assertEqual(res.added["lead.update"], 1)
+        self.assertEqual(res.stale["lead.update"], 0)
+        self.assertEqual(PendingChange.objects.count(), 1)  # dry_run нічого не пише
+
+    def test_stale_rows_are_reported(self):
+        event = self.event(cdc_payload("Lead", "UPDATE", Email="a@example.com"))
+        self.existing(event, action="create")
+
+        res = self.run_dry()
+
+        self.assertEqual(res.added["lead.update"], 1)
+        self.assertEqual(res.stale["lead.create"], 1)
+
+    def test_rows_without_source_event_match_by_count(self):
+        first = self.event(cdc_payload("Lead", "UPDATE", Email="a@example.com"))
+        second = self.event(cdc_payload("Lead", "UPDATE", Phone="+380000000000"))
+        self.existing(first, source_event_id=None)
+
+        res = self.run_dry()
+        self.assertEqual(res.added["lead.update"], 1)
+        self.assertEqual(res.stale["lead.update"], 0)
+
+        self.existing(second, source_event_id=None)
+        res = self.run_dry()
+        self.assertEqual(res.added["lead.update"], 0)
+
+    def test_writes_missing_changes_with_source_event(self):
+        event = self.event(cdc_payload("Lead", "CREATE", Email="a@example.com"))
+
+        res = reprocess.Reprocessor(since=T0 - timedelta(minutes=1), workers=1).run()
+
+        self.assertEqual(res.added["lead.create"], 1)
+        change = PendingChange.objects.get()
+        self.assertEqual(change.source_event_id, event.pk)
+        self.assertEqual(change.source_received_at, T0)
+
+    def test_topic_filter_ignores_other_topics(self):
+        lead = self.event(cdc_payload("Lead", "UPDATE", Email="a@example.com"))
+        campaign = self.event(cdc_payload("Campaign", "UPDATE", "701000000000001AAA", Name="Spring"))
+        SalesforceEvent.objects.filter(pk=campaign.pk).update(object_name="/data/CampaignChangeEvent")
+        self.existing(lead)
+        self.existing(campaign)
+
+        res = reprocess.Reprocessor(topics=["/data/LeadChangeEvent"], workers=1, dry_run=True).run()
+
+        self.assertEqual(res.events, 1)
+        self.assertEqual(res.added["lead.update"], 0)
+        self.assertEqual(sum(res.stale.values()), 0)  # campaign.update з іншого topic-у — не stale
+
+
+class _CampaignStatus(enum.IntEnum):
+    UNSPECIFIED = 0
+    ENABLED = 2
+    PAUSED = 3
+    REMOVED = 4
+
+
+class _Channel(enum.IntEnum):
+    SEARCH = 2
+
+
+class _FakeAdsClient:
+    """get_type(...) для Writer-а: лише enum-и, як у proto-plus (IntEnum)."""
+
+    def get_type(self, name):
+        return {"CampaignStatusEnum": SimpleNamespace(CampaignStatus=_CampaignStatus)}[name]
+
+
+def campaign_row(**overrides):
+    fields = dict(
+        resource_name="customers/1/campaigns/42",
+        id=42,
+        name="Spring",
+        status=_CampaignStatus.PAUSED,
+        advertising_channel_type=_Channel.SEARCH,
+        start_date="2025-01-01",
+        end_date="",
+        last_modified_time="2025-03-01T12:00:00Z",
+    )
+    fields.update(overrides)
+    return SimpleNamespace(campaign=SimpleNamespace(**fields))
+
+
+class CampaignReaderTests(SimpleTestCase):
+    def legacy_row_to_dict(self, row):
+        # hand-written mapper, який замінив CAMPAIGN.reader() (без budget_micros: GAQL його не вибирає)
+        c = row.campaign
+        return {
+            "resource_name": c.resource_name,
+            "campaign_id": int(c.id),
+            "name": c.name,
+            "status": c.status.name if hasattr(c.status, "name") else str(c.status),
+            "advertising_channel_type": c.advertising_channel_type.name if hasattr(c.advertising_channel_type, "name") else str(c.advertising_channel_type),
+            "start_date": str(c.start_date) or None,
+            "end_date": str(c.end_date) or None,
+            "external_updated_at": to_dt(getattr(c, "last_modified_time", None)),
+        }
+
+    def test_matches_legacy_mapper(self):
+        read = CAMPAIGN.reader()
+        for row in (campaign_row(), campaign_row(status=_CampaignStatus.ENABLED, end_date="2025-12-31"), campaign_row(status=7)):
+            self.assertEqual(read(row), self.legacy_row_to_dict(row))
+
+    def test_missing_optional_field(self):
+        row = campaign_row()
+        del row.campaign.last_modified_time
+        data = CAMPAIGN.reader()(row)
+        self.assertIsNone(data["external_updated_at"])
+        self.assertEqual(data, self.legacy_row_to_dict(row))
+
+    def test_reader_is_compiled_once(self):
+        self.assertIs(CAMPAIGN.reader(), CAMPAIGN.reader())
+
+
+class WriterTests(SimpleTestCase):
+    def payload(self, changed, **fields):
+        return {**fields, "ChangeEventHeader": {"changeType": "UPDATE", "changedFields": changed}}
+
+    def test_values_use_changed_fields(self):
+        payload = self.payload(["Name", "LastModifiedDate", "OwnerId"], Name="Spring", Status="Paused",
+                               OwnerId="005000000000001AAA", LastModifiedDate=T0_MS)
+        self.assertEqual(CAMPAIGN.writer().values(payload), {"name": "Spring"})
+
+    def test_values_all_fields(self):
+        payload = self.payload(["Name"], Name="Spring", Status="Paused", Description="x")
+        self.assertEqual(CAMPAIGN.writer().values(payload, changed_only=False),
+                         {"name": "Spring", "status": "Paused"})
+
+    def test_values_from_our_keys(self):
+        payload = {"fields": {"name": "Spring", "campaign_id": 1, "bogus": 2}}
+        self.assertEqual(CAMPAIGN.writer().values(payload), {"name": "Spring"})  # campaign_id не writable
+
+    def test_apply_converts_enums_and_returns_mask(self):
+        writer = CAMPAIGN.writer(_FakeAdsClient())
+        campaign = SimpleNamespace()
+        payload = self.payload(["Name", "Status", "StartDate", "OwnerId"], Name=" Spring ", Status="paused",
+                               StartDate=20089, OwnerId="005000000000001AAA")
+        mask = writer.apply_payload(campaign, payload)
+        self.assertEqual(mask, ["name", "status", "start_date"])
+        self.assertEqual(campaign.name, "Spring")
+        self.assertIs(campaign.status, _CampaignStatus.PAUSED)
+        self.assertEqual(campaign.start_date, "2025-01-01")
+        self.assertFalse(hasattr(campaign, "OwnerId"))
+
+    def test_unmappable_values_are_skipped(self):
+        # SF-статус без відповідника в GA і порожнє ім'я не потрапляють ні в proto, ні в mask
+        campaign = SimpleNamespace()
+        mask = CAMPAIGN.writer(_FakeAdsClient()).apply_payload(
+            campaign, self.payload(["Name", "Status"], Name="  ", Status="Planned"))
+        self.assertEqual(mask, [])
+        self.assertEqual(vars(campaign), {})
+
+    def test_writer_cached_per_client(self):
+        client = _FakeAdsClient()
+        self.assertIs(CAMPAIGN.writer(client), CAMPAIGN.writer(client))
+        self.assertIsNot(CAMPAIGN.writer(client), CAMPAIGN.writer())
+
+
+class ClickConversionWriterTests(SimpleTestCase):
+    def values(self, **payload):
+        return CLICK_CONVERSION.writer().values(payload, changed_only=False)
+
+    def test_order_id_falls_back_to_external_id(self):
+        self.assertEqual(self.values(gclid="abc", external_id="00Q1")["order_id"], "00Q1")
+        self.assertEqual(self.values(gclid="abc", order_id="", external_id="00Q1")["order_id"], "00Q1")
+
+    def test_order_id_wins_over_external_id(self):
+        self.assertEqual(self.values(external_id="00Q1", order_id="ord-1")["order_id"], "ord-1")
+
+    def test_apply(self):
+        conversion = SimpleNamespace()
+        writer = CLICK_CONVERSION.writer()
+        mask = writer.apply(conversion, self.values(
+            gclid="abc", conversion_time="2025-03-01T12:00:00.000+0000", conversion_value="10.5", external_id=42))
+        self.assertEqual(mask, ["gclid", "conversion_date_time", "conversion_value", "order_id"])
+        self.assertEqual(conversion.conversion_date_time, "2025-03-01 12:00:00+00:00")
+        self.assertEqual(conversion.conversion_value, 10.5)
+        self.assertEqual(conversion.order_id, "42")
+
+    def test_conversion_time_formats(self):
+        writer = CLICK_CONVERSION.writer()
+        for sf_value, ga_value in (
+            ("2025-03-01T12:00:00.000+0000", "2025-03-01 12:00:00+00:00"),
+            ("2025-03-01T12:00:00Z", "2025-03-01 12:00:00+00:00"),
+            ("2025-03-01T12:00:00+00:00", "2025-03-01 12:00:00+00:00"),
+            ("2025-03-01T14:00:00.000+0200", "2025-03-01 14:00:00+02:00"),
+            ("2025-03-01 12:00:00+00:00", "2025-03-01 12:00:00+00:00"),  # вже формат GA
+        ):
+            with self.subTest(sf_value=sf_value):
+                conversion = SimpleNamespace()
+                writer.apply(conversion, {"conversion_date_time": sf_value})
+                self.assertEqual(conversion.conversion_date_time, ga_value)
+
+    def test_invalid_conversion_time_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            CLICK_CONVERSION.writer().apply(SimpleNamespace(), {"conversion_date_time": "2025-03-01Tnoon"})
+
+
+class OrderedLanesTests(SimpleTestCase):
+    def setUp(self):
+        self.lanes = OrderedLanes(2, name="test-lane")
+
+    def tearDown(self):
+        try:
+            self.lanes.close()
+        except LaneError:
+            pass
+
+    def barrier(self, lane):
+        """Задача без seqs у кінці lane: коли вона виконалась, попередні вже позначені done."""
+        reached = threading.Event()
+        self.lanes.submit_to(lane, [], reached.set)
+        self.assertTrue(reached.wait(5))
+
+    def test_watermark_waits_for_earlier_seqs(self):
+        release = threading.Event()
+        self.lanes.submit_to(0, [0, 1], release.wait, 5)
+        self.lanes.submit_to(1, [2, 3], lambda: None)
+        self.barrier(1)
+        self.assertIsNone(self.lanes.watermark())  # 2, 3 готові, але 0, 1 ще ні
+
+        release.set()
+        self.barrier(0)
+        self.assertEqual(self.lanes.watermark(), 3)
+
+    def test_watermark_is_monotonic_across_batches(self):
+        self.lanes.submit_to(1, [0], lambda: None)
+        self.barrier(1)
+        self.assertEqual(self.lanes.watermark(), 0)
+        release = threading.Event()
+        self.lanes.submit_to(0, [1], release.wait, 5)
+        self.lanes.submit_to(1, [2], lambda: None)
+        self.barrier(1)
+        self.assertEqual(self.lanes.watermark(), 0)
+        release.set()
+        self.barrier(0)
+        self.assertEqual(self.lanes.watermark(), 2)
+
+    def test_lane_error_stops_watermark(self):
+        failed = threading.Event()
+
+        def fail():
+            failed.set()
+            raise ValueError("boom")
+
+        self.lanes.submit_to(0, [0], lambda: None)
+        self.barrier(0)
+        self.lanes.submit_to(1, [1], fail)
+        self.assertTrue(failed.wait(5))
+        with self.assertRaises(LaneError):
+            self.lanes.close()
+        self.assertEqual(self.lanes.watermark(), 0)  # 1 не записано — checkpoint не переступає його
+        with self.assertRaises(LaneError):
+            self.lanes.submit_to(0, [2], lambda: None)
+
+
+class ClaimBatchTests(TestCase):
+    def change(self, record_id, action="update"):
+        ch = PendingChange(resource="campaign", action=action, payload={"Id": record_id})
+        ch.save()
+        return ch
+
+    def claimed(self, owner="w1"):
+        return [ch.id for ch in queue.claim_batch("campaign", 10, owner)]
+
+    def test_claims_only_head_of_each_key(self):
+        first = self.change("701A")
+        second = self.change("701A", "pause")
+        other = self.change("701B")
+
+        self.assertEqual(sorted(self.claimed()), sorted([first.id, other.id]))
+        # голова ключа в роботі — наступна зміна того ж запису чекає
+        self.assertEqual(self.claimed("w2"), [])
+
+        queue.mark_done([first.id], "w1")
+        self.assertEqual(self.claimed("w2"), [second.id])
+
+    def test_failed_head_blocks_until_retried(self):
+        first = self.change("701A")
+        second = self.change("701A", "pause")
+        self.assertEqual(self.claimed(), [first.id])
+
+        queue.mark_failed([first.id], "temporary", "w1", retry=True)
+        # голова чекає retry (next_attempt_at у майбутньому) — друга зміна не обганяє її
+        self.assertEqual(self.claimed("w2"), [])
+        PendingChange.objects.filter(id=first.id).update(next_attempt_at=T0)
+        self.assertEqual(self.claimed("w2"), [first.id])
+        queue.mark_done([first.id], "w2")
+        self.assertEqual(self.claimed("w3"), [second.id])
+
+
+class IngestParseTests(SimpleTestCase):
+    def test_non_object_records_are_rejected(self):
+        for body in (b"1", b'"x"', b"[1]", b'["x"]', b"[[]]", b'{"records": [{"Id": "00Q1"}, 2]}'):
+            with self.subTest(body=body), self.assertRaises(ValueError):
+                ingest.parse_json(body, "Lead")
+
+    def test_non_object_ndjson_line_is_rejected(self):
+        with self.assertRaises(ValueError):
+            list(ingest.parse_ndjson([b'{"Id": "00Q1"}\n', b"[]\n"], "Lead"))
+
+    def test_records_become_cdc_payloads(self):
+        [payload] = ingest.parse_json(b'{"records": [{"attributes": {"type": "Lead"}, "Id": "00Q1"}]}')
+        self.assertEqual(payload["ChangeEventHeader"]["entityName"], "Lead")
+        self.assertEqual(payload["ChangeEventHeader"]["recordIds"], ["00Q1"])
@@ -0,0 +1,10 @@
+from django.urls import path
+
+from . import views
+
+app_name = "googleads_sync"
+
+urlpatterns = [
+    path("ingest/outbound/", views.outbound_message, name="ingest-outbound"),
+    path("ingest/webhook/", views.webhook, name="ingest-webhook"),
+]
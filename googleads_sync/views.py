@@ -1,3 +1,89 @@
-from django.shortcuts import render
+# googleads_sync/views.py
+"""
+Async ingest endpoints (ASGI): Salesforce Outbound Messages і JSON/NDJSON webhooks.
 
-# Create your views here.
+Запит лише парситься і кладеться в services.ingest.IngestBuffer; у БД пише
+спільний batch-flush, тож під навантаженням сотні запитів ділять один INSERT.
+Автентифікація: INGEST_TOKEN (?token= або X-Ingest-Token — Outbound Message
+не вміє власні заголовки, тож токен іде в endpoint URL) + для SOAP
+опційно INGEST_ALLOWED_ORG_IDS.
+"""
+import hmac
+import logging
+
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from .services import ingest
+
+logger = logging.getLogger(__name__)
+
+INGEST_TOKEN = getattr(settings, "INGEST_TOKEN", "") or ""
+ALLOWED_ORG_IDS = {o[:15] for o in getattr(settings, "INGEST_ALLOWED_ORG_IDS", ()) if o}
+
+
+def _authorized(request) -> bool:
+    # без токена endpoint закритий: відкритий ingest = будь-хто пише в PendingChange
+    token = request.GET.get("token") or request.headers.get("X-Ingest-Token") or ""
+    return bool(INGEST_TOKEN) and hmac.compare_digest(token.encode(), INGEST_TOKEN.encode())
+
+
+def _soap(ack: bool, status: int = 200) -> HttpResponse:
+    return HttpResponse(
+        ingest.OUTBOUND_ACK.format(ack="true" if ack else "false"),
+        content_type="text/xml; charset=utf-8",
+        status=status,
+    )
+
+
+@csrf_exempt
+@require_POST
+async def outbound_message(request):
+    """Salesforce Outbound Message (SOAP). Ack=true лише після постановки (і, за DURABLE_ACK, коміту)."""
+    if not _authorized(request):
+        return HttpResponse(status=403)
+    try:
+        org_id, payloads = ingest.parse_outbound_message(ingest.read_chunks(request))
+    except Exception as e:
+        logger.warning("outbound message: bad SOAP body: %s", e)
+        return _soap(False, status=400)
+    if ALLOWED_ORG_IDS and org_id[:15] not in ALLOWED_ORG_IDS:
+        return HttpResponse(status=403)
+    try:
+        await ingest.enqueue("outbound", payloads)
+    except ingest.IngestOverloaded:
+        return _soap(False, status=503)  # SF повторить доставку з backoff
+    except Exception:
+        logger.exception("outbound message: enqueue failed")
+        return _soap(False, status=503)
+    return _soap(True)
+
+
+@csrf_exempt
+@require_POST
+async def webhook(request):
+    """
+    Flow / Apex HTTP callout. application/x-ndjson — по рядку на запис;
+    інакше JSON (обʼєкт, масив або {"records": [...]}). ?object=Lead — тип для
+    записів без attributes.type.
+    """
+    if not _authorized(request):
+        return HttpResponse(status=403)
+    entity = request.GET.get("object") or None
+    try:
+        if request.content_type == "application/x-ndjson":
+            payloads = list(ingest.parse_ndjson(ingest.read_chunks(request), entity))
+        else:
+            payloads = ingest.parse_json(request.read(), entity)
+    except ValueError as e:  # json.JSONDecodeError — теж ValueError
+        return JsonResponse({"error": str(e)}, status=400)
+    try:
+        accepted = await ingest.enqueue("webhook", payloads)
+    except ingest.IngestOverloaded as e:
+        return JsonResponse({"error": str(e)}, status=503, headers={"Retry-After": "1"})
+    except Exception:
+        logger.exception("webhook: enqueue failed")
+        return JsonResponse({"error": "enqueue failed"}, status=503)
+    return JsonResponse({"accepted": accepted}, status=202)